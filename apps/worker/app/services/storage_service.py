@@ -1,4 +1,5 @@
 import boto3
+
 from app.core.config import settings
 from app.core.logging import get_logger
 
@@ -36,3 +37,28 @@ def get_bytes(key: str) -> bytes:
     c = s3_client()
     obj = c.get_object(Bucket=settings.s3_bucket, Key=key)
     return obj["Body"].read()
+
+
+class S3CacheTier:
+    """Tầng cache trên MinIO/S3 (key = prefix + key cache) cho cache của ocr_core (get/put
+    bytes)."""
+
+    def __init__(self, prefix: str, content_type: str = "application/json"):
+        self.prefix = prefix
+        self.content_type = content_type
+        self._client = s3_client()
+
+    def get(self, key: str) -> bytes | None:
+        try:
+            obj = self._client.get_object(Bucket=settings.s3_bucket, Key=self.prefix + key)
+        except self._client.exceptions.NoSuchKey:
+            return None
+        return obj["Body"].read()
+
+    def put(self, key: str, data: bytes) -> None:
+        self._client.put_object(
+            Bucket=settings.s3_bucket,
+            Key=self.prefix + key,
+            Body=data,
+            ContentType=self.content_type,
+        )
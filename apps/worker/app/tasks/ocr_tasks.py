@@ -2,57 +2,219 @@
 OCR tasks: hai bước tách rời.
 
 1) run_job (Detect):
-   - Chạy CRAFT detect_text_boxes theo từng trang.
+   - Chạy CRAFT detect_text_boxes_batch cho cả tài liệu (nhiều trang mỗi forward); trang PDF
+     born-digital lấy box từ lớp text PDF, không chạy CRAFT.
    - Lưu kết quả vào CSDL (detect_result) và MinIO (detect.json).
    - Cập nhật status = DETECT_DONE. Frontend có thể chỉnh sửa boxes rồi PATCH detect_result.
 
 2) run_ocr_job (Recognize theo vùng đã lưu):
    - Đọc detect_result từ CSDL (vùng đã detect, có thể đã chỉnh sửa).
-   - Gọi run_ocr_with_boxes → preprocess ảnh, recognize bằng VietOCR, postprocess.
+   - Gọi run_ocr_with_boxes → preprocess ảnh, recognize bằng VietOCR, postprocess. Box nằm trên lớp
+     text PDF lấy text thẳng từ PDF (result ghi source theo trang/block).
    - Lưu kết quả OCR lên MinIO và cập nhật job DONE.
 
-Luồng: Detect → lưu CSDL → (chỉnh sửa boxes qua API, lưu lại CSDL) → run_ocr_job đọc CSDL → VietOCR theo từng vùng.
+Trang render ở bước Detect được giữ trong page cache local (ocr_core.infra.page_cache, theo checksum
+input) để run_ocr_job / chạy lại Detect đọc lại ngay, không tải input từ MinIO và render lại.
+
+Tài liệu dài (>= worker.shard_min_pages, worker.shard_pages > 0): run_job / run_detect_job /
+run_ocr_job chỉ chia đoạn trang rồi fan-out bằng chord — group các task detect_shard / ocr_shard
+(mỗi task một đoạn trang, chạy trên worker bất kỳ) → reducer detect_reduce / ocr_reduce ghép kết quả
+theo thứ tự trang và lưu như chế độ một task.
+
+Luồng: Detect → lưu CSDL → (chỉnh sửa boxes qua API, lưu lại CSDL) → run_ocr_job đọc CSDL → VietOCR
+theo từng vùng.
 """
 from __future__ import annotations
-import io
+
 import json
 import time
-from celery import shared_task
-from PIL import Image
+from collections.abc import Callable, Iterable, Iterator
+
+from celery import chord, group, shared_task
+from ocr_core.config_loader import get_system_config
+from ocr_core.domain.models import OcrPage, OcrResult
+from ocr_core.infra.detection_cache import get_detection_cache
+from ocr_core.infra.page_cache import cached_pages, get_page_cache
+from ocr_core.pipeline.detect import detect_input_side, detect_text_boxes_batch
+from ocr_core.pipeline.orchestrator import run_ocr_with_boxes
+from ocr_core.pipeline.preprocess import is_blank_page, preprocess_side
+from ocr_core.pipeline.rasterize import RasterPage, chunked, count_pages, page_stream_params
 
 from app.core.logging import get_logger
 from app.services.db_service import get_job, update_job
 from app.services.storage_service import get_bytes, put_bytes
 
-from ocr_core.domain.models import OcrResult, OcrPage
-from ocr_core.pipeline.detect import detect_text_boxes
-from ocr_core.pipeline.orchestrator import run_ocr, run_ocr_with_boxes
-
 logger = get_logger(__name__)
 
 
-def _raw_to_pages(raw: bytes, content_type: str | None, filename: str | None) -> list[Image.Image]:
-    """Chuyển raw bytes thành danh sách ảnh (1 ảnh nếu image, nhiều ảnh nếu PDF)."""
+def _input_loader(job: dict) -> Callable[[], bytes]:
+    """Hàm tải input từ MinIO (một lần, chỉ khi cần — trang đủ trong page cache thì không tải)."""
+    state: dict = {}
+
+    def load() -> bytes:
+        if "raw" not in state:
+            logger.info(f"[OCR] Lấy input: key={job['input_object_key']}")
+            state["raw"] = get_bytes(job["input_object_key"])
+            logger.info(f"[OCR] Input đã tải: size={len(state['raw'])} bytes")
+        return state["raw"]
+
+    return load
+
+
+def _render_side(stage_side: int | None) -> int | None:
+    """Cạnh dài render. Bật page cache: Detect và OCR render chung một kích thước (lớn hơn của hai
+    bước, mỗi bước tự thu nhỏ) để bước sau đọc lại trang đã render từ cache; tắt: đúng kích thước
+    bước cần."""
+    if get_page_cache() is None:
+        return stage_side
+    sides = (detect_input_side(), preprocess_side())
+    return None if None in sides else max(sides)
+
+
+def _page_stream(
+    job: dict, target_side: int | None = None, start: int = 0, stop: int | None = None,
+) -> tuple[int, Iterator[RasterPage]]:
+    """Input của job → (số trang tài liệu, luồng trang [start, stop)) — 1 trang nếu image, nhiều
+    trang nếu PDF. PDF được render lười từng trang ở cạnh dài target_side (kích thước bước
+    detect/recognize cần) với look-ahead page_stream.lookahead trang; tọa độ tham chiếu
+    (detect_result) giữ như render 150 dpi — xem ocr_core.pipeline.rasterize. Bộ nhớ đỉnh theo
+    look-ahead/cửa sổ, không theo số trang. Trang đã render ở bước trước (page cache theo checksum
+    input) được đọc lại, không tải input/render lại."""
     is_pdf = (
-        (content_type or "").lower() == "application/pdf"
-        or (filename or "").lower().endswith(".pdf")
+        (job.get("content_type") or "").lower() == "application/pdf"
+        or (job.get("original_filename") or "").lower().endswith(".pdf")
     )
+    load_raw = _input_loader(job)
+    side = _render_side(target_side)
+    checksum = job.get("checksum")
+    page_count = job.get("page_count") if checksum and get_page_cache() is not None else None
+    if not page_count:
+        page_count = count_pages(load_raw(), is_pdf)
     if is_pdf:
-        import fitz
-        doc = fitz.open(stream=raw, filetype="pdf")
-        pages = []
-        try:
-            for i in range(len(doc)):
-                page = doc[i]
-                pix = page.get_pixmap(dpi=150)
-                img = Image.frombytes("RGB", [pix.width, pix.height], pix.samples)
-                pages.append(img)
-            logger.info("[OCR] PDF đã chuyển thành %s trang ảnh", len(pages))
-        finally:
-            doc.close()
-        return pages
-    img = Image.open(io.BytesIO(raw)).convert("RGB")
-    return [img]
+        logger.info(
+            f"[OCR] PDF {page_count} trang, render theo luồng trang "
+            f"{start}-{(stop or page_count) - 1} "
+            f"(cạnh dài <= {side or 'dpi tham chiếu'}, look-ahead {page_stream_params()[0]} trang)"
+        )
+    return page_count, cached_pages(checksum, page_count, side, load_raw, is_pdf, start, stop)
+
+
+def _log_page_cache() -> None:
+    cache = get_page_cache()
+    if cache is not None:
+        logger.info(f"[OCR] Page cache: {cache.stats()}")
+
+
+def _detect_window(pages: list[RasterPage]) -> tuple[list[list], list[bool], list[bool]]:
+    """Detect một cửa sổ trang → (boxes theo tọa độ tham chiếu, cờ trang lớp text PDF, cờ trang
+    trắng)."""
+    from_text = [p.text_layer is not None for p in pages]
+    blank = [not t and is_blank_page(p.image) for p, t in zip(pages, from_text)]
+    todo = [i for i in range(len(pages)) if not blank[i] and not from_text[i]]
+    all_boxes: list[list] = [[] for _ in pages]
+    for i, p in enumerate(pages):
+        if from_text[i]:
+            all_boxes[i] = [box for box, _ in p.text_layer.lines]
+    if todo:
+        found = detect_text_boxes_batch([pages[i].image for i in todo], skip_blank=False)
+        for i, boxes in zip(todo, found):
+            # Box trên ảnh render (có thể nhỏ hơn) → tọa độ tham chiếu của detect_result
+            all_boxes[i] = pages[i].to_reference(boxes)
+    return all_boxes, from_text, blank
+
+
+def _detect_pages(pages: Iterable[RasterPage]) -> tuple[list[dict], int]:
+    """Detect cho mọi trang (luồng, theo cửa sổ page_stream.window trang) → (danh sách page dict cho
+    detect_result, số trang trắng bỏ qua). Chỉ box + kích thước được giữ lại, ảnh trang giải phóng
+    sau mỗi cửa sổ.
+    - Trang PDF có lớp text (RasterPage.text_layer): box = dòng text PDF, "source": "text_layer",
+      không gọi model.
+    - Trang trắng (is_blank_page): boxes rỗng, "blank": true, không gọi model.
+    - Còn lại: CRAFT detect_text_boxes_batch (batch nhiều trang/forward), "source": "ocr"."""
+    t0 = time.perf_counter()
+    _, window = page_stream_params()
+    detect_pages = []
+    n_text = n_blank = n_boxes = 0
+    for chunk in chunked(pages, window):
+        all_boxes, from_text, blank = _detect_window(chunk)
+        for p, boxes, is_text, is_blank in zip(chunk, all_boxes, from_text, blank):
+            w, h = p.ref_size
+            page = {
+                "page_index": p.index,
+                "width": w,
+                "height": h,
+                "source": "text_layer" if is_text else "ocr",
+                "boxes": [{"x1": x1, "y1": y1, "x2": x2, "y2": y2} for (x1, y1, x2, y2) in boxes],
+            }
+            if is_blank:
+                page["blank"] = True
+            detect_pages.append(page)
+        n_text += sum(from_text)
+        n_blank += sum(blank)
+        n_boxes += sum(len(b) for b in all_boxes)
+    logger.info(
+        f"[OCR] Detect {len(detect_pages)} trang (CRAFT {len(detect_pages) - n_text - n_blank}, "
+        f"lớp text PDF {n_text}, bỏ qua {n_blank} trang trắng): {n_boxes} vùng, "
+        f"thời gian={time.perf_counter() - t0:.3f}s"
+    )
+    cache = get_detection_cache()
+    if cache is not None and len(detect_pages) > n_text + n_blank:
+        logger.info(f"[OCR] Detection cache: {cache.stats()}")
+    return detect_pages, n_blank
+
+
+SHARD_PAGES = 0
+SHARD_MIN_PAGES = 40
+
+
+def _shards(page_count: int) -> list[tuple[int, int]] | None:
+    """Chia tài liệu thành các đoạn trang [start, stop) cho chế độ fan-out (worker.shard_pages trang
+    mỗi task); None nếu tắt (shard_pages = 0) hoặc tài liệu ngắn hơn worker.shard_min_pages."""
+    wcfg = get_system_config().worker
+    size = SHARD_PAGES if wcfg.shard_pages is None else wcfg.shard_pages
+    min_pages = wcfg.shard_min_pages or SHARD_MIN_PAGES
+    if size <= 0 or page_count < max(min_pages, 2) or page_count <= size:
+        return None
+    return [(start, min(start + size, page_count)) for start in range(0, page_count, size)]
+
+
+def _save_detect(job: dict, detect_pages: list[dict]) -> None:
+    """Lưu detect_result (DB + MinIO detect.json), status = DETECT_DONE."""
+    job_id = job["job_id"]
+    skipped_blank = sum(1 for p in detect_pages if p.get("blank"))
+    detect_key = f"results/{job['tenant_id']}/{job_id}/detect.json"
+    detect_payload = {"job_id": job_id, "pages": detect_pages, "skipped_blank_pages": skipped_blank}
+    detect_json_str = json.dumps(detect_payload, indent=2)
+    put_bytes(detect_key, detect_json_str.encode("utf-8"), "application/json")
+    update_job(job_id, detect_result=detect_json_str, status="DETECT_DONE")
+
+
+def _save_result(job: dict, result: OcrResult, page_count: int) -> None:
+    """Lưu kết quả OCR (DB + MinIO result.json), status = DONE."""
+    job_id = result.job_id
+    result_key = f"results/{job['tenant_id']}/{job_id}/result.json"
+    result_json_str = result.model_dump_json(indent=2)
+    put_bytes(result_key, result_json_str.encode("utf-8"), "application/json")
+    update_job(
+        job_id,
+        status="DONE",
+        result_object_key=result_key,
+        result=result_json_str,
+        error=None,
+        processed_pages=page_count,
+        progress=100,
+    )
+
+
+def _dispatch_shards(job_id: str, shards: list[tuple[int, int]], shard_task, reduce_task) -> None:
+    """Fan-out: chord (group task theo đoạn trang → reducer ghép theo thứ tự trang); shard lỗi → job
+    FAILED."""
+    header = group(shard_task.s(job_id, start, stop) for start, stop in shards)
+    chord(header)(reduce_task.s(job_id).on_error(shard_failed.s(job_id)))
+    logger.info(
+        f"[OCR] Fan-out job_id={job_id}: {len(shards)} shard "
+        f"({shards[0][1] - shards[0][0]} trang/shard)"
+    )
 
 
 @shared_task(
@@ -76,7 +238,9 @@ def run_job(job_id: str):
 
     # Đã có DETECT_DONE thì không chạy lại detect (chờ user chỉnh sửa rồi gọi run_ocr_job)
     if job.get("status") == "DETECT_DONE":
-        logger.info("[OCR] Job đã DETECT_DONE, bỏ qua run_job. Gọi run_ocr_job khi đã chỉnh sửa boxes.")
+        logger.info(
+            "[OCR] Job đã DETECT_DONE, bỏ qua run_job. Gọi run_ocr_job khi đã chỉnh sửa boxes."
+        )
         return
 
     if not job.get("input_object_key"):
@@ -88,40 +252,29 @@ def run_job(job_id: str):
     logger.info("[OCR] Job started: job_id=%s, input_key=%s", job_id, job["input_object_key"])
 
     try:
-        logger.info("[OCR] Bước 1/4 - Lấy input: key=%s", job["input_object_key"])
-        raw = get_bytes(job["input_object_key"])
-        logger.info("[OCR] Input đã tải: size=%s bytes", len(raw))
-
-        pages = _raw_to_pages(
-            raw,
-            job.get("content_type"),
-            job.get("original_filename"),
-        )
-        if not pages:
+        page_count, pages = _page_stream(job, detect_input_side())
+        if not page_count:
             update_job(job_id, status="FAILED", error="Không đọc được trang nào từ file")
             return
 
-        page_count = len(pages)
         update_job(job_id, page_count=page_count)
         logger.info("[OCR] Đã load %s trang (ảnh/PDF)", page_count)
 
-        # Detect: chạy CRAFT cho từng trang, lưu detect.json để frontend vẽ vùng lên PDF
-        detect_pages = []
-        for i, img in enumerate(pages):
-            boxes = detect_text_boxes(img)
-            w, h = img.size
-            detect_pages.append({
-                "page_index": i,
-                "width": w,
-                "height": h,
-                "boxes": [{"x1": x1, "y1": y1, "x2": x2, "y2": y2} for (x1, y1, x2, y2) in boxes],
-            })
-        detect_key = f"results/{job['tenant_id']}/{job_id}/detect.json"
-        detect_payload = {"job_id": job_id, "pages": detect_pages}
-        detect_json_str = json.dumps(detect_payload, indent=2)
-        put_bytes(detect_key, detect_json_str.encode("utf-8"), "application/json")
-        update_job(job_id, detect_result=detect_json_str, status="DETECT_DONE")
-        logger.info("[OCR] Đã lưu kết quả Detect vào DB + MinIO: %s trang. Status=DETECT_DONE. Chỉnh sửa boxes (nếu cần) rồi gọi run_ocr_job.", len(detect_pages))
+        shards = _shards(page_count)
+        if shards:
+            pages.close()
+            _dispatch_shards(job_id, shards, detect_shard, detect_reduce)
+            return
+
+        # Detect: chạy CRAFT theo batch trang, lưu detect.json để frontend vẽ vùng lên PDF
+        detect_pages, _ = _detect_pages(pages)
+        _log_page_cache()
+        _save_detect(job, detect_pages)
+        logger.info(
+            "[OCR] Đã lưu kết quả Detect vào DB + MinIO: %s trang. Status=DETECT_DONE. "
+            "Chỉnh sửa boxes (nếu cần) rồi gọi run_ocr_job.",
+            len(detect_pages),
+        )
     except Exception as e:
         logger.exception("[OCR] Job failed: job_id=%s, error=%r", job_id, e)
         update_job(job_id, status="FAILED", error=str(e))
@@ -149,32 +302,19 @@ def run_detect_job(job_id: str):
         return
     update_job(job_id, status="RUNNING", processed_pages=0, progress=0)
     try:
-        raw = get_bytes(job["input_object_key"])
-        pages = _raw_to_pages(
-            raw,
-            job.get("content_type"),
-            job.get("original_filename"),
-        )
-        if not pages:
+        page_count, pages = _page_stream(job, detect_input_side())
+        if not page_count:
             update_job(job_id, status="FAILED", error="Không đọc được trang nào từ file")
             return
-        page_count = len(pages)
         update_job(job_id, page_count=page_count)
-        detect_pages = []
-        for i, img in enumerate(pages):
-            boxes = detect_text_boxes(img)
-            w, h = img.size
-            detect_pages.append({
-                "page_index": i,
-                "width": w,
-                "height": h,
-                "boxes": [{"x1": x1, "y1": y1, "x2": x2, "y2": y2} for (x1, y1, x2, y2) in boxes],
-            })
-        detect_key = f"results/{job['tenant_id']}/{job_id}/detect.json"
-        detect_payload = {"job_id": job_id, "pages": detect_pages}
-        detect_json_str = json.dumps(detect_payload, indent=2)
-        put_bytes(detect_key, detect_json_str.encode("utf-8"), "application/json")
-        update_job(job_id, detect_result=detect_json_str, status="DETECT_DONE")
+        shards = _shards(page_count)
+        if shards:
+            pages.close()
+            _dispatch_shards(job_id, shards, detect_shard, detect_reduce)
+            return
+        detect_pages, _ = _detect_pages(pages)
+        _log_page_cache()
+        _save_detect(job, detect_pages)
         logger.info("[OCR] Chạy lại Detect xong: job_id=%s, %s trang.", job_id, len(detect_pages))
     except Exception as e:
         logger.exception("[OCR] Run detect failed: job_id=%s, error=%r", job_id, e)
@@ -190,7 +330,8 @@ def run_detect_job(job_id: str):
     retry_kwargs={"max_retries": 2},
 )
 def run_ocr_job(job_id: str):
-    """Chạy OCR (recognize) theo vùng đã detect lưu trong CSDL: đọc detect_result từ DB, recognize bằng VietOCR (run_ocr_with_boxes), lưu result."""
+    """Chạy OCR (recognize) theo vùng đã detect lưu trong CSDL: đọc detect_result từ DB, recognize
+    bằng VietOCR (run_ocr_with_boxes), lưu result."""
     logger.info("[OCR] Run OCR job: job_id=%s", job_id)
     job = get_job(job_id)
     if not job:
@@ -199,7 +340,11 @@ def run_ocr_job(job_id: str):
     detect_json = job.get("detect_result")
     if not detect_json:
         logger.warning("[OCR] Job chưa có detect_result (chưa chạy Detect). job_id=%s", job_id)
-        update_job(job_id, status="FAILED", error="Chưa có kết quả Detect. Chạy job trước để tạo detect_result.")
+        update_job(
+            job_id,
+            status="FAILED",
+            error="Chưa có kết quả Detect. Chạy job trước để tạo detect_result.",
+        )
         return
     try:
         detect_payload = json.loads(detect_json)
@@ -217,33 +362,22 @@ def run_ocr_job(job_id: str):
 
     update_job(job_id, status="RUNNING", processed_pages=0, progress=0)
     try:
-        raw = get_bytes(job["input_object_key"])
-        pages = _raw_to_pages(
-            raw,
-            job.get("content_type"),
-            job.get("original_filename"),
-        )
-        if not pages:
+        page_count, pages = _page_stream(job, preprocess_side())
+        if not page_count:
             update_job(job_id, status="FAILED", error="Không đọc được trang nào từ file")
             return
-        page_count = len(pages)
+        shards = _shards(page_count)
+        if shards:
+            pages.close()
+            _dispatch_shards(job_id, shards, ocr_shard, ocr_reduce)
+            return
         t0 = time.perf_counter()
-        # VietOCR: recognize từng vùng (boxes từ detect_result trong CSDL)
+        # VietOCR: recognize từng vùng (boxes từ detect_result trong CSDL); trang đến theo luồng
         result = run_ocr_with_boxes(job_id, pages, detect_pages)
+        _log_page_cache()
         elapsed = time.perf_counter() - t0
         total_blocks = sum(len(p.blocks) for p in result.pages)
-        result_key = f"results/{job['tenant_id']}/{job_id}/result.json"
-        result_json_str = result.model_dump_json(indent=2)
-        put_bytes(result_key, result_json_str.encode("utf-8"), "application/json")
-        update_job(
-            job_id,
-            status="DONE",
-            result_object_key=result_key,
-            result=result_json_str,
-            error=None,
-            processed_pages=page_count,
-            progress=100,
-        )
+        _save_result(job, result, page_count)
         logger.info(
             "[OCR] OCR job hoàn thành: job_id=%s, pages=%s, blocks=%s, time=%.2fs",
             job_id, page_count, total_blocks, elapsed,
@@ -252,3 +386,109 @@ def run_ocr_job(job_id: str):
         logger.exception("[OCR] OCR job failed: job_id=%s, error=%r", job_id, e)
         update_job(job_id, status="FAILED", error=str(e))
         raise
+
+
+@shared_task(
+    name="ocr.detect_shard",
+    autoretry_for=(Exception,),
+    retry_backoff=True,
+    retry_backoff_max=600,
+    retry_jitter=True,
+    retry_kwargs={"max_retries": 2},
+)
+def detect_shard(job_id: str, start: int, stop: int) -> list[dict]:
+    """Detect các trang [start, stop) của job (chế độ fan-out) → page dict detect_result của đoạn
+    trang."""
+    job = get_job(job_id)
+    if not job:
+        raise ValueError(f"Job not found: {job_id}")
+    t0 = time.perf_counter()
+    _, pages = _page_stream(job, detect_input_side(), start, stop)
+    detect_pages, _ = _detect_pages(pages)
+    logger.info(
+        f"[OCR] Detect shard job_id={job_id} trang {start}-{stop - 1}: "
+        f"{time.perf_counter() - t0:.2f}s"
+    )
+    return detect_pages
+
+
+@shared_task(
+    name="ocr.detect_reduce",
+    autoretry_for=(Exception,),
+    retry_backoff=True,
+    retry_kwargs={"max_retries": 3},
+)
+def detect_reduce(shard_results: list[list[dict]], job_id: str):
+    """Ghép detect_result các shard theo thứ tự trang, lưu DB + MinIO, status = DETECT_DONE."""
+    job = get_job(job_id)
+    if not job:
+        logger.warning(f"[OCR] Job not found: job_id={job_id}")
+        return
+    detect_pages = sorted(
+        (p for pages in shard_results for p in pages), key=lambda p: p["page_index"]
+    )
+    _save_detect(job, detect_pages)
+    logger.info(
+        f"[OCR] Detect (fan-out {len(shard_results)} shard) xong: job_id={job_id}, "
+        f"{len(detect_pages)} trang. Status=DETECT_DONE."
+    )
+
+
+@shared_task(
+    name="ocr.ocr_shard",
+    autoretry_for=(Exception,),
+    retry_backoff=True,
+    retry_backoff_max=600,
+    retry_kwargs={"max_retries": 2},
+)
+def ocr_shard(job_id: str, start: int, stop: int) -> list[dict]:
+    """Recognize các trang [start, stop) theo detect_result trong CSDL (chế độ fan-out) → OcrPage
+    (dict)."""
+    job = get_job(job_id)
+    if not job:
+        raise ValueError(f"Job not found: {job_id}")
+    detect_pages = [
+        p for p in json.loads(job.get("detect_result") or "{}").get("pages") or []
+        if start <= p.get("page_index", -1) < stop
+    ]
+    t0 = time.perf_counter()
+    _, pages = _page_stream(job, preprocess_side(), start, stop)
+    result = run_ocr_with_boxes(job_id, pages, detect_pages)
+    logger.info(
+        f"[OCR] OCR shard job_id={job_id} trang {start}-{stop - 1}: "
+        f"{time.perf_counter() - t0:.2f}s"
+    )
+    return [p.model_dump(mode="json") for p in result.pages]
+
+
+@shared_task(
+    name="ocr.ocr_reduce",
+    autoretry_for=(Exception,),
+    retry_backoff=True,
+    retry_kwargs={"max_retries": 3},
+)
+def ocr_reduce(shard_results: list[list[dict]], job_id: str):
+    """Ghép OcrPage các shard theo thứ tự trang thành OcrResult, lưu DB + MinIO, status = DONE."""
+    job = get_job(job_id)
+    if not job:
+        logger.warning(f"[OCR] Job not found: job_id={job_id}")
+        return
+    pages = sorted(
+        (OcrPage(**p) for pages in shard_results for p in pages), key=lambda p: p.page_index
+    )
+    result = OcrResult(job_id=job_id, pages=pages)
+    _save_result(job, result, len(pages))
+    logger.info(
+        f"[OCR] OCR job (fan-out {len(shard_results)} shard) hoàn thành: job_id={job_id}, "
+        f"pages={len(pages)}, "
+        f"blocks={sum(len(p.blocks) for p in pages)}"
+    )
+
+
+@shared_task(name="ocr.shard_failed")
+def shard_failed(request, exc, traceback, job_id: str):
+    """Errback của chord: một shard lỗi (hết retry) → job FAILED."""
+    logger.error(
+        f"[OCR] Shard lỗi: job_id={job_id}, task={getattr(request, 'id', None)}, error={exc!r}"
+    )
+    update_job(job_id, status="FAILED", error=f"Shard lỗi: {exc}")
@@ -1,11 +1,35 @@
+import os
+
 from celery import Celery
-from celery.signals import worker_init
+from celery.signals import worker_init, worker_process_init
+from ocr_core.config_loader import get_system_config
+from ocr_core.engines.runtime import (
+    available_cores,
+    configure_threads,
+    cores_per_child,
+    worker_concurrency,
+)
+from ocr_core.infra.detection_cache import get_detection_cache
+from ocr_core.infra.page_cache import get_page_cache
 
 from app.core.config import settings
 from app.core.logging import get_logger
 
 logger = get_logger(__name__)
 
+# Parse + validate system_config.yml (và env override) ngay khi import: config sai → worker không
+# khởi động (ConfigError) thay vì lỗi giữa job. Sau đó config được cache, chỉ đọc lại khi file đổi
+# mtime.
+SYSTEM_CONFIG = get_system_config()
+logger.info(
+    f"[WORKER] Config: {SYSTEM_CONFIG.path or '(không có system_config.yml, dùng env/mặc định)'}"
+)
+
+# Ngân sách core cho mỗi process con (OCR_CORES_PER_CHILD / worker.cores_per_child): quyết định cả
+# số process con (concurrency, trừ khi truyền -c khi chạy celery) lẫn số thread Torch/OpenCV trong
+# từng process.
+CORES_PER_CHILD = cores_per_child()
+
 
 @worker_init.connect
 def _init_redis_and_bucket(**kwargs):
@@ -21,7 +45,21 @@ def _init_redis_and_bucket(**kwargs):
             raise
     else:
         logger.warning("[REDIS] CELERY_BROKER_URL chưa cấu hình")
-    # 2) MinIO/S3 bucket (không crash worker nếu S3 chưa cấu hình; task sẽ lỗi khi gọi get/put)
+    # 2) CPU budget: concurrency thực tế (có thể bị -c ghi đè) x cores_per_child
+    #    không nên vượt số core
+    sender = kwargs.get("sender")
+    concurrency = getattr(sender, "concurrency", None) or celery_app.conf.worker_concurrency
+    cores = available_cores()
+    logger.info(
+        f"[WORKER] CPU: {cores} core khả dụng, cores_per_child={CORES_PER_CHILD}, "
+        f"concurrency={concurrency}"
+    )
+    if concurrency * CORES_PER_CHILD > cores:
+        logger.warning(
+            f"[WORKER] concurrency x cores_per_child = {concurrency * CORES_PER_CHILD} > {cores} "
+            "core: CPU bị oversubscribe"
+        )
+    # 3) MinIO/S3 bucket (không crash worker nếu S3 chưa cấu hình; task sẽ lỗi khi gọi get/put)
     try:
         if settings.s3_endpoint:
             logger.info("[WORKER] Đang kiểm tra S3 bucket...")
@@ -29,9 +67,50 @@ def _init_redis_and_bucket(**kwargs):
             ensure_bucket()
             logger.info("[WORKER] ✅ S3 bucket sẵn sàng")
         else:
-            logger.warning("[WORKER] S3/MinIO chưa cấu hình (MINIO_ENDPOINT/S3_ENDPOINT); task OCR sẽ lỗi khi đọc/ghi file.")
+            logger.warning(
+                "[WORKER] S3/MinIO chưa cấu hình (MINIO_ENDPOINT/S3_ENDPOINT); "
+                "task OCR sẽ lỗi khi đọc/ghi file."
+            )
     except Exception:
-        logger.exception("[WORKER] ⚠️ Không đảm bảo được S3 bucket; worker vẫn chạy, task có thể lỗi khi dùng storage.")
+        logger.exception(
+            "[WORKER] ⚠️ Không đảm bảo được S3 bucket; worker vẫn chạy, "
+            "task có thể lỗi khi dùng storage."
+        )
+
+
+@worker_process_init.connect
+def _configure_child_threads(**kwargs):
+    # Mỗi process con (sau fork) đặt số thread Torch/OpenCV/ORT theo budget trước khi load model
+    applied = configure_threads(CORES_PER_CHILD)
+    logger.info(f"[WORKER] Process con pid={os.getpid()} áp dụng thread: {applied}")
+
+
+@worker_process_init.connect
+def _attach_detection_cache_remote(**kwargs):
+    # Detection cache: tầng đĩa local có sẵn trong ocr_core; gắn MinIO làm tầng 2 nếu cấu hình
+    # remote_prefix
+    prefix = (get_system_config().detection_cache.remote_prefix or "").strip()
+    cache = get_detection_cache()
+    if cache is None or not prefix or not settings.s3_endpoint:
+        return
+    from app.services.storage_service import S3CacheTier
+
+    cache.remote = S3CacheTier(prefix)
+    logger.info(f"[WORKER] Detection cache: tầng MinIO prefix={prefix}")
+
+
+@worker_process_init.connect
+def _attach_page_cache_remote(**kwargs):
+    # Page cache (trang đã render): gắn MinIO làm tầng 2 để worker khác dùng lại trang nếu cấu hình
+    # remote_prefix
+    prefix = (get_system_config().page_cache.remote_prefix or "").strip()
+    cache = get_page_cache()
+    if cache is None or not prefix or not settings.s3_endpoint:
+        return
+    from app.services.storage_service import S3CacheTier
+
+    cache.remote = S3CacheTier(prefix, content_type="application/octet-stream")
+    logger.info(f"[WORKER] Page cache: tầng MinIO prefix={prefix}")
 
 
 celery_app = Celery(
@@ -40,3 +119,4 @@ celery_app = Celery(
     backend=settings.celery_result_backend,
     include=["app.tasks.ocr_tasks"],
 )
+celery_app.conf.worker_concurrency = worker_concurrency(CORES_PER_CHILD)
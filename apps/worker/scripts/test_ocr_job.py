@@ -1,6 +1,7 @@
 #!/usr/bin/env python3
 """
-Test chạy OCR (run_ocr_job) cho một job_id: đọc detect_result từ DB, recognize VietOCR, in kết quả và (mặc định) lưu vào DB + MinIO.
+Test chạy OCR (run_ocr_job) cho một job_id: đọc detect_result từ DB, recognize VietOCR, in kết quả
+và (mặc định) lưu vào DB + MinIO.
 
 Cách chạy (từ repo root hoặc apps/worker, cần DB + MinIO đang chạy):
   cd apps/worker
@@ -8,7 +9,8 @@ Cách chạy (từ repo root hoặc apps/worker, cần DB + MinIO đang chạy):
   uv run python scripts/test_ocr_job.py 613ee70d1a0c46a1aa7a00107783da62
   uv run python scripts/test_ocr_job.py --job-id 613ee70d1a0c46a1aa7a00107783da62 --no-update
 
-Cần OCR_CONFIG_BASE trỏ tới thư mục gốc repo (để VietOCR/CRAFT load config từ infra/system_config.yml).
+Cần OCR_CONFIG_BASE trỏ tới thư mục gốc repo (để VietOCR/CRAFT load config từ
+infra/system_config.yml).
 """
 from __future__ import annotations
 
@@ -35,17 +37,20 @@ if _ocr_core_src.is_dir():
             del sys.modules[key]
     sys.path.insert(0, str(_libs))
 
-from app.services.db_service import get_job, update_job
-from app.services.storage_service import get_bytes, put_bytes
-from app.tasks.ocr_tasks import _raw_to_pages
-from ocr_core.pipeline.orchestrator import run_ocr_with_boxes
-
+# import sau khi chỉnh sys.path ở trên
+from app.services.db_service import get_job, update_job  # noqa: E402
+from app.services.storage_service import put_bytes  # noqa: E402
+from app.tasks.ocr_tasks import _page_stream  # noqa: E402
+from ocr_core.pipeline.orchestrator import run_ocr_with_boxes  # noqa: E402
+from ocr_core.pipeline.preprocess import preprocess_side  # noqa: E402
 
 DEFAULT_JOB_ID = "613ee70d1a0c46a1aa7a00107783da62"
 
 
 def main() -> int:
-    parser = argparse.ArgumentParser(description="Test OCR cho job_id (đọc detect_result từ DB, chạy VietOCR).")
+    parser = argparse.ArgumentParser(
+        description="Test OCR cho job_id (đọc detect_result từ DB, chạy VietOCR)."
+    )
     parser.add_argument(
         "job_id",
         nargs="?",
@@ -92,18 +97,13 @@ def main() -> int:
         print("Lỗi: Job không có input_object_key.")
         return 1
 
-    print("Đang tải input từ storage...")
-    raw = get_bytes(job["input_object_key"])
-    pages = _raw_to_pages(
-        raw,
-        job.get("content_type"),
-        job.get("original_filename"),
-    )
-    if not pages:
+    print("Đang lấy trang (page cache hoặc tải input từ storage)...")
+    page_count, pages = _page_stream(job, preprocess_side())
+    if not page_count:
         print("Lỗi: Không đọc được trang nào từ file.")
         return 1
 
-    print(f"Đã load {len(pages)} trang. Đang chạy VietOCR (run_ocr_with_boxes)...")
+    print(f"File có {page_count} trang. Đang chạy VietOCR (run_ocr_with_boxes)...")
     t0 = time.perf_counter()
     result = run_ocr_with_boxes(job_id, pages, detect_pages)
     elapsed = time.perf_counter() - t0
@@ -128,7 +128,7 @@ def main() -> int:
             result_object_key=result_key,
             result=result_json_str,
             error=None,
-            processed_pages=len(pages),
+            processed_pages=page_count,
             progress=100,
         )
         print(f"Đã cập nhật DB và MinIO: result_object_key={result_key}")
@@ -1,8 +1,28 @@
-"""Load system_config.yml và get_config(system_config, keys). Path từ env OCR_SYSTEM_CONFIG, base từ OCR_CONFIG_BASE."""
+"""Load system_config.yml và get_config(system_config, keys). Path từ env OCR_SYSTEM_CONFIG, base từ
+OCR_CONFIG_BASE.
+
+Registry: get_system_config() trả về SystemConfig (pydantic, đã validate) — file YAML chỉ parse một
+lần và chỉ parse lại khi mtime/size của file đổi (hoặc gọi reload_system_config()). Việc kiểm tra
+file (os.stat + env vị trí config) chỉ chạy tối đa mỗi RECHECK_SECONDS giây; giữa hai lần kiểm tra
+get_system_config() trả thẳng config đã cache, không syscall. Biến môi trường (OCR_DEVICE,
+VIETOCR_*, CRAFT_*, ...) được áp vào lúc parse, nên hot path (mỗi trang/mỗi crop) chỉ đọc thuộc
+tính. Đổi env lúc đang chạy → gọi reload_system_config(). Config sai (YAML lỗi, giá trị không hợp
+lệ) → ConfigError; worker gọi get_system_config() khi khởi động để lỗi ngay thay vì giữa job.
+"""
 from __future__ import annotations
+
 import os
+import threading
+import time
+from functools import lru_cache
 from pathlib import Path
-from typing import Any
+from typing import Any, Literal
+
+from pydantic import BaseModel, ConfigDict, Field, PrivateAttr, ValidationError
+
+
+class ConfigError(ValueError):
+    """system_config.yml (hoặc env override) không đọc/validate được."""
 
 
 def _load_yaml(path: str) -> dict:
@@ -12,7 +32,8 @@ def _load_yaml(path: str) -> dict:
 
 
 def get_config(system_config: dict, keys: list[str]) -> Any:
-    """Lấy giá trị lồng nhau: get_config(cfg, ["craft_net", "weights"]) -> cfg["craft_net"]["weights"]."""
+    """Lấy giá trị lồng nhau: get_config(cfg, ["craft_net", "weights"]) ->
+    cfg["craft_net"]["weights"]."""
     v = system_config
     for k in keys:
         v = v.get(k) if isinstance(v, dict) else None
@@ -34,28 +55,330 @@ def resolve_path(path: str | None, base: str | Path) -> str | None:
     return str(p.resolve())
 
 
-def load_system_config() -> tuple[dict, Path]:
-    """
-    Load infra/system_config.yml.
-    - Path file: env OCR_SYSTEM_CONFIG, hoặc OCR_CONFIG_BASE/infra/system_config.yml, hoặc None (trả về {}, Path('.')).
-    - Base để resolve path tương đối: env OCR_CONFIG_BASE hoặc thư mục chứa file config.
-    Returns (config_dict, base_path).
-    """
-    config_path = os.getenv("OCR_SYSTEM_CONFIG", "").strip()
-    base_env = os.getenv("OCR_CONFIG_BASE", "").strip()
+class _Section(BaseModel):
+    # Giữ các key chưa khai báo (các model khác trong system_config.yml) thay vì báo lỗi
+    model_config = ConfigDict(extra="allow")
+
+
+class VietOCRConfig(_Section):
+    config: str | None = None
+    weights: str | None = None
+    device: str | None = None
+    batch_size: int | None = Field(default=None, ge=1)
+    bucket_width: int | None = Field(default=None, ge=1)
+    line_segmentation: Literal["profile", "fixed"] | None = None
+    backend: Literal["torch", "onnx"] | None = None
+    onnx_encoder: str | None = None
+    onnx_decoder: str | None = None
+    quantize: str | bool | None = None
+    quantized_weights: str | None = None
+    prepare_workers: int | None = Field(default=None, ge=0)
+    prepare_queue: int | None = Field(default=None, ge=1)
+
+
+class CraftNetConfig(_Section):
+    weights: str | None = None
+    max_side: int | None = Field(default=None, ge=0)
+    refiner: bool = True
+    batch_size: int | None = Field(default=None, ge=1)
+    bucket: int | None = Field(default=None, ge=32)
+    backend: Literal["torch", "onnx", "torchscript"] | None = None
+    onnx: str | None = None
+    torchscript: str | None = None
+    memory_mb: int | None = Field(default=None, ge=1)
+    tiling: bool = False
+    tile_size: int | None = Field(default=None, ge=256)
+    tile_overlap: int | None = Field(default=None, ge=0)
+    adaptive: bool = False
+    adaptive_min_glyph: int | None = Field(default=None, ge=4)
+    adaptive_min_side: int | None = Field(default=None, ge=64)
+    adaptive_max_side: int | None = Field(default=None, ge=64)
+
+
+class WeightsConfig(_Section):
+    weights: str | None = None
+
+
+class PreprocessConfig(_Section):
+    max_side: int = Field(default=1200, ge=1)
+
+
+class RecognitionCacheConfig(_Section):
+    enabled: bool = True
+    max_entries: int | None = Field(default=None, ge=0)
+    redis_url: str | None = None
+    redis_ttl: int | None = Field(default=None, ge=1)
+
+
+class DetectionCacheConfig(_Section):
+    enabled: bool = True
+    directory: str | None = None
+    max_mb: int | None = Field(default=None, ge=0)
+    remote_prefix: str | None = None
+
+
+class PageCacheConfig(_Section):
+    enabled: bool = True
+    directory: str | None = None
+    max_mb: int | None = Field(default=None, ge=0)
+    remote_prefix: str | None = None
+
+
+class BlankPageConfig(_Section):
+    enabled: bool = True
+    ink_ratio: float | None = Field(default=None, ge=0, le=1)
+    min_contrast: int | None = Field(default=None, ge=0, le=255)
+    min_std: float | None = Field(default=None, ge=0)
+
+
+class BoxPostprocessConfig(_Section):
+    enabled: bool = True
+    dedupe_iou: float | None = Field(default=None, gt=0, le=1)
+    dedupe_contain: float | None = Field(default=None, gt=0, le=1)
+    merge_lines: bool = True
+    line_gap: float | None = Field(default=None, ge=0)
+    max_line_aspect: float | None = Field(default=None, gt=0)
+    column_gap: float | None = Field(default=None, ge=0)
+
+
+class RasterizeConfig(_Section):
+    dpi: int | None = Field(default=None, ge=36)
+    grayscale: bool = False
+    workers: int | None = Field(default=None, ge=0)
+    parallel_min_pages: int | None = Field(default=None, ge=0)
+
+
+class PageStreamConfig(_Section):
+    lookahead: int | None = Field(default=None, ge=0)
+    window: int | None = Field(default=None, ge=1)
+
+
+class PipelineConfig(_Section):
+    queue_size: int | None = Field(default=None, ge=1)
+    preprocess_workers: int | None = Field(default=None, ge=1)
+    detect_workers: int | None = Field(default=None, ge=1)
+    recognize_workers: int | None = Field(default=None, ge=1)
+
+
+class TextLayerConfig(_Section):
+    enabled: bool = True
+    min_chars: int | None = Field(default=None, ge=1)
+    max_garbled: float | None = Field(default=None, ge=0, le=1)
+    max_image_coverage: float | None = Field(default=None, ge=0, le=1)
+
+
+class WorkerConfig(_Section):
+    cores_per_child: int | None = Field(default=None, ge=1)
+    shard_pages: int | None = Field(default=None, ge=0)
+    shard_min_pages: int | None = Field(default=None, ge=1)
+
+
+class SystemConfig(_Section):
+    """system_config.yml đã validate + env override. base/raw/path: thư mục resolve path, dict YAML
+    gốc, file."""
+
+    vietocr: VietOCRConfig = Field(default_factory=VietOCRConfig)
+    craft_net: CraftNetConfig = Field(default_factory=CraftNetConfig)
+    refine_net: WeightsConfig = Field(default_factory=WeightsConfig)
+    preprocess: PreprocessConfig = Field(default_factory=PreprocessConfig)
+    recognition_cache: RecognitionCacheConfig = Field(default_factory=RecognitionCacheConfig)
+    detection_cache: DetectionCacheConfig = Field(default_factory=DetectionCacheConfig)
+    page_cache: PageCacheConfig = Field(default_factory=PageCacheConfig)
+    box_postprocess: BoxPostprocessConfig = Field(default_factory=BoxPostprocessConfig)
+    blank_page: BlankPageConfig = Field(default_factory=BlankPageConfig)
+    rasterize: RasterizeConfig = Field(default_factory=RasterizeConfig)
+    text_layer: TextLayerConfig = Field(default_factory=TextLayerConfig)
+    page_stream: PageStreamConfig = Field(default_factory=PageStreamConfig)
+    pipeline: PipelineConfig = Field(default_factory=PipelineConfig)
+    worker: WorkerConfig = Field(default_factory=WorkerConfig)
+
+    _base: Path = PrivateAttr(default_factory=lambda: Path("."))
+    _raw: dict = PrivateAttr(default_factory=dict)
+    _path: Path | None = PrivateAttr(default=None)
+
+    @property
+    def base(self) -> Path:
+        return self._base
+
+    @property
+    def raw(self) -> dict:
+        return self._raw
+
+    @property
+    def path(self) -> Path | None:
+        return self._path
+
+    def resolve(self, path: str | None) -> str | None:
+        """resolve_path theo base của config."""
+        return resolve_path(path, self._base)
+
+
+# Env override: (section, key, env, ưu tiên). "env": env thắng YAML; "yaml": env chỉ dùng khi YAML
+# không có key.
+_ENV_OVERRIDES = [
+    ("vietocr", "device", "OCR_DEVICE", "env"),
+    ("vietocr", "weights", "VIETOCR_WEIGHTS", "env"),
+    ("vietocr", "backend", "VIETOCR_BACKEND", "env"),
+    ("vietocr", "batch_size", "VIETOCR_BATCH_SIZE", "env"),
+    ("vietocr", "bucket_width", "VIETOCR_BUCKET_WIDTH", "env"),
+    ("vietocr", "line_segmentation", "VIETOCR_LINE_SEGMENTATION", "env"),
+    ("vietocr", "quantize", "VIETOCR_QUANTIZE", "env"),
+    ("vietocr", "prepare_workers", "OCR_PREPARE_WORKERS", "env"),
+    ("vietocr", "prepare_queue", "OCR_PREPARE_QUEUE", "env"),
+    ("craft_net", "refiner", "CRAFT_REFINER", "env"),
+    ("craft_net", "weights", "CRAFT_WEIGHTS_CRAFT_NET", "yaml"),
+    ("craft_net", "max_side", "CRAFT_MAX_SIDE", "yaml"),
+    ("craft_net", "batch_size", "CRAFT_BATCH_SIZE", "env"),
+    ("craft_net", "backend", "CRAFT_BACKEND", "env"),
+    ("craft_net", "memory_mb", "CRAFT_MEMORY_MB", "env"),
+    ("craft_net", "tiling", "CRAFT_TILING", "env"),
+    ("craft_net", "adaptive", "CRAFT_ADAPTIVE", "env"),
+    ("refine_net", "weights", "CRAFT_WEIGHTS_REFINE_NET", "yaml"),
+    ("preprocess", "max_side", "OCR_MAX_SIDE", "env"),
+    ("recognition_cache", "enabled", "OCR_REC_CACHE", "env"),
+    ("recognition_cache", "max_entries", "OCR_REC_CACHE_SIZE", "env"),
+    ("recognition_cache", "redis_url", "OCR_REC_CACHE_REDIS_URL", "env"),
+    ("detection_cache", "enabled", "OCR_DETECT_CACHE", "env"),
+    ("detection_cache", "directory", "OCR_DETECT_CACHE_DIR", "env"),
+    ("page_cache", "enabled", "OCR_PAGE_CACHE", "env"),
+    ("page_cache", "directory", "OCR_PAGE_CACHE_DIR", "env"),
+    ("page_cache", "max_mb", "OCR_PAGE_CACHE_MB", "env"),
+    ("box_postprocess", "enabled", "OCR_BOX_POSTPROCESS", "env"),
+    ("box_postprocess", "merge_lines", "OCR_MERGE_LINES", "env"),
+    ("blank_page", "enabled", "OCR_BLANK_PAGE", "env"),
+    ("blank_page", "ink_ratio", "OCR_BLANK_INK_RATIO", "env"),
+    ("rasterize", "grayscale", "OCR_PDF_GRAYSCALE", "env"),
+    ("rasterize", "workers", "OCR_RASTER_WORKERS", "env"),
+    ("text_layer", "enabled", "OCR_TEXT_LAYER", "env"),
+    ("text_layer", "min_chars", "OCR_TEXT_LAYER_MIN_CHARS", "env"),
+    ("page_stream", "lookahead", "OCR_PAGE_LOOKAHEAD", "env"),
+    ("page_stream", "window", "OCR_PAGE_WINDOW", "env"),
+    ("pipeline", "queue_size", "OCR_PIPELINE_QUEUE", "env"),
+    ("pipeline", "detect_workers", "OCR_PIPELINE_DETECT_WORKERS", "env"),
+    ("pipeline", "recognize_workers", "OCR_PIPELINE_RECOGNIZE_WORKERS", "env"),
+    ("worker", "cores_per_child", "OCR_CORES_PER_CHILD", "env"),
+    ("worker", "shard_pages", "OCR_SHARD_PAGES", "env"),
+    ("worker", "shard_min_pages", "OCR_SHARD_MIN_PAGES", "env"),
+]
+# Giá trị env viết thường trước khi validate (Literal không phân biệt hoa thường như code cũ)
+_LOWERCASE_KEYS = {"backend", "line_segmentation", "quantize"}
+
+
+def _config_location() -> tuple[Path | None, str]:
+    """(file config, OCR_CONFIG_BASE) theo env hiện tại."""
+    return _resolve_location(
+        os.getenv("OCR_SYSTEM_CONFIG", "").strip(), os.getenv("OCR_CONFIG_BASE", "").strip()
+    )
+
+
+@lru_cache(maxsize=8)
+def _resolve_location(config_path: str, base_env: str) -> tuple[Path | None, str]:
     if not config_path and base_env:
         config_path = str(Path(base_env) / "infra" / "system_config.yml")
     if not config_path:
-        return {}, Path(".")
-    path = Path(config_path).resolve()
-    if not path.is_file():
-        return {}, path.parent
-    cfg = _load_yaml(str(path))
+        return None, base_env
+    return Path(config_path).resolve(), base_env
+
+
+def _stamp(path: Path | None) -> tuple[int, int] | None:
+    if path is None:
+        return None
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return (st.st_mtime_ns, st.st_size)
+
+
+def _with_env_overrides(raw: dict) -> dict:
+    data = {k: dict(v) if isinstance(v, dict) else v for k, v in raw.items()}
+    for section, key, env, priority in _ENV_OVERRIDES:
+        value = os.getenv(env, "").strip()
+        if not value:
+            continue
+        current = data.get(section)
+        if not isinstance(current, dict):
+            current = {}
+            data[section] = current
+        if priority == "yaml" and current.get(key) not in (None, ""):
+            continue
+        current[key] = value.lower() if key in _LOWERCASE_KEYS else value
+    return data
+
+
+def _parse(path: Path | None, base_env: str) -> SystemConfig:
+    raw: dict = {}
+    if path is not None and path.is_file():
+        try:
+            raw = _load_yaml(str(path))
+        except Exception as e:
+            raise ConfigError(f"Không đọc được {path}: {e}") from e
+        if not isinstance(raw, dict):
+            raise ConfigError(f"{path}: nội dung phải là mapping, nhận {type(raw).__name__}")
+    try:
+        cfg = SystemConfig.model_validate(_with_env_overrides(raw))
+    except ValidationError as e:
+        raise ConfigError(f"Config không hợp lệ ({path or 'env'}):\n{e}") from e
     if base_env:
         base = Path(base_env).resolve()
+    elif path is None:
+        base = Path(".")
     else:
         # Nếu config nằm trong .../infra/system_config.yml thì base = repo root
         base = path.parent
         if path.parent.name == "infra":
             base = path.parent.parent
-    return cfg, base
+    cfg._base = base
+    cfg._raw = raw
+    cfg._path = path
+    return cfg
+
+
+# Khoảng tối thiểu (giây) giữa hai lần kiểm tra file config (os.stat) trong get_system_config()
+RECHECK_SECONDS = 1.0
+
+_lock = threading.Lock()
+_state: dict = {"key": None, "config": None, "checked": 0.0}
+
+
+def get_system_config() -> SystemConfig:
+    """Config đã parse + validate, cache theo process. Chỉ parse lại khi file config (mtime/size)
+    hoặc OCR_SYSTEM_CONFIG/OCR_CONFIG_BASE đổi; việc kiểm tra đó chạy tối đa mỗi RECHECK_SECONDS
+    giây (thay đổi được thấy chậm nhất sau khoảng này). Lỗi → ConfigError."""
+    cfg = _state["config"]
+    now = time.monotonic()
+    if cfg is not None and now - _state["checked"] < RECHECK_SECONDS:
+        return cfg
+    path, base_env = _config_location()
+    key = (path, base_env, _stamp(path))
+    if cfg is not None and _state["key"] == key:
+        _state["checked"] = now
+        return cfg
+    with _lock:
+        if _state["config"] is None or _state["key"] != key:
+            _state["config"] = _parse(path, base_env)
+            _state["key"] = key
+        _state["checked"] = now
+        return _state["config"]
+
+
+def reload_system_config() -> SystemConfig:
+    """Bỏ cache và parse lại ngay (vd. sau khi đổi env override lúc đang chạy). Lỗi →
+    ConfigError."""
+    with _lock:
+        _state["config"] = None
+        _state["key"] = None
+        _state["checked"] = 0.0
+    return get_system_config()
+
+
+def load_system_config() -> tuple[dict, Path]:
+    """
+    Load infra/system_config.yml (qua registry: không đọc lại file nếu chưa đổi).
+    - Path file: env OCR_SYSTEM_CONFIG, hoặc OCR_CONFIG_BASE/infra/system_config.yml, hoặc None (trả
+      về {}, Path('.')).
+    - Base để resolve path tương đối: env OCR_CONFIG_BASE hoặc thư mục chứa file config.
+    Returns (config_dict, base_path). config_dict là YAML gốc (chưa áp env), không được sửa.
+    """
+    cfg = get_system_config()
+    return cfg.raw, cfg.base
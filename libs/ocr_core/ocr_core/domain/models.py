@@ -1,26 +1,28 @@
 from __future__ import annotations
-from typing import List, Optional, Tuple
+
 from pydantic import BaseModel, Field
 
-Box = Tuple[int, int, int, int]  # x, y, w, h
+Box = tuple[int, int, int, int]  # x, y, w, h
 
 
 class OcrBlock(BaseModel):
     block_id: str
     box: Box
     score: float = 1.0
-    text: Optional[str] = None
-    conf: Optional[float] = None
+    text: str | None = None
+    conf: float | None = None
+    source: str = "ocr"  # ocr (VietOCR) | text_layer (text PDF)
 
 
 class OcrPage(BaseModel):
     page_index: int
     width: int
     height: int
-    blocks: List[OcrBlock] = Field(default_factory=list)
+    source: str = "ocr"  # ocr | text_layer | hybrid (một phần box không có text PDF → VietOCR)
+    blocks: list[OcrBlock] = Field(default_factory=list)
 
 
 class OcrResult(BaseModel):
     job_id: str
-    pages: List[OcrPage]
+    pages: list[OcrPage]
     pipeline_version: str = "v2-commercial"
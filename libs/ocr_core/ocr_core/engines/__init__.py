@@ -1,4 +1,11 @@
 """OCR engines: VietOCR (recognize), CRAFT (detect). Load model 1 lần/process (lru_cache)."""
+from ocr_core.engines.runtime import configure_threads, cores_per_child, worker_concurrency
 from ocr_core.engines.vietocr_engine import get_vietocr_model, vietocr_predict_batch
 
-__all__ = ["get_vietocr_model", "vietocr_predict_batch"]
+__all__ = [
+    "configure_threads",
+    "cores_per_child",
+    "get_vietocr_model",
+    "vietocr_predict_batch",
+    "worker_concurrency",
+]
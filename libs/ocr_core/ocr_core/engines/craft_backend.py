@@ -0,0 +1,268 @@
+"""Backend chạy CRAFT + refiner cho detect: torch (eager, mặc định), onnx (ONNX Runtime) hoặc
+torchscript.
+
+Mọi backend nhận tensor đã chuẩn hóa float32 Bx3xHxW (H, W bội 32) và trả (score_text, score_link)
+float32 BxH/2xW/2 — detect_text_boxes_batch dùng chung phần resize/letterbox/getDetBoxes cho cả ba.
+
+- Export (offline, 1 lần mỗi bộ weights craft_net/refine_net):
+    python -m ocr_core.engines.craft_backend --format onnx|torchscript [--output-dir DIR] [--check]
+  Tạo một graph gộp CRAFT + refiner (<craft weights>.onnx hoặc <craft weights>.ts.pt); --check chạy
+  parity với eager trên ảnh ngẫu nhiên (sai khác score map tối đa).
+- Runtime: craft_net.backend: onnx | torchscript trong system_config.yml (hoặc env CRAFT_BACKEND);
+  craft_net.onnx / craft_net.torchscript để chỉ đường dẫn khác mặc định.
+"""
+from __future__ import annotations
+
+import argparse
+import inspect
+import logging
+import os
+import time
+from pathlib import Path
+
+import numpy as np
+
+from ocr_core.config_loader import get_system_config
+
+logger = logging.getLogger(__name__)
+
+OPSET_VERSION = 17
+# Ngưỡng mặc định của craft_text_detector.Craft (dùng khi không load Craft eager)
+TEXT_THRESHOLD = 0.7
+LINK_THRESHOLD = 0.4
+LOW_TEXT = 0.4
+LONG_SIZE = 1280
+
+
+def _craft_backend_name() -> str:
+    """Backend detect: "torch" (mặc định), "onnx" hoặc "torchscript" (craft_net.backend / env
+    CRAFT_BACKEND)."""
+    return get_system_config().craft_net.backend or "torch"
+
+
+def export_paths() -> dict[str, Path]:
+    """Đường dẫn graph đã export theo format: craft_net.onnx / craft_net.torchscript trong config,
+    mặc định cạnh file weights CRAFT (<weights>.onnx, <weights>.ts.pt)."""
+    system = get_system_config()
+    weights = Path(system.resolve(system.craft_net.weights) or "craft_mlt_25k.pth")
+    onnx_path = system.resolve(system.craft_net.onnx)
+    ts_path = system.resolve(system.craft_net.torchscript)
+    return {
+        "onnx": Path(onnx_path) if onnx_path else weights.with_suffix(".onnx"),
+        "torchscript": Path(ts_path) if ts_path else weights.with_suffix(".ts.pt"),
+    }
+
+
+def _graph_module(craft_net, refine_net):
+    """craft_net + refiner thành một module: ảnh Bx3xHxW → (score_text, score_link) BxH/2xW/2."""
+    from torch import nn
+
+    class _CraftGraph(nn.Module):
+        def __init__(self, net, refiner):
+            super().__init__()
+            self.net = net
+            self.refiner = refiner
+
+        def forward(self, x):
+            y, feature = self.net(x)
+            score_text = y[..., 0]
+            if self.refiner is None:
+                return score_text, y[..., 1]
+            return score_text, self.refiner(y, feature)[..., 0]
+
+    graph = _CraftGraph(craft_net, refine_net).eval()
+    for p in graph.parameters():
+        p.requires_grad_(False)
+    return graph
+
+
+class TorchCraftBackend:
+    """CRAFT eager (craft_text_detector.Craft): tham chiếu cho parity, không cần export."""
+
+    name = "torch"
+
+    def __init__(self, craft):
+        self.craft = craft
+        self.cuda = bool(craft.cuda)
+        self.text_threshold = craft.text_threshold
+        self.link_threshold = craft.link_threshold
+        self.low_text = craft.low_text
+        self.long_size = craft.long_size
+        self.graph = _graph_module(craft.craft_net, craft.refine_net)
+
+    def forward(self, x: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+        import torch
+
+        t = torch.from_numpy(x)
+        if self.cuda:
+            t = t.cuda()
+        with torch.no_grad():
+            score_text, score_link = self.graph(t)
+        return score_text.cpu().numpy(), score_link.cpu().numpy()
+
+
+class TorchScriptCraftBackend(TorchCraftBackend):
+    """Graph TorchScript đã trace + freeze (torch.jit.load), không cần craft_text_detector lúc
+    chạy."""
+
+    name = "torchscript"
+
+    def __init__(self, path: str | Path, cuda: bool = False):
+        import torch
+
+        if not Path(path).is_file():
+            raise FileNotFoundError(
+                f"Không tìm thấy {path}. Chạy "
+                "`python -m ocr_core.engines.craft_backend --format torchscript`."
+            )
+        self.cuda = cuda
+        self.text_threshold = TEXT_THRESHOLD
+        self.link_threshold = LINK_THRESHOLD
+        self.low_text = LOW_TEXT
+        self.long_size = LONG_SIZE
+        self.graph = torch.jit.load(str(path), map_location="cuda" if cuda else "cpu").eval()
+
+
+class OnnxCraftBackend:
+    """Graph ONNX chạy bằng ONNX Runtime (CPU), intra-op threads theo OCR_ORT_THREADS."""
+
+    name = "onnx"
+
+    def __init__(self, path: str | Path):
+        import onnxruntime as ort
+
+        if not Path(path).is_file():
+            raise FileNotFoundError(
+                f"Không tìm thấy {path}. Chạy "
+                "`python -m ocr_core.engines.craft_backend --format onnx`."
+            )
+        opts = ort.SessionOptions()
+        opts.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        threads = int(os.getenv("OCR_ORT_THREADS", "0") or 0)
+        if threads > 0:
+            opts.intra_op_num_threads = threads
+        self.session = ort.InferenceSession(
+            str(path), sess_options=opts, providers=["CPUExecutionProvider"]
+        )
+        self.cuda = False
+        self.text_threshold = TEXT_THRESHOLD
+        self.link_threshold = LINK_THRESHOLD
+        self.low_text = LOW_TEXT
+        self.long_size = LONG_SIZE
+
+    def forward(self, x: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+        feed = {"image": np.ascontiguousarray(x, dtype=np.float32)}
+        score_text, score_link = self.session.run(None, feed)
+        return score_text, score_link
+
+
+def load_craft_backend(craft_factory):
+    """Tạo backend theo craft_net.backend. craft_factory: hàm trả Craft eager (chỉ gọi khi backend
+    torch)."""
+    backend = _craft_backend_name()
+    paths = export_paths()
+    if backend == "onnx":
+        model = OnnxCraftBackend(paths["onnx"])
+    elif backend == "torchscript":
+        device = get_system_config().vietocr.device or "cpu"
+        model = TorchScriptCraftBackend(paths["torchscript"], cuda="cuda" in device)
+    else:
+        model = TorchCraftBackend(craft_factory())
+    logger.info("[OCR Detect] CRAFT backend=%s", model.name)
+    return model
+
+
+def export_craft(fmt: str, output_dir: str | Path | None = None) -> Path:
+    """Export CRAFT + refiner (weights hiện tại, CPU) sang ONNX hoặc TorchScript. Trả về đường dẫn
+    file."""
+    import torch
+
+    from ocr_core.pipeline.detect import get_craft_detector
+
+    if fmt not in ("onnx", "torchscript"):
+        raise ValueError(f"format không hợp lệ: {fmt!r} (onnx|torchscript)")
+    craft = get_craft_detector()
+    if craft.cuda:
+        raise ValueError("Export chạy trên CPU; đặt OCR_DEVICE=cpu khi export")
+    path = export_paths()[fmt]
+    if output_dir:
+        path = Path(output_dir) / path.name
+    path.parent.mkdir(parents=True, exist_ok=True)
+
+    graph = _graph_module(craft.craft_net, craft.refine_net)
+    sample = torch.rand(1, 3, 320, 256)
+    with torch.no_grad():
+        if fmt == "onnx":
+            kwargs = {"opset_version": OPSET_VERSION}
+            if "dynamo" in inspect.signature(torch.onnx.export).parameters:
+                kwargs["dynamo"] = False
+            torch.onnx.export(
+                graph, (sample,), str(path),
+                input_names=["image"], output_names=["score_text", "score_link"],
+                dynamic_axes={
+                    "image": {0: "batch", 2: "height", 3: "width"},
+                    "score_text": {0: "batch", 1: "height_2", 2: "width_2"},
+                    "score_link": {0: "batch", 1: "height_2", 2: "width_2"},
+                },
+                **kwargs,
+            )
+        else:
+            traced = torch.jit.freeze(torch.jit.trace(graph, sample))
+            traced.save(str(path))
+    refiner = " + refiner" if craft.refine_net is not None else ""
+    logger.info("[OCR Detect] Đã export CRAFT%s (%s): %s", refiner, fmt, path)
+    return path
+
+
+def check_parity(fmt: str, path: str | Path, sizes=((1, 640, 480), (2, 960, 736)),
+                 seed: int = 0) -> dict:
+    """So sánh score map backend đã export với eager trên ảnh ngẫu nhiên (chuẩn hóa như CRAFT).
+    Trả về {"max_abs_diff": ..., "eager_s": ..., "exported_s": ...}."""
+    from ocr_core.pipeline.detect import get_craft_detector
+
+    eager = TorchCraftBackend(get_craft_detector())
+    exported = OnnxCraftBackend(path) if fmt == "onnx" else TorchScriptCraftBackend(path)
+    rng = np.random.default_rng(seed)
+    max_diff = 0.0
+    eager_s = exported_s = 0.0
+    for batch, height, width in sizes:
+        x = rng.standard_normal((batch, 3, height, width), dtype=np.float32)
+        t0 = time.perf_counter()
+        ref = eager.forward(x)
+        eager_s += time.perf_counter() - t0
+        t0 = time.perf_counter()
+        got = exported.forward(x)
+        exported_s += time.perf_counter() - t0
+        for a, b in zip(ref, got):
+            max_diff = max(max_diff, float(np.abs(a - b).max()))
+    return {"max_abs_diff": max_diff, "eager_s": eager_s, "exported_s": exported_s}
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(
+        description="Export CRAFT + refiner (craft_net/refine_net weights) sang ONNX/TorchScript."
+    )
+    parser.add_argument("--format", "-f", choices=("onnx", "torchscript"), default="onnx")
+    parser.add_argument("--output-dir", "-o", type=str, default=None,
+                        help="Thư mục ghi file (mặc định: cạnh file weights CRAFT)")
+    parser.add_argument("--check", action="store_true", help="Chạy parity với eager sau khi export")
+    parser.add_argument("--tolerance", type=float, default=1e-3,
+                        help="Sai khác score map tối đa khi --check")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+    path = export_craft(args.format, args.output_dir)
+    print(f"CRAFT {args.format}: {path}")
+    if args.check:
+        report = check_parity(args.format, path)
+        print(
+            f"Parity: max_abs_diff={report['max_abs_diff']:.2e}, "
+            f"eager={report['eager_s']:.3f}s, {args.format}={report['exported_s']:.3f}s"
+        )
+        if report["max_abs_diff"] > args.tolerance:
+            print(f"Vượt ngưỡng {args.tolerance:g}")
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
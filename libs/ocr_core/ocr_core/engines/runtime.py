@@ -0,0 +1,79 @@
+"""Cấu hình thread cho Torch / OpenCV / ONNX Runtime theo ngân sách core của mỗi worker process.
+
+Một budget duy nhất: cores_per_child (số core dành cho một process con Celery).
+- Số process con (concurrency) = số core khả dụng // cores_per_child.
+- Mỗi process con: torch intra-op = cores_per_child, inter-op = 1 (forward CRAFT/VietOCR là một
+  graph tuần tự), OpenCV = 1 (resize crop nhỏ; song song hóa bằng thread pool chuẩn bị batch), ONNX
+  Runtime = cores_per_child.
+Vd. node 32 core: cores_per_child=4 → 8 worker "mỏng"; cores_per_child=16 → 2 worker "béo".
+
+Cấu hình: worker.cores_per_child trong system_config.yml hoặc env OCR_CORES_PER_CHILD (mặc định 4).
+"""
+from __future__ import annotations
+
+import logging
+import os
+from pathlib import Path
+
+from ocr_core.config_loader import get_system_config
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CORES_PER_CHILD = 4
+
+
+def available_cores() -> int:
+    """Số core process được dùng: CPU affinity, giới hạn bởi quota cgroup (cpu.max, khi chạy trong
+    container)."""
+    try:
+        cores = len(os.sched_getaffinity(0))
+    except AttributeError:
+        cores = os.cpu_count() or 1
+    try:
+        quota, period = Path("/sys/fs/cgroup/cpu.max").read_text().split()[:2]
+        if quota != "max":
+            cores = min(cores, max(1, int(int(quota) // int(period))))
+    except (OSError, ValueError):
+        pass
+    return max(1, cores)
+
+
+def cores_per_child() -> int:
+    """Ngân sách core cho mỗi process con (env OCR_CORES_PER_CHILD hoặc worker.cores_per_child)."""
+    cores = get_system_config().worker.cores_per_child or DEFAULT_CORES_PER_CHILD
+    return min(cores, available_cores())
+
+
+def worker_concurrency(budget: int | None = None) -> int:
+    """Số process con Celery để tổng thread không vượt số core: available_cores() //
+    cores_per_child."""
+    budget = budget or cores_per_child()
+    return max(1, available_cores() // budget)
+
+
+def configure_threads(budget: int | None = None) -> dict:
+    """Áp dụng số thread cho process hiện tại (gọi trong process con, trước khi load model). Trả về
+    các giá trị đã áp dụng để log. Biến môi trường OMP/MKL/ORT được đặt cho thư viện khởi tạo sau
+    (không ghi đè nếu đã có)."""
+    budget = budget or cores_per_child()
+    for name in ("OMP_NUM_THREADS", "MKL_NUM_THREADS", "OPENBLAS_NUM_THREADS"):
+        os.environ.setdefault(name, str(budget))
+    os.environ.setdefault("OCR_ORT_THREADS", str(budget))
+    applied = {"cores_per_child": budget, "ort_threads": int(os.environ["OCR_ORT_THREADS"])}
+
+    import torch
+
+    torch.set_num_threads(budget)
+    try:
+        torch.set_num_interop_threads(1)
+    except RuntimeError:
+        # Chỉ đặt được trước khi torch chạy tác vụ song song đầu tiên trong process
+        logger.warning("[OCR Runtime] Không đặt được torch interop threads (đã khởi tạo)")
+    applied["torch_threads"] = torch.get_num_threads()
+    applied["torch_interop_threads"] = torch.get_num_interop_threads()
+
+    import cv2
+
+    cv2.setNumThreads(1)
+    applied["cv2_threads"] = cv2.getNumThreads()
+    return applied
@@ -1,56 +1,144 @@
-"""VietOCR engine: load model 1 lần/worker process (lru_cache). Config từ infra/system_config.yml (vietocr.config, vietocr.weights, device).
-VietOCR được train cho ảnh một dòng (height≈32). Vùng cao (nhiều dòng) sẽ được tách thành từng dòng, nhận dạng rồi ghép lại.
+"""VietOCR engine: load model 1 lần/worker process (lru_cache). Config từ infra/system_config.yml
+(vietocr.config, vietocr.weights, device). VietOCR được train cho ảnh một dòng (height≈32). Vùng cao
+(nhiều dòng) sẽ được tách thành từng dòng, nhận dạng rồi ghép lại. Crop/strip là view NumPy của mảng
+trang (không copy); nhận dạng theo batch: ảnh dòng được resize (cv2) về chiều cao cố định của model,
+gom bucket theo chiều rộng, pad trắng bên phải rồi chạy encoder/decoder một lần cho cả batch (thay
+vì model.predict() từng ảnh). Decoder chạy từng bước với cache key/value, ảnh đã xong bị bỏ khỏi
+batch và số bước tối đa giới hạn theo chiều rộng ảnh, nên nhãn ngắn (ngày tháng, số tiền) không phải
+chờ dòng dài nhất trong batch.
 """
 from __future__ import annotations
+
+import hashlib
+import json
+import math
 import os
-from functools import lru_cache
+from collections.abc import Callable, Iterable
+from functools import lru_cache, partial
 from pathlib import Path
+from typing import NamedTuple
 
+import cv2
+import numpy as np
 from PIL import Image
 
-from ocr_core.config_loader import get_config, load_system_config, resolve_path
+from ocr_core.config_loader import get_system_config
 
-# VietOCR mong đợi ảnh ~1 dòng (height 32). Vùng cao hơn ngưỡng này sẽ tách thành nhiều strip theo chiều ngang.
+# VietOCR mong đợi ảnh ~1 dòng (height 32). Vùng cao hơn ngưỡng này sẽ tách thành nhiều strip theo
+# chiều ngang.
 MAX_SINGLE_LINE_HEIGHT = 56
 LINE_STRIP_HEIGHT = 32
 LINE_STRIP_OVERLAP = 4
 
+# Tách dòng theo projection profile (tổng số pixel mực theo từng hàng): hàng có mực > INK_ROW_RATIO
+# * width được coi là thuộc dòng chữ; crop có độ tương phản < INK_MIN_CONTRAST coi như trống.
+INK_ROW_RATIO = 0.01
+INK_MIN_CONTRAST = 40
 
-def _vietocr_cfg():
-    """Đọc cấu hình VietOCR từ system_config.yml (vietocr.config, vietocr.weights) và device (env hoặc config)."""
-    from vietocr.tool.config import Cfg
+# Batch inference: số ảnh dòng tối đa mỗi batch và độ rộng bucket (px, sau resize về image_height).
+# Ảnh trong cùng bucket chỉ pad thêm < BUCKET_WIDTH px nên kết quả gần như không đổi so với predict
+# từng ảnh.
+BATCH_SIZE = 32
+BUCKET_WIDTH = 32
+MAX_SEQ_LENGTH = 128
+# Giới hạn độ dài decode theo chiều rộng ảnh: CNN (vgg) giảm chiều ngang 4 lần, mỗi ký tự chiếm ≥ 1
+# cột feature.
+MIN_CHAR_WIDTH_PX = 4
+SOS_TOKEN = 1
+EOS_TOKEN = 2
 
-    system_config, base = load_system_config()
-    device = os.getenv("OCR_DEVICE") or get_config(system_config, ["vietocr", "device"]) or "cpu"
 
-    config_path = get_config(system_config, ["vietocr", "config"])
-    weights_path = get_config(system_config, ["vietocr", "weights"])
+def _vietocr_cfg():
+    """Đọc cấu hình VietOCR từ system_config.yml (vietocr.config, vietocr.weights) và device (env
+    hoặc config)."""
+    from vietocr.tool.config import Cfg
 
-    if config_path:
-        config_path = resolve_path(config_path, base)
-    if weights_path:
-        weights_path = resolve_path(weights_path, base)
+    system = get_system_config()
+    vcfg = system.vietocr
+    config_path = system.resolve(vcfg.config)
+    weights_path = system.resolve(vcfg.weights)
 
     if config_path and Path(config_path).is_file():
         cfg = Cfg.load_config_from_file(config_path)
     else:
         cfg = Cfg.load_config_from_name("vgg_transformer")
 
-    cfg["device"] = device
+    cfg["device"] = vcfg.device or "cpu"
     if weights_path:
         cfg["weights"] = weights_path
-    if os.getenv("VIETOCR_WEIGHTS"):
-        cfg["weights"] = os.getenv("VIETOCR_WEIGHTS")
     return cfg
 
 
+def _backend() -> str:
+    """Backend nhận dạng: "torch" (mặc định) hoặc "onnx", từ vietocr.backend hoặc env
+    VIETOCR_BACKEND."""
+    return get_system_config().vietocr.backend or "torch"
+
+
 @lru_cache(maxsize=1)
 def get_vietocr_model():
-    """Load VietOCR predictor 1 lần; cache theo process. Config từ infra/system_config.yml."""
-    from vietocr.tool.predictor import Predictor
-
+    """Load VietOCR predictor 1 lần; cache theo process. Config từ infra/system_config.yml.
+    vietocr.backend: torch → vietocr Predictor (PyTorch); onnx → OnnxPredictor (ONNX Runtime, cần
+    export trước). vietocr.quantize: int8 (backend torch) → model INT8 dynamic quantization, weights
+    cache trên đĩa. model.cache_version: phiên bản model dùng trong key của recognition cache."""
     cfg = _vietocr_cfg()
-    return Predictor(cfg)
+    backend = _backend()
+    quantize = None
+    if backend == "onnx":
+        from ocr_core.engines.vietocr_onnx import OnnxPredictor, onnx_paths
+
+        model = OnnxPredictor(cfg, *onnx_paths(cfg))
+    else:
+        from ocr_core.engines.vietocr_quant import load_quantized_predictor, quantize_mode
+
+        quantize = quantize_mode()
+        if quantize == "int8":
+            model = load_quantized_predictor(cfg)
+        else:
+            from vietocr.tool.predictor import Predictor
+
+            model = Predictor(cfg)
+    model.cache_version = _model_version(cfg, backend, quantize)
+    return model
+
+
+def _model_version(cfg, backend: str, quantize: str | None) -> str:
+    """Hash nội dung file weights + các tham số ảnh hưởng kết quả (vocab, kích thước ảnh, backend,
+    quantize, beamsearch, giới hạn decode). Đổi weights/config → key cache mới, kết quả cũ không bị
+    dùng lại."""
+    h = hashlib.blake2b(digest_size=8)
+    weights = cfg.get("weights")
+    if weights and os.path.isfile(weights):
+        with open(weights, "rb") as f:
+            for chunk in iter(lambda: f.read(1 << 20), b""):
+                h.update(chunk)
+    else:
+        h.update(str(weights).encode("utf-8"))
+    params = {
+        "backend": backend,
+        "quantize": quantize,
+        "seq_modeling": cfg.get("seq_modeling"),
+        "vocab": cfg.get("vocab"),
+        "dataset": {
+            k: cfg["dataset"].get(k) for k in ("image_height", "image_min_width", "image_max_width")
+        },
+        "beamsearch": cfg.get("predictor", {}).get("beamsearch"),
+        "max_seq_length": MAX_SEQ_LENGTH,
+        "min_char_width": MIN_CHAR_WIDTH_PX,
+    }
+    if quantize:
+        from ocr_core.engines.vietocr_quant import QUANT_FORMAT
+
+        params["quant_format"] = QUANT_FORMAT
+    h.update(json.dumps(params, sort_keys=True, ensure_ascii=False).encode("utf-8"))
+    return h.hexdigest()
+
+
+def _batch_params() -> tuple[int, int]:
+    """(batch_size, bucket_width) từ system_config.yml (vietocr.batch_size, vietocr.bucket_width)
+    hoặc env."""
+    vcfg = get_system_config().vietocr
+    return vcfg.batch_size or BATCH_SIZE, vcfg.bucket_width or BUCKET_WIDTH
 
 
 def _prob_to_float(prob) -> float:
@@ -60,18 +148,85 @@ def _prob_to_float(prob) -> float:
     return float(prob) if prob is not None else 1.0
 
 
-def _split_tall_crop_into_strips(
-    img: Image.Image,
-    original_height_px: int | None = None,
-) -> list[Image.Image]:
-    """Tách ảnh cao (nhiều dòng) thành các strip ngang ~1 dòng để VietOCR nhận dạng đúng thứ tự.
-    Nếu original_height_px > 56 (chiều cao box gốc từ detect_result), dùng nó để quyết định số strip
-    vì crop có thể đã bị scale nhỏ (preprocess resize)."""
-    w, h = img.size
+def _line_segmentation() -> str:
+    """Chế độ tách dòng: "profile" (mặc định) hoặc "fixed" (strip cố định 32px), từ
+    vietocr.line_segmentation hoặc env."""
+    return get_system_config().vietocr.line_segmentation or "profile"
+
+
+def _find_text_lines(gray: np.ndarray, expected_line_px: float) -> list[tuple[int, int]] | None:
+    """Tìm các dòng chữ trong crop bằng horizontal projection profile (vectorized NumPy).
+    gray: ảnh xám HxW (uint8). expected_line_px: chiều cao một dòng ước lượng (px trong crop).
+    Trả về list (y1, y2) các dòng; [] nếu crop trống; None nếu không tách được (dùng strip cố
+    định)."""
+    h, w = gray.shape
+    lo, hi = int(gray.min()), int(gray.max())
+    if hi - lo < INK_MIN_CONTRAST:
+        return []
+    ink = gray < (lo + hi) // 2
+    rows = ink.sum(axis=1) > max(1, int(w * INK_ROW_RATIO))
+    if not rows.any():
+        return []
+    edges = np.diff(np.concatenate(([0], rows.astype(np.int8), [0])))
+    starts = np.flatnonzero(edges == 1)
+    ends = np.flatnonzero(edges == -1)
+
+    # Gộp các khe rất nhỏ (dấu tiếng Việt tách khỏi thân chữ 1-2px)
+    ref = float(np.percentile(ends - starts, 75))
+    gap_thr = max(1, int(round(0.15 * ref)))
+    keep = np.concatenate(([True], (starts[1:] - ends[:-1]) > gap_thr))
+    starts = starts[keep]
+    ends = np.concatenate((ends[np.flatnonzero(keep)[1:] - 1], ends[-1:]))
+
+    # Run quá thấp (dấu, gạch chân) gắn vào dòng kề gần nhất
+    heights = ends - starts
+    ref = float(np.median(heights[heights >= 0.5 * heights.max()]))
+    bands = [[int(a), int(b)] for a, b in zip(starts, ends)]
+    i = 0
+    while len(bands) > 1 and i < len(bands):
+        y1, y2 = bands[i]
+        if y2 - y1 >= 0.4 * ref:
+            i += 1
+            continue
+        gap_up = y1 - bands[i - 1][1] if i > 0 else None
+        gap_down = bands[i + 1][0] - y2 if i + 1 < len(bands) else None
+        if gap_down is None or (gap_up is not None and gap_up <= gap_down):
+            bands[i - 1][1] = y2
+        else:
+            bands[i + 1][0] = y1
+        del bands[i]
+
+    # Dòng quá cao (các dòng dính nhau): chỉ một band → None (strip cố định); nhiều band → chia đều
+    # theo ref
+    line_px = max(ref, expected_line_px)
+    if len(bands) == 1 and bands[0][1] - bands[0][0] > 2.5 * line_px:
+        return None
+    split = []
+    for y1, y2 in bands:
+        n = int(round((y2 - y1) / ref)) if y2 - y1 > 2.5 * line_px else 1
+        cuts = np.linspace(y1, y2, max(n, 1) + 1).astype(int)
+        split.extend([int(a), int(b)] for a, b in zip(cuts[:-1], cuts[1:]))
+    bands = split
+
+    # Nới biên mỗi dòng (không vượt quá giữa khe với dòng kề)
+    pad = max(1, int(0.25 * ref))
+    out = []
+    for k, (y1, y2) in enumerate(bands):
+        top = y1 - pad if k == 0 else max(y1 - pad, (bands[k - 1][1] + y1) // 2)
+        bottom = y2 + pad if k == len(bands) - 1 else min(y2 + pad, (y2 + bands[k + 1][0] + 1) // 2)
+        out.append((max(0, top), min(h, bottom)))
+    return out
+
+
+def _fixed_strips(img: np.ndarray, original_height_px: int | None = None) -> list[np.ndarray]:
+    """Strip cố định LINE_STRIP_HEIGHT (32px) overlap 4px (theo chiều cao gốc nếu có). Strip là view
+    của img."""
+    h = img.shape[0]
     use_original = original_height_px is not None and original_height_px > MAX_SINGLE_LINE_HEIGHT
     if use_original:
-        # Strip theo chiều cao gốc: mỗi dòng ~32px, overlap 4px. Map tọa độ gốc → crop (crop có thể đã scale)
-        # để tránh cắt qua chữ (vd. "Ban" của dòng 2 lẫn vào strip 1). Số strip = số dòng ước lượng.
+        # Strip theo chiều cao gốc: mỗi dòng ~32px, overlap 4px. Map tọa độ gốc → crop (crop có thể
+        # đã scale) để tránh cắt qua chữ (vd. "Ban" của dòng 2 lẫn vào strip 1). Số strip = số dòng
+        # ước lượng.
         num_strips = max(1, round(original_height_px / LINE_STRIP_HEIGHT))
         step_orig = max(1, LINE_STRIP_HEIGHT - LINE_STRIP_OVERLAP)
         strips = []
@@ -84,58 +239,343 @@ def _split_tall_crop_into_strips(
             y1_crop = int(y_orig * h / original_height_px)
             y2_crop = int(y2_orig * h / original_height_px)
             if y2_crop > y1_crop and (y2_crop - y1_crop) >= 8:
-                strips.append(img.crop((0, y1_crop, w, y2_crop)))
+                strips.append(img[y1_crop:y2_crop])
         return strips if strips else [img]
-    if h <= MAX_SINGLE_LINE_HEIGHT:
-        return [img]
     step = max(1, LINE_STRIP_HEIGHT - LINE_STRIP_OVERLAP)
     strips = []
     y = 0
     while y < h:
         y2 = min(y + LINE_STRIP_HEIGHT, h)
-        strip = img.crop((0, y, w, y2))
-        if strip.size[1] >= 8:
-            strips.append(strip)
+        if y2 - y >= 8:
+            strips.append(img[y:y2])
         y += step
     return strips if strips else [img]
 
 
+def _split_tall_crop_into_strips(
+    img: np.ndarray,
+    original_height_px: int | None = None,
+) -> list[np.ndarray]:
+    """Tách ảnh cao (nhiều dòng) thành các dòng để VietOCR nhận dạng đúng thứ tự.
+    Nếu original_height_px > 56 (chiều cao box gốc từ detect_result), dùng nó để quyết định có tách
+    hay không vì crop có thể đã bị scale nhỏ (preprocess resize). Mặc định tách theo projection
+    profile (dòng thật, bỏ khoảng trắng); không tách được thì fallback strip cố định 32px. img:
+    uint8 HxWx3 RGB; strip là view."""
+    h = img.shape[0]
+    use_original = original_height_px is not None and original_height_px > MAX_SINGLE_LINE_HEIGHT
+    if not use_original and h <= MAX_SINGLE_LINE_HEIGHT:
+        return [img]
+    if _line_segmentation() == "profile":
+        scale = h / original_height_px if use_original else 1.0
+        bands = _find_text_lines(cv2.cvtColor(img, cv2.COLOR_RGB2GRAY), LINE_STRIP_HEIGHT * scale)
+        if bands is not None:
+            strips = [img[y1:y2] for (y1, y2) in bands if y2 - y1 >= 8]
+            return strips if strips else [img]
+    return _fixed_strips(img, original_height_px)
+
+
+def _line_width(w: int, h: int, image_height: int, min_width: int, max_width: int) -> int:
+    """Chiều rộng sau resize về image_height (cùng quy tắc vietocr.tool.translate.resize: làm tròn
+    lên bội 10)."""
+    new_w = int(image_height * float(w) / float(max(h, 1)))
+    new_w = math.ceil(new_w / 10) * 10
+    return min(max(new_w, min_width), max_width)
+
+
+def _as_rgb(img: Image.Image | np.ndarray) -> np.ndarray:
+    """Crop (view NumPy uint8 HxWx3 RGB, hoặc ảnh PIL) → mảng RGB; mảng RGB uint8 dùng nguyên không
+    copy."""
+    if (isinstance(img, np.ndarray) and img.ndim == 3 and img.shape[2] == 3
+            and img.dtype == np.uint8):
+        return img
+    from ocr_core.pipeline.preprocess import to_rgb_array
+
+    return to_rgb_array(img)
+
+
+def _prepare_line(img: np.ndarray, image_height: int, min_width: int, max_width: int) -> np.ndarray:
+    """Resize ảnh dòng (view uint8 HxWx3 RGB) về (image_height, new_w); trả về uint8 HxWx3
+    C-contiguous. cv2 đọc thẳng từ view (không copy crop); thu nhỏ dùng INTER_AREA (khử răng cưa như
+    LANCZOS của PIL), phóng to dùng INTER_CUBIC."""
+    h, w = img.shape[:2]
+    new_w = _line_width(w, h, image_height, min_width, max_width)
+    shrink = h > image_height or w > new_w
+    interpolation = cv2.INTER_AREA if shrink else cv2.INTER_CUBIC
+    return cv2.resize(img, (new_w, image_height), interpolation=interpolation)
+
+
+def _plan_batches(
+    model,
+    lines: list[np.ndarray],
+    batch_size: int,
+    bucket_width: int,
+) -> list[list[int]]:
+    """Chia ảnh dòng thành các batch (list chỉ số) theo bucket chiều rộng sau resize, tối đa
+    batch_size ảnh/batch. Chỉ tính từ kích thước ảnh (không resize) nên lập kế hoạch xong trước khi
+    chuẩn bị batch nào."""
+    ds = model.config["dataset"]
+    buckets: dict[int, list[int]] = {}
+    for i, line in enumerate(lines):
+        h, w = line.shape[:2]
+        width = _line_width(w, h, ds["image_height"], ds["image_min_width"], ds["image_max_width"])
+        buckets.setdefault(math.ceil(width / bucket_width), []).append(i)
+    plans = []
+    for key in sorted(buckets):
+        idx_all = buckets[key]
+        for start in range(0, len(idx_all), batch_size):
+            plans.append(idx_all[start:start + batch_size])
+    return plans
+
+
+def _pad_batch(lines: list[np.ndarray]) -> tuple[np.ndarray, np.ndarray]:
+    """Ghép ảnh dòng (đã resize, cùng chiều cao) thành tensor float32 Bx3xHxW: pad trắng bên phải
+    tới ảnh rộng nhất, chuẩn hóa /255 một lần cho cả batch. Trả về (x, chiều rộng thật của từng ảnh
+    trước khi pad)."""
+    widths = np.array([line.shape[1] for line in lines], dtype=np.int64)
+    batch = np.full((len(lines), lines[0].shape[0], int(widths.max()), 3), 255, dtype=np.uint8)
+    for j, line in enumerate(lines):
+        batch[j, :, :line.shape[1]] = line
+    x = batch.transpose(0, 3, 1, 2).astype(np.float32) / 255.0
+    return x, widths
+
+
+class PreparedBatch(NamedTuple):
+    """Một batch đã chuẩn bị xong (chưa inference).
+    hits: (chỉ số, kết quả) lấy từ recognition cache; todo/keys: ảnh cần nhận dạng và key cache
+    tương ứng; x/widths: tensor đã pad + chuẩn hóa của các ảnh todo (None nếu không cần, vd. beam
+    search); duplicates: chỉ số ảnh trùng key → chỉ số ảnh được nhận dạng thay."""
+    hits: list[tuple[int, tuple[str, float]]]
+    todo: list[int]
+    keys: list[str]
+    x: np.ndarray | None
+    widths: np.ndarray | None
+    duplicates: list[tuple[int, int]]
+
+
+def prepare_batch(model, lines: list[np.ndarray], idx: list[int], cache=None) -> PreparedBatch:
+    """Bước chuẩn bị (không dùng model inference, an toàn khi chạy trong thread pool): resize các
+    ảnh idx, tra recognition cache, bỏ ảnh trùng, pad + chuẩn hóa phần còn lại."""
+    ds = model.config["dataset"]
+    prepared = [
+        _prepare_line(
+            _as_rgb(lines[i]), ds["image_height"], ds["image_min_width"], ds["image_max_width"]
+        )
+        for i in idx
+    ]
+    hits = []
+    todo = list(range(len(idx)))
+    keys: list[str] = []
+    duplicates = []
+    if cache is not None:
+        from ocr_core.infra.recognition_cache import image_key
+
+        keys = [image_key(p, model.cache_version) for p in prepared]
+        first: dict[str, int] = {}
+        todo = []
+        for j, res in enumerate(cache.get_many(keys)):
+            if res is not None:
+                hits.append((idx[j], res))
+            elif keys[j] in first:
+                # Ảnh trùng nhau trong cùng batch (cùng key) chỉ nhận dạng một lần
+                duplicates.append((idx[j], idx[first[keys[j]]]))
+            else:
+                first[keys[j]] = j
+                todo.append(j)
+    x = widths = None
+    beamsearch = model.config.get("predictor", {}).get("beamsearch")
+    if todo and not (beamsearch and getattr(model, "backend", "torch") == "torch"):
+        x, widths = _pad_batch([prepared[j] for j in todo])
+    return PreparedBatch(
+        hits=hits,
+        todo=[idx[j] for j in todo],
+        keys=[keys[j] for j in todo] if keys else [],
+        x=x,
+        widths=widths,
+        duplicates=duplicates,
+    )
+
+
+def _max_steps(widths: np.ndarray) -> np.ndarray:
+    """Số bước decode tối đa cho từng ảnh theo chiều rộng thật: mỗi ký tự chiếm ít nhất
+    MIN_CHAR_WIDTH_PX px (= stride chiều ngang của CNN) + 1 bước cho <eos>; không vượt
+    MAX_SEQ_LENGTH + 1."""
+    caps = np.ceil(widths / MIN_CHAR_WIDTH_PX).astype(np.int64) + 1
+    return np.minimum(caps, MAX_SEQ_LENGTH + 1)
+
+
+def _translate_batch(model, x: np.ndarray,
+                     widths: np.ndarray | None = None) -> list[tuple[str, float]]:
+    """Greedy decode cả batch: encoder 1 lần, decoder 1 bước/lần cho các ảnh chưa xong.
+    conf = trung bình xác suất các ký tự trước <eos> (như vietocr translate)."""
+    if widths is None:
+        widths = np.full(x.shape[0], x.shape[3], dtype=np.int64)
+    caps = _max_steps(widths)
+    if getattr(model, "backend", "torch") == "onnx":
+        ids, probs = model.greedy_decode(x, caps, SOS_TOKEN, EOS_TOKEN)
+    else:
+        ids, probs = _greedy_decode_torch(model, x, caps)
+    # Chỉ lấy ký tự trước <eos> đầu tiên; token đặc biệt (pad/sos/eos/mask) có id <= 3
+    before_eos = np.cumsum(ids == EOS_TOKEN, axis=1) == 0
+    is_char = before_eos & (ids > 3)
+    counts = is_char.sum(axis=1)
+    confs = np.where(counts > 0, (probs * is_char).sum(axis=1) / np.maximum(counts, 1), 0.0)
+    out = []
+    for row, mask, conf in zip(ids, before_eos, confs):
+        out.append((model.vocab.decode(row[mask].tolist()), float(conf)))
+    return out
+
+
+def _greedy_decode_torch(model, x: np.ndarray, caps: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    """Greedy decode bằng VietOCR PyTorch. Trả về (ids BxT, probs BxT); vị trí sau khi dừng là
+    <eos>/0. Transformer: decoder từng bước có cache K/V, ảnh đã ra <eos> hoặc chạm caps bị bỏ khỏi
+    batch. seq2seq: chạy lại decoder của vietocr trên cả prefix, chỉ che kết quả các ảnh đã xong."""
+    import torch
+
+    net = model.model
+    net.eval()
+    n = x.shape[0]
+    max_len = int(caps.max())
+    ids = np.full((n, max_len), EOS_TOKEN, dtype=np.int64)
+    probs = np.zeros((n, max_len), dtype=np.float32)
+    with torch.no_grad():
+        img = torch.from_numpy(x).to(model.device)
+        if model.config.get("seq_modeling", "transformer") == "transformer":
+            from ocr_core.engines.vietocr_functional import IncrementalDecoder
+
+            decoder = IncrementalDecoder(net, net.transformer.forward_encoder(net.cnn(img)))
+            active = np.arange(n)
+            tokens = torch.full((n,), SOS_TOKEN, dtype=torch.long, device=img.device)
+            for step in range(max_len):
+                prob, idx = torch.softmax(decoder.step(tokens, step), dim=-1).max(dim=-1)
+                idx_np = idx.cpu().numpy()
+                ids[active, step] = idx_np
+                probs[active, step] = prob.cpu().numpy()
+                alive = (idx_np != EOS_TOKEN) & (caps[active] > step + 1)
+                if not alive.all():
+                    if not alive.any():
+                        break
+                    keep = torch.from_numpy(np.flatnonzero(alive)).to(img.device)
+                    decoder.select(keep)
+                    idx = idx.index_select(0, keep)
+                    active = active[alive]
+                tokens = idx
+            return ids, probs
+
+        memory = net.transformer.forward_encoder(net.cnn(img))
+        tokens = torch.full((1, n), SOS_TOKEN, dtype=torch.long, device=img.device)
+        finished = np.zeros(n, dtype=bool)
+        for step in range(max_len):
+            output, memory = net.transformer.forward_decoder(tokens, memory)
+            prob, idx = torch.softmax(output[:, -1, :], dim=-1).max(dim=-1)
+            idx_np = np.where(finished, EOS_TOKEN, idx.cpu().numpy())
+            ids[:, step] = idx_np
+            probs[:, step] = np.where(finished, 0.0, prob.cpu().numpy())
+            finished |= (idx_np == EOS_TOKEN) | (caps <= step + 1)
+            if finished.all():
+                break
+            step_tokens = torch.from_numpy(idx_np).to(img.device).unsqueeze(0)
+            tokens = torch.cat([tokens, step_tokens], dim=0)
+    return ids, probs
+
+
+def _recognition_cache(model):
+    """Recognition cache của process nếu model có cache_version (model từ get_vietocr_model), ngược
+    lại None."""
+    if not getattr(model, "cache_version", None):
+        return None
+    from ocr_core.infra.recognition_cache import get_recognition_cache
+
+    return get_recognition_cache()
+
+
+def predict_lines(
+    model,
+    lines: list[np.ndarray | Image.Image],
+    map_fn: Callable[[Callable, Iterable], Iterable] | None = None,
+) -> list[tuple[str, float]]:
+    """Nhận dạng batch ảnh một dòng; kết quả (text, conf) giữ đúng thứ tự đầu vào.
+    Ảnh đã có trong recognition cache (model có cache_version) không chạy lại inference.
+    map_fn(fn, plans): cách chạy bước chuẩn bị batch (mặc định map tuần tự); recognize dùng thread
+    pool để chuẩn bị batch kế tiếp trong lúc batch hiện tại đang inference. Phải trả kết quả theo
+    đúng thứ tự plans. Beam search (predictor.beamsearch) không hỗ trợ batch → fallback
+    model.predict từng ảnh."""
+    if not lines:
+        return []
+    lines = [_as_rgb(im) for im in lines]
+    cache = _recognition_cache(model)
+    beamsearch = model.config.get("predictor", {}).get("beamsearch")
+    beamsearch = beamsearch and getattr(model, "backend", "torch") == "torch"
+    batch_size, bucket_width = _batch_params()
+    plans = _plan_batches(model, lines, batch_size, bucket_width)
+    results: list[tuple[str, float]] = [("", 0.0)] * len(lines)
+    for batch in (map_fn or map)(partial(prepare_batch, model, lines, cache=cache), plans):
+        for i, res in batch.hits:
+            results[i] = res
+        if batch.todo:
+            if beamsearch:
+                rec = []
+                for i in batch.todo:
+                    line_img = Image.fromarray(np.ascontiguousarray(lines[i]))
+                    res = model.predict(line_img, return_prob=True)
+                    if isinstance(res, tuple):
+                        rec.append((res[0], _prob_to_float(res[1])))
+                    else:
+                        rec.append((res, 1.0))
+            else:
+                rec = _translate_batch(model, batch.x, batch.widths)
+            for i, res in zip(batch.todo, rec):
+                results[i] = res
+            if cache is not None:
+                cache.put_many(list(zip(batch.keys, rec)))
+        for i, j in batch.duplicates:
+            results[i] = results[j]
+    return results
+
+
 def _predict_one_crop_maybe_multiline(
     model,
-    im: Image.Image,
+    im: np.ndarray | Image.Image,
     original_height_px: int | None = None,
 ) -> tuple[str, float]:
-    """Một crop: nếu ảnh cao hoặc original_height_px > 56 thì tách dòng, nhận dạng từng dòng rồi ghép bằng \\n."""
+    """Một crop: nếu ảnh cao hoặc original_height_px > 56 thì tách dòng, nhận dạng batch các dòng
+    rồi ghép bằng \\n."""
+    im = _as_rgb(im)
     strips = _split_tall_crop_into_strips(im, original_height_px)
     if len(strips) == 1:
-        res = model.predict(im, return_prob=True)
-        if isinstance(res, tuple):
-            return (res[0], _prob_to_float(res[1]))
-        return (res, 1.0)
-    texts: list[str] = []
-    probs: list[float] = []
-    for strip in strips:
-        res = model.predict(strip, return_prob=True)
-        if isinstance(res, tuple):
-            texts.append(res[0])
-            probs.append(_prob_to_float(res[1]))
-        else:
-            texts.append(res)
-            probs.append(1.0)
-    joined = "\n".join(texts)
-    conf = min(probs) if probs else 1.0
+        return predict_lines(model, [im])[0]
+    return _join_strips(predict_lines(model, strips))
+
+
+def _join_strips(rec: list[tuple[str, float]]) -> tuple[str, float]:
+    """Ghép kết quả các strip của một vùng: text nối bằng \\n, conf = min."""
+    joined = "\n".join(t for t, _ in rec)
+    conf = min(c for _, c in rec) if rec else 1.0
     return (joined, conf)
 
 
 def vietocr_predict_batch(
     model,
-    crops: list[Image.Image],
-    original_heights: list[int] | None = None,
+    crops: list[np.ndarray | Image.Image],
+    original_heights: list[int | None] | None = None,
+    map_fn: Callable[[Callable, Iterable], Iterable] | None = None,
 ) -> list[tuple[str, float]]:
-    """Predict từng crop. Crop cao (vùng nhiều dòng) được tách thành dòng, nhận dạng rồi ghép.
-    original_heights: chiều cao box gốc (page coords) từ detect_result; dùng để tách dòng dù crop đã scale."""
-    out: list[tuple[str, float]] = []
+    """Predict batch các crop. Mọi dòng (crop một dòng + từng strip của crop cao) được gom vào một
+    hàng đợi chung rồi nhận dạng batch một lần; kết quả ghép lại theo crop (\\n giữa các strip, conf
+    = min). original_heights: chiều cao box gốc (page coords) từ detect_result; dùng để tách dòng dù
+    crop đã scale. crops: view NumPy uint8 HxWx3 RGB của mảng trang (recognize.crop_regions) hoặc
+    ảnh PIL. map_fn: chuyển cho predict_lines (chuẩn bị batch song song với inference)."""
+    lines: list[np.ndarray] = []
+    spans: list[tuple[int, int]] = []
     for i, im in enumerate(crops):
         oh = original_heights[i] if original_heights and i < len(original_heights) else None
-        out.append(_predict_one_crop_maybe_multiline(model, im, oh))
-    return out
\ No newline at end of file
+        strips = _split_tall_crop_into_strips(_as_rgb(im), oh)
+        spans.append((len(lines), len(lines) + len(strips)))
+        lines.extend(strips)
+    rec = predict_lines(model, lines, map_fn=map_fn)
+    out = []
+    for start, end in spans:
+        if end - start == 1:
+            out.append(rec[start])
+        else:
+            out.append(_join_strips(rec[start:end]))
+    return out
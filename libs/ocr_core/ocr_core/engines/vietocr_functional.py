@@ -0,0 +1,294 @@
+"""Transformer của VietOCR viết lại bằng phép toán tensor thuần, dùng lại weights của model gốc.
+
+nn.MultiheadAttention tính kích thước batch*heads bằng số nguyên Python nên graph export (ONNX) bị
+cố định batch/độ dài. Các hàm ở đây chỉ dùng reshape(-1)/matmul nên export được với trục động và cho
+kết quả giống nn.Transformer (eval, không dropout). Chỉ áp dụng cho seq_modeling=transformer.
+"""
+from __future__ import annotations
+
+import math
+
+import torch
+import torch.nn.functional as F
+from torch import nn
+
+
+def _in_proj(attn: nn.Module, x: torch.Tensor, part: int) -> torch.Tensor:
+    """Phép chiếu q/k/v (part 0/1/2) của x: lát in_proj_weight gộp (nn.MultiheadAttention) hoặc
+    Linear riêng (SplitAttention)."""
+    if isinstance(attn, SplitAttention):
+        return (attn.q_proj, attn.k_proj, attn.v_proj)[part](x)
+    e = attn.embed_dim
+    rows = slice(part * e, (part + 1) * e)
+    return F.linear(x, attn.in_proj_weight[rows], attn.in_proj_bias[rows])
+
+
+def _attention(x_q: torch.Tensor, x_kv: torch.Tensor, attn: nn.Module,
+               mask: torch.Tensor | None = None) -> torch.Tensor:
+    """Multi-head attention. x_q: TxBxE, x_kv: SxBxE, mask cộng vào score (TxS) → TxBxE."""
+    e = attn.embed_dim
+    heads = attn.num_heads
+    d = e // heads
+    q = _in_proj(attn, x_q, 0)
+    k = _in_proj(attn, x_kv, 1)
+    v = _in_proj(attn, x_kv, 2)
+    # T x B x E → B x H x T x d
+    q = q.reshape(q.shape[0], -1, heads, d).permute(1, 2, 0, 3)
+    k = k.reshape(k.shape[0], -1, heads, d).permute(1, 2, 0, 3)
+    v = v.reshape(v.shape[0], -1, heads, d).permute(1, 2, 0, 3)
+    scores = torch.matmul(q, k.transpose(-1, -2)) / math.sqrt(d)
+    if mask is not None:
+        scores = scores + mask
+    out = torch.matmul(torch.softmax(scores, dim=-1), v)
+    out = out.permute(2, 0, 1, 3).reshape(out.shape[2], -1, e)
+    return attn.out_proj(out)
+
+
+def _additive_mask(mask: torch.Tensor | None) -> torch.Tensor | None:
+    """Mask bool (True = bị che) → mask cộng vào score như causal_mask; mask số giữ nguyên."""
+    if mask is None or mask.dtype != torch.bool:
+        return mask
+    blocked = torch.finfo(torch.float32).min
+    return torch.zeros(mask.shape, device=mask.device).masked_fill(mask, blocked)
+
+
+class SplitAttention(nn.Module):
+    """nn.MultiheadAttention (eval, seq-first) với in_proj tách thành ba nn.Linear q/k/v.
+
+    quantize_dynamic chỉ lượng tử hóa module nn.Linear: in_proj_weight gộp của nn.MultiheadAttention
+    là Parameter trần, out_proj là NonDynamicallyQuantizableLinear → cả hai bị bỏ qua. Sau khi
+    tách, mọi phép chiếu attention là nn.Linear thường. Thay trực tiếp được trong nn.Transformer
+    (cùng chữ ký forward, không trả attention weights) và dùng chung với các hàm functional /
+    IncrementalDecoder.
+    """
+
+    batch_first = False
+
+    def __init__(self, embed_dim: int, num_heads: int, bias: bool = True):
+        super().__init__()
+        self.embed_dim = embed_dim
+        self.num_heads = num_heads
+        self.q_proj = nn.Linear(embed_dim, embed_dim, bias=bias)
+        self.k_proj = nn.Linear(embed_dim, embed_dim, bias=bias)
+        self.v_proj = nn.Linear(embed_dim, embed_dim, bias=bias)
+        self.out_proj = nn.Linear(embed_dim, embed_dim, bias=bias)
+
+    @classmethod
+    def from_attention(cls, attn: nn.MultiheadAttention) -> SplitAttention:
+        """Chép weights từ nn.MultiheadAttention (kdim = vdim = embed_dim, không bias_k/bias_v)."""
+        if attn.batch_first or not attn._qkv_same_embed_dim or attn.bias_k is not None:
+            raise ValueError("SplitAttention chỉ hỗ trợ attention seq-first, q/k/v cùng kích thước")
+        split = cls(attn.embed_dim, attn.num_heads, bias=attn.in_proj_bias is not None)
+        e = attn.embed_dim
+        with torch.no_grad():
+            for part, proj in enumerate((split.q_proj, split.k_proj, split.v_proj)):
+                proj.weight.copy_(attn.in_proj_weight[part * e:(part + 1) * e])
+                if proj.bias is not None:
+                    proj.bias.copy_(attn.in_proj_bias[part * e:(part + 1) * e])
+            split.out_proj.weight.copy_(attn.out_proj.weight)
+            if split.out_proj.bias is not None:
+                split.out_proj.bias.copy_(attn.out_proj.bias)
+        return split.eval()
+
+    def forward(self, query: torch.Tensor, key: torch.Tensor, value: torch.Tensor,
+                key_padding_mask: torch.Tensor | None = None, need_weights: bool = False,
+                attn_mask: torch.Tensor | None = None, average_attn_weights: bool = True,
+                is_causal: bool = False) -> tuple[torch.Tensor, None]:
+        """Như nn.MultiheadAttention.forward; value phải là key (luôn đúng trong nn.Transformer)."""
+        mask = _additive_mask(attn_mask)
+        if key_padding_mask is not None:
+            pad = _additive_mask(key_padding_mask)[:, None, None, :]
+            mask = pad if mask is None else mask + pad
+        return _attention(query, key, self, mask), None
+
+
+def _feed_forward(layer, x: torch.Tensor) -> torch.Tensor:
+    activation = layer.activation if callable(getattr(layer, "activation", None)) else F.relu
+    return layer.linear2(activation(layer.linear1(x)))
+
+
+def encoder_layer(layer: nn.TransformerEncoderLayer, x: torch.Tensor) -> torch.Tensor:
+    if getattr(layer, "norm_first", False):
+        h = layer.norm1(x)
+        x = x + _attention(h, h, layer.self_attn)
+        return x + _feed_forward(layer, layer.norm2(x))
+    x = layer.norm1(x + _attention(x, x, layer.self_attn))
+    return layer.norm2(x + _feed_forward(layer, x))
+
+
+def decoder_layer(layer: nn.TransformerDecoderLayer, x: torch.Tensor, memory: torch.Tensor,
+                  mask: torch.Tensor | None) -> torch.Tensor:
+    if getattr(layer, "norm_first", False):
+        h = layer.norm1(x)
+        x = x + _attention(h, h, layer.self_attn, mask)
+        x = x + _attention(layer.norm2(x), memory, layer.multihead_attn)
+        return x + _feed_forward(layer, layer.norm3(x))
+    x = layer.norm1(x + _attention(x, x, layer.self_attn, mask))
+    x = layer.norm2(x + _attention(x, memory, layer.multihead_attn))
+    return layer.norm3(x + _feed_forward(layer, x))
+
+
+def causal_mask(length: int | torch.Tensor, device=None) -> torch.Tensor:
+    """Mask tam giác (TxT): 0 ở vị trí được nhìn, -inf ở vị trí tương lai."""
+    ones = torch.ones(length, length, device=device)
+    return torch.triu(ones, diagonal=1) * torch.finfo(torch.float32).min
+
+
+def cnn_features(net, img: torch.Tensor) -> torch.Tensor:
+    """CNN backbone → chuỗi SxBxC (như Vgg.forward nhưng permute chỉ số dương để export ONNX)."""
+    backbone = net.cnn.model
+    if hasattr(backbone, "features") and hasattr(backbone, "last_conv_1x1"):
+        conv = backbone.last_conv_1x1(backbone.features(img))
+        return conv.transpose(2, 3).flatten(2).permute(2, 0, 1)
+    return net.cnn(img)
+
+
+def encode(net, img: torch.Tensor) -> torch.Tensor:
+    """Ảnh Bx3xHxW → memory SxBxE (tương đương transformer.forward_encoder(cnn(img)))."""
+    lt = net.transformer
+    x = lt.pos_enc(cnn_features(net, img) * math.sqrt(lt.d_model))
+    encoder = lt.transformer.encoder
+    for layer in encoder.layers:
+        x = encoder_layer(layer, x)
+    if encoder.norm is not None:
+        x = encoder.norm(x)
+    return x
+
+
+def decode(net, tgt: torch.Tensor, memory: torch.Tensor) -> torch.Tensor:
+    """tgt TxB (token) + memory SxBxE → logits BxTxV (tương đương transformer.forward_decoder)."""
+    lt = net.transformer
+    x = lt.pos_enc(lt.embed_tgt(tgt) * math.sqrt(lt.d_model))
+    mask = causal_mask(tgt.shape[0], device=tgt.device)
+    decoder = lt.transformer.decoder
+    for layer in decoder.layers:
+        x = decoder_layer(layer, x, memory, mask)
+    if decoder.norm is not None:
+        x = decoder.norm(x)
+    return lt.fc(x.transpose(0, 1))
+
+
+def _split_heads(x: torch.Tensor, heads: int) -> torch.Tensor:
+    # T x B x E → B x H x T x d
+    return x.reshape(x.shape[0], -1, heads, x.shape[-1] // heads).permute(1, 2, 0, 3)
+
+
+def _project_kv(attn: nn.Module, x: torch.Tensor) -> tuple[torch.Tensor, torch.Tensor]:
+    """K, V của x (SxBxE) theo trọng số attn → BxHxSxd."""
+    k = _in_proj(attn, x, 1)
+    v = _in_proj(attn, x, 2)
+    return _split_heads(k, attn.num_heads), _split_heads(v, attn.num_heads)
+
+
+def _attend_cached(attn: nn.Module, x: torch.Tensor, k: torch.Tensor,
+                   v: torch.Tensor) -> torch.Tensor:
+    """x: 1xBxE (token mới); k, v: BxHxSxd → 1xBxE."""
+    e = attn.embed_dim
+    q = _split_heads(_in_proj(attn, x, 0), attn.num_heads)
+    scores = torch.matmul(q, k.transpose(-1, -2)) / math.sqrt(q.shape[-1])
+    out = torch.matmul(torch.softmax(scores, dim=-1), v)
+    out = out.permute(2, 0, 1, 3).reshape(1, -1, e)
+    return attn.out_proj(out)
+
+
+class IncrementalDecoder:
+    """Decoder từng bước có cache key/value: mỗi bước chỉ tính token mới.
+
+    - Self-attention: K/V của các token đã sinh được lưu theo từng layer (B x H x t x d) và nối thêm
+      mỗi bước.
+    - Cross-attention: K/V của memory tính một lần khi khởi tạo.
+    - select(keep): bỏ các sequence đã xong khỏi batch (cắt mọi cache theo trục batch).
+    Kết quả tương đương forward_decoder trên toàn bộ prefix (eval, post-norm hoặc pre-norm).
+    """
+
+    def __init__(self, net, memory: torch.Tensor):
+        lt = net.transformer
+        self.lt = lt
+        self.layers = list(lt.transformer.decoder.layers)
+        self.norm = lt.transformer.decoder.norm
+        self.scale = math.sqrt(lt.d_model)
+        self.self_k: list[torch.Tensor | None] = [None] * len(self.layers)
+        self.self_v: list[torch.Tensor | None] = [None] * len(self.layers)
+        self.cross_k = []
+        self.cross_v = []
+        for layer in self.layers:
+            k, v = _project_kv(layer.multihead_attn, memory)
+            self.cross_k.append(k)
+            self.cross_v.append(v)
+
+    def _self_attend(self, i: int, layer, h: torch.Tensor) -> torch.Tensor:
+        k, v = _project_kv(layer.self_attn, h)
+        if self.self_k[i] is not None:
+            k = torch.cat([self.self_k[i], k], dim=2)
+            v = torch.cat([self.self_v[i], v], dim=2)
+        self.self_k[i] = k
+        self.self_v[i] = v
+        return _attend_cached(layer.self_attn, h, k, v)
+
+    def step(self, tokens: torch.Tensor, position: int) -> torch.Tensor:
+        """tokens: (B,) token ở vị trí position → logits (B, V) cho token kế tiếp."""
+        x = self.lt.embed_tgt(tokens).unsqueeze(0) * self.scale
+        x = x + self.lt.pos_enc.pe[position:position + 1]
+        for i, layer in enumerate(self.layers):
+            if getattr(layer, "norm_first", False):
+                x = x + self._self_attend(i, layer, layer.norm1(x))
+                x = x + _attend_cached(layer.multihead_attn, layer.norm2(x), self.cross_k[i],
+                                       self.cross_v[i])
+                x = x + _feed_forward(layer, layer.norm3(x))
+            else:
+                x = layer.norm1(x + self._self_attend(i, layer, x))
+                cross = _attend_cached(layer.multihead_attn, x, self.cross_k[i], self.cross_v[i])
+                x = layer.norm2(x + cross)
+                x = layer.norm3(x + _feed_forward(layer, x))
+        if self.norm is not None:
+            x = self.norm(x)
+        return self.lt.fc(x[0])
+
+    def select(self, keep: torch.Tensor) -> None:
+        """Giữ lại các sequence theo chỉ số keep (trục batch) trong mọi cache."""
+        for i in range(len(self.layers)):
+            self.cross_k[i] = self.cross_k[i].index_select(0, keep)
+            self.cross_v[i] = self.cross_v[i].index_select(0, keep)
+            if self.self_k[i] is not None:
+                self.self_k[i] = self.self_k[i].index_select(0, keep)
+                self.self_v[i] = self.self_v[i].index_select(0, keep)
+
+
+def cross_kv(net, memory: torch.Tensor) -> tuple[torch.Tensor, torch.Tensor]:
+    """K/V cross-attention của memory (SxBxE) cho mọi layer decoder → (K, V) LxBxHxSxd. Tính một lần
+    mỗi batch."""
+    layers = net.transformer.transformer.decoder.layers
+    pairs = [_project_kv(layer.multihead_attn, memory) for layer in layers]
+    return torch.stack([k for k, _ in pairs]), torch.stack([v for _, v in pairs])
+
+
+def decode_step(net, tokens: torch.Tensor, position: torch.Tensor, cross_k: torch.Tensor,
+                cross_v: torch.Tensor, past_k: torch.Tensor, past_v: torch.Tensor):
+    """Một bước decoder có cache K/V ở dạng tensor (bản không trạng thái của IncrementalDecoder, để
+    export ONNX). tokens (B,) ở vị trí position (int64, shape (1,)); past_k/past_v LxBxHxtxd (t =
+    position, có thể 0)
+    → (logits BxV, present_k, present_v LxBxHx(t+1)xd)."""
+    lt = net.transformer
+    decoder = lt.transformer.decoder
+    x = lt.embed_tgt(tokens).unsqueeze(0) * math.sqrt(lt.d_model)
+    x = x + lt.pos_enc.pe.index_select(0, position)
+    present_k = []
+    present_v = []
+    for i, layer in enumerate(decoder.layers):
+        h = layer.norm1(x) if getattr(layer, "norm_first", False) else x
+        k, v = _project_kv(layer.self_attn, h)
+        k = torch.cat([past_k[i], k], dim=2)
+        v = torch.cat([past_v[i], v], dim=2)
+        present_k.append(k)
+        present_v.append(v)
+        if getattr(layer, "norm_first", False):
+            x = x + _attend_cached(layer.self_attn, h, k, v)
+            x = x + _attend_cached(layer.multihead_attn, layer.norm2(x), cross_k[i], cross_v[i])
+            x = x + _feed_forward(layer, layer.norm3(x))
+        else:
+            x = layer.norm1(x + _attend_cached(layer.self_attn, x, k, v))
+            x = layer.norm2(x + _attend_cached(layer.multihead_attn, x, cross_k[i], cross_v[i]))
+            x = layer.norm3(x + _feed_forward(layer, x))
+    if decoder.norm is not None:
+        x = decoder.norm(x)
+    return lt.fc(x[0]), torch.stack(present_k), torch.stack(present_v)
@@ -0,0 +1,316 @@
+"""VietOCR backend ONNX Runtime (CPU): export encoder/decoder từ vietocr.weights và runtime trả cùng
+(text, conf).
+
+- Export (offline, 1 lần mỗi bộ weights):
+    python -m ocr_core.engines.vietocr_onnx [--output-dir DIR]
+  Tạo <weights>.encoder.onnx (ảnh Bx3xHxW → memory SxBxE), <weights>.decoder.onnx
+  (tgt TxB + memory → xác suất token kế tiếp BxV) và cặp decoder có cache K/V: <decoder>.init.onnx
+  (memory → K/V cross-attention mọi layer) + <decoder>.step.onnx (token mới + K/V đã có → xác suất +
+  K/V mới). Chỉ hỗ trợ seq_modeling=transformer.
+- Decode: có cặp init/step thì mỗi bước chỉ tính token mới (như IncrementalDecoder của backend
+  torch); model export trước khi có cặp này vẫn chạy bằng decoder.onnx trên toàn prefix mỗi bước
+  (O(T²)) — export lại để dùng cache.
+- Runtime: vietocr.backend: onnx trong system_config.yml (hoặc env VIETOCR_BACKEND=onnx);
+  get_vietocr_model() trả OnnxPredictor, vietocr_predict_batch dùng chung luồng batch như backend
+  torch.
+"""
+from __future__ import annotations
+
+import argparse
+import inspect
+import logging
+import os
+from pathlib import Path
+
+import numpy as np
+from PIL import Image
+
+from ocr_core.config_loader import get_system_config
+
+logger = logging.getLogger(__name__)
+
+OPSET_VERSION = 17
+
+
+def onnx_paths(cfg) -> tuple[Path, Path]:
+    """Đường dẫn encoder/decoder ONNX: vietocr.onnx_encoder / vietocr.onnx_decoder trong config,
+    mặc định cạnh file weights (<weights>.encoder.onnx, <weights>.decoder.onnx)."""
+    system = get_system_config()
+    encoder = system.resolve(system.vietocr.onnx_encoder)
+    decoder = system.resolve(system.vietocr.onnx_decoder)
+    weights = Path(str(cfg.get("weights") or "vietocr.pth"))
+    enc_path = Path(encoder) if encoder else weights.with_suffix(".encoder.onnx")
+    dec_path = Path(decoder) if decoder else weights.with_suffix(".decoder.onnx")
+    return enc_path, dec_path
+
+
+def kv_decoder_paths(dec_path: Path) -> tuple[Path, Path]:
+    """Cặp decoder có cache K/V cạnh decoder.onnx: <decoder>.init.onnx, <decoder>.step.onnx."""
+    base = dec_path.with_suffix("")
+    return base.with_name(base.name + ".init.onnx"), base.with_name(base.name + ".step.onnx")
+
+
+def _export_modules(model):
+    """Bọc VietOCR torch thành các module export được: encoder, một bước decoder trên cả prefix
+    (softmax token cuối), và cặp decoder cache K/V (init: memory → K/V cross; step: một token + K/V
+    → softmax + K/V mới). Dùng bản functional (vietocr_functional) để graph giữ trục batch/độ dài
+      động."""
+    import torch
+    from torch import nn
+
+    from ocr_core.engines import vietocr_functional as vf
+
+    class _Encoder(nn.Module):
+        def __init__(self, net):
+            super().__init__()
+            self.net = net
+
+        def forward(self, img):
+            return vf.encode(self.net, img)
+
+    class _DecoderStep(nn.Module):
+        def __init__(self, net):
+            super().__init__()
+            self.net = net
+
+        def forward(self, tgt, memory):
+            logits = vf.decode(self.net, tgt, memory)
+            return torch.softmax(logits[:, -1, :], dim=-1)
+
+    class _DecoderInit(nn.Module):
+        def __init__(self, net):
+            super().__init__()
+            self.net = net
+
+        def forward(self, memory):
+            return vf.cross_kv(self.net, memory)
+
+    class _DecoderStepKV(nn.Module):
+        def __init__(self, net):
+            super().__init__()
+            self.net = net
+
+        def forward(self, tokens, position, cross_k, cross_v, past_k, past_v):
+            logits, present_k, present_v = vf.decode_step(self.net, tokens, position, cross_k,
+                                                          cross_v, past_k, past_v)
+            return torch.softmax(logits, dim=-1), present_k, present_v
+
+    return (_Encoder(model).eval(), _DecoderStep(model).eval(),
+            _DecoderInit(model).eval(), _DecoderStepKV(model).eval())
+
+
+def export_vietocr_onnx(output_dir: str | Path | None = None) -> tuple[Path, Path]:
+    """Export VietOCR (config + weights hiện tại) sang encoder/decoder ONNX (kèm cặp decoder cache
+    K/V cạnh decoder, xem kv_decoder_paths). Trả về (encoder_path, decoder_path)."""
+    import torch
+    from vietocr.tool.predictor import Predictor
+
+    from ocr_core.engines.vietocr_engine import _vietocr_cfg
+
+    cfg = _vietocr_cfg()
+    cfg["device"] = "cpu"
+    if cfg.get("seq_modeling", "transformer") != "transformer":
+        raise ValueError(
+            f"ONNX export chỉ hỗ trợ seq_modeling=transformer, nhận {cfg.get('seq_modeling')!r}"
+        )
+    enc_path, dec_path = onnx_paths(cfg)
+    if output_dir:
+        enc_path = Path(output_dir) / enc_path.name
+        dec_path = Path(output_dir) / dec_path.name
+    enc_path.parent.mkdir(parents=True, exist_ok=True)
+    init_path, step_path = kv_decoder_paths(dec_path)
+
+    net = Predictor(cfg).model.eval()
+    encoder, decoder, decoder_init, decoder_step = _export_modules(net)
+    height = cfg["dataset"]["image_height"]
+    img = torch.rand(2, 3, height, 128)
+    tgt = torch.ones(3, 2, dtype=torch.long)
+    with torch.no_grad():
+        memory = encoder(img)
+        cross_k, cross_v = decoder_init(memory)
+        # mẫu export step ở vị trí 2 (đã có K/V 2 token); trục past động nên runtime chạy được cả
+        # bước đầu (t=0)
+        _, past_k, past_v = decoder_step(tgt[0], torch.tensor([0]), cross_k, cross_v,
+                                         cross_k[:, :, :, :0], cross_v[:, :, :, :0])
+        _, past_k, past_v = decoder_step(tgt[1], torch.tensor([1]), cross_k, cross_v,
+                                         past_k, past_v)
+    position = torch.tensor([2])
+
+    kwargs = {"opset_version": OPSET_VERSION}
+    if "dynamo" in inspect.signature(torch.onnx.export).parameters:
+        kwargs["dynamo"] = False
+    with torch.no_grad():
+        torch.onnx.export(
+            encoder, (img,), str(enc_path),
+            input_names=["img"], output_names=["memory"],
+            dynamic_axes={"img": {0: "batch", 3: "width"}, "memory": {0: "seq", 1: "batch"}},
+            **kwargs,
+        )
+        torch.onnx.export(
+            decoder, (tgt, memory), str(dec_path),
+            input_names=["tgt", "memory"], output_names=["probs"],
+            dynamic_axes={"tgt": {0: "steps", 1: "batch"}, "memory": {0: "seq", 1: "batch"},
+                          "probs": {0: "batch"}},
+            **kwargs,
+        )
+        kv_axes = {1: "batch", 3: "seq"}
+        torch.onnx.export(
+            decoder_init, (memory,), str(init_path),
+            input_names=["memory"], output_names=["cross_k", "cross_v"],
+            dynamic_axes={"memory": {0: "seq", 1: "batch"}, "cross_k": kv_axes, "cross_v": kv_axes},
+            **kwargs,
+        )
+        past_axes = {1: "batch", 3: "past"}
+        present_axes = {1: "batch", 3: "present"}
+        torch.onnx.export(
+            decoder_step, (tgt[2], position, cross_k, cross_v, past_k, past_v), str(step_path),
+            input_names=["tokens", "position", "cross_k", "cross_v", "past_k", "past_v"],
+            output_names=["probs", "present_k", "present_v"],
+            dynamic_axes={"tokens": {0: "batch"}, "cross_k": kv_axes, "cross_v": kv_axes,
+                          "past_k": past_axes, "past_v": past_axes, "probs": {0: "batch"},
+                          "present_k": present_axes, "present_v": present_axes},
+            **kwargs,
+        )
+    logger.info("[VietOCR ONNX] Đã export encoder=%s, decoder=%s, decoder K/V=%s + %s",
+                enc_path, dec_path, init_path, step_path)
+    return enc_path, dec_path
+
+
+class OnnxPredictor:
+    """Predictor VietOCR chạy bằng ONNX Runtime. Giữ các thuộc tính mà luồng batch dùng (config,
+    vocab, device)."""
+
+    backend = "onnx"
+
+    def __init__(self, cfg, encoder_path: str | Path, decoder_path: str | Path):
+        import onnxruntime as ort
+        from vietocr.model.vocab import Vocab
+
+        for path in (encoder_path, decoder_path):
+            if not Path(path).is_file():
+                raise FileNotFoundError(
+                    f"Không tìm thấy {path}. "
+                    "Chạy `python -m ocr_core.engines.vietocr_onnx` để export."
+                )
+        opts = ort.SessionOptions()
+        opts.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        threads = int(os.getenv("OCR_ORT_THREADS", "0") or 0)
+        if threads > 0:
+            opts.intra_op_num_threads = threads
+
+        def session(path):
+            return ort.InferenceSession(str(path), sess_options=opts,
+                                        providers=["CPUExecutionProvider"])
+
+        self.encoder = session(encoder_path)
+        self.decoder = session(decoder_path)
+        init_path, step_path = kv_decoder_paths(Path(decoder_path))
+        if init_path.is_file() and step_path.is_file():
+            self.decoder_init = session(init_path)
+            self.decoder_step = session(step_path)
+        else:
+            self.decoder_init = self.decoder_step = None
+            logger.warning(
+                "[VietOCR ONNX] Không có %s / %s: decode chạy lại decoder trên toàn prefix mỗi "
+                "bước (O(T²)). Export lại bằng `python -m ocr_core.engines.vietocr_onnx` để dùng "
+                "cache K/V.",
+                init_path, step_path,
+            )
+        self.config = cfg
+        self.vocab = Vocab(cfg["vocab"])
+        self.device = "cpu"
+
+    def encode(self, x: np.ndarray) -> np.ndarray:
+        """x: float32 Bx3xHxW (đã /255) → memory SxBxE."""
+        return self.encoder.run(None, {"img": x})[0]
+
+    def decode_step(self, tgt: np.ndarray, memory: np.ndarray) -> np.ndarray:
+        """tgt: int64 TxB (token đã sinh) → xác suất token kế tiếp BxV."""
+        return self.decoder.run(None, {"tgt": tgt, "memory": memory})[0]
+
+    def greedy_decode(self, x: np.ndarray, max_steps: np.ndarray | int, sos_token: int,
+                      eos_token: int):
+        """Greedy decode cả batch. max_steps: số bước tối đa (chung hoặc theo từng ảnh).
+        Ảnh đã ra <eos> hoặc hết số bước bị bỏ khỏi batch. Trả về (ids BxT, probs BxT) như luồng
+        torch. Có decoder K/V (init/step): mỗi bước chỉ tính token mới; không có: decoder.onnx trên
+        toàn prefix."""
+        n = x.shape[0]
+        caps = np.broadcast_to(np.asarray(max_steps, dtype=np.int64), (n,))
+        max_len = int(caps.max())
+        ids = np.full((n, max_len), eos_token, dtype=np.int64)
+        out_probs = np.zeros((n, max_len), dtype=np.float32)
+        memory = self.encode(x)
+        if self.decoder_step is not None:
+            self._greedy_decode_kv(memory, caps, sos_token, eos_token, ids, out_probs)
+            return ids, out_probs
+        tokens = np.full((1, n), sos_token, dtype=np.int64)
+        active = np.arange(n)
+        for step in range(max_len):
+            probs = self.decode_step(tokens, memory)
+            idx = probs.argmax(axis=-1)
+            ids[active, step] = idx
+            out_probs[active, step] = probs[np.arange(len(active)), idx]
+            alive = (idx != eos_token) & (caps[active] > step + 1)
+            if not alive.all():
+                if not alive.any():
+                    break
+                tokens, memory, idx = tokens[:, alive], memory[:, alive], idx[alive]
+                active = active[alive]
+            tokens = np.concatenate([tokens, idx[None, :].astype(np.int64)], axis=0)
+        return ids, out_probs
+
+    def _greedy_decode_kv(self, memory: np.ndarray, caps: np.ndarray, sos_token: int,
+                          eos_token: int, ids: np.ndarray, out_probs: np.ndarray) -> None:
+        """Greedy decode bằng cặp decoder init/step: K/V cross tính một lần, K/V self nối thêm mỗi
+        bước; ảnh đã xong bị cắt khỏi mọi cache (trục batch). Ghi kết quả vào ids/out_probs."""
+        cross_k, cross_v = self.decoder_init.run(None, {"memory": memory})
+        n = memory.shape[1]
+        # LxBxHx0xd: chưa có token nào
+        past_k = np.zeros(cross_k.shape[:3] + (0,) + cross_k.shape[4:], dtype=cross_k.dtype)
+        past_v = past_k
+        tokens = np.full((n,), sos_token, dtype=np.int64)
+        active = np.arange(n)
+        for step in range(ids.shape[1]):
+            probs, past_k, past_v = self.decoder_step.run(None, {
+                "tokens": tokens, "position": np.array([step], dtype=np.int64),
+                "cross_k": cross_k, "cross_v": cross_v, "past_k": past_k, "past_v": past_v,
+            })
+            idx = probs.argmax(axis=-1)
+            ids[active, step] = idx
+            out_probs[active, step] = probs[np.arange(len(active)), idx]
+            alive = (idx != eos_token) & (caps[active] > step + 1)
+            if not alive.all():
+                if not alive.any():
+                    break
+                cross_k, cross_v = cross_k[:, alive], cross_v[:, alive]
+                past_k, past_v = past_k[:, alive], past_v[:, alive]
+                idx = idx[alive]
+                active = active[alive]
+            tokens = idx.astype(np.int64)
+
+    def predict(self, img: Image.Image, return_prob: bool = False):
+        """Tương thích vietocr Predictor.predict (một ảnh)."""
+        from ocr_core.engines.vietocr_engine import predict_lines
+
+        text, conf = predict_lines(self, [img])[0]
+        return (text, conf) if return_prob else text
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(
+        description="Export VietOCR (vietocr.config + vietocr.weights) sang ONNX."
+    )
+    parser.add_argument("--output-dir", "-o", type=str, default=None,
+                        help="Thư mục ghi file .onnx (mặc định: cạnh file weights)")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+    enc_path, dec_path = export_vietocr_onnx(args.output_dir)
+    init_path, step_path = kv_decoder_paths(dec_path)
+    print(f"Encoder: {enc_path}")
+    print(f"Decoder: {dec_path}")
+    print(f"Decoder K/V: {init_path}, {step_path}")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
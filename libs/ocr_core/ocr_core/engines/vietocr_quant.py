@@ -0,0 +1,275 @@
+"""VietOCR INT8 (dynamic quantization) cho worker CPU.
+
+- Bật: vietocr.quantize: int8 trong system_config.yml hoặc env VIETOCR_QUANTIZE=int8 (backend
+  torch).
+- Mọi phép chiếu tuyến tính của transformer được quantize động sang qint8: attention q/k/v/out (tách
+  khỏi nn.MultiheadAttention thành SplitAttention), feed-forward, fc; CNN giữ fp32.
+- Weights đã quantize được cache ra đĩa (<weights>.int8.pt hoặc vietocr.quantized_weights); lần khởi
+  động sau load thẳng file cache, không cần load weights fp32. Cache tự build lại khi file weights
+  gốc thay đổi.
+- So sánh độ chính xác với fp32 trên tập mẫu:
+    python -m ocr_core.engines.vietocr_quant --samples DIR [--labels labels.tsv]
+  DIR chứa ảnh dòng (png/jpg); labels.tsv (tùy chọn): "tên_file<TAB>nội dung đúng" mỗi dòng.
+"""
+from __future__ import annotations
+
+import argparse
+import io
+import logging
+import os
+import tempfile
+import time
+from pathlib import Path
+
+from PIL import Image
+
+from ocr_core.config_loader import get_system_config
+
+logger = logging.getLogger(__name__)
+
+IMAGE_SUFFIXES = (".png", ".jpg", ".jpeg", ".bmp", ".tif", ".tiff")
+# Đổi khi cách quantize thay đổi (module trong state_dict khác) → cache INT8 cũ được build lại
+QUANT_FORMAT = 2
+
+
+def quantize_mode() -> str | None:
+    """"int8" nếu bật chế độ quantize (env VIETOCR_QUANTIZE hoặc vietocr.quantize), ngược lại
+    None."""
+    mode = get_system_config().vietocr.quantize
+    mode = "" if mode is None else str(mode).strip().lower()
+    if mode in ("int8", "1", "true"):
+        return "int8"
+    if mode in ("", "0", "false", "none", "fp32"):
+        return None
+    raise ValueError(f"vietocr.quantize không hợp lệ: {mode!r} (int8|none)")
+
+
+def quantized_cache_path(cfg) -> Path:
+    """File cache weights INT8: vietocr.quantized_weights hoặc <weights>.int8.pt."""
+    system = get_system_config()
+    path = system.resolve(system.vietocr.quantized_weights)
+    if path:
+        return Path(path)
+    return Path(str(cfg.get("weights") or "vietocr.pth")).with_suffix(".int8.pt")
+
+
+def _source_signature(weights: str) -> dict:
+    """Nhận diện file weights gốc (path, size, mtime) để biết cache còn hợp lệ."""
+    st = os.stat(weights)
+    return {"path": str(Path(weights).resolve()), "size": st.st_size, "mtime_ns": st.st_mtime_ns}
+
+
+def _split_attention(module) -> None:
+    """Thay tại chỗ mọi nn.MultiheadAttention trong module bằng SplitAttention (cùng weights)."""
+    from torch import nn
+
+    from ocr_core.engines.vietocr_functional import SplitAttention
+
+    for name, child in module.named_children():
+        if isinstance(child, nn.MultiheadAttention):
+            setattr(module, name, SplitAttention.from_attention(child))
+        else:
+            _split_attention(child)
+
+
+def quantize_model(net):
+    """Dynamic INT8 quantization cho mọi nn.Linear: encoder/decoder transformer gồm cả phép chiếu
+    attention (in_proj tách thành q/k/v, out_proj), feed-forward, fc. Sửa tại chỗ net (fp32 không
+    giữ lại: weights Linear fp32 được giải phóng sau khi quantize)."""
+    import torch
+    from torch import nn
+
+    net.eval()
+    _split_attention(net)
+    return torch.ao.quantization.quantize_dynamic(net, {nn.Linear}, dtype=torch.qint8, inplace=True)
+
+
+class QuantizedPredictor:
+    """Predictor VietOCR với model INT8; cùng thuộc tính/phương thức với vietocr Predictor."""
+
+    backend = "torch"
+
+    def __init__(self, cfg, model, vocab):
+        self.config = cfg
+        self.model = model
+        self.vocab = vocab
+        self.device = "cpu"
+
+    def predict(self, img: Image.Image, return_prob: bool = False):
+        from vietocr.tool.predictor import Predictor
+
+        return Predictor.predict(self, img, return_prob=return_prob)
+
+
+def _write_cache(cache_path: Path, payload: dict) -> None:
+    """Ghi atomic qua file tạm riêng của process: nhiều process con prefork cùng build cache lần đầu
+    không ghi đè file tạm của nhau, bên đọc không thấy file dở dang."""
+    import torch
+
+    cache_path.parent.mkdir(parents=True, exist_ok=True)
+    fd, tmp = tempfile.mkstemp(dir=cache_path.parent, prefix=cache_path.name + ".", suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            torch.save(payload, f)
+        os.chmod(tmp, 0o644)  # mkstemp tạo 0600; cache dùng chung cho mọi user chạy worker
+        os.replace(tmp, cache_path)
+    except BaseException:
+        try:
+            os.unlink(tmp)
+        except OSError:
+            pass
+        raise
+
+
+def load_quantized_predictor(cfg) -> QuantizedPredictor:
+    """Load model INT8 từ cache; chưa có (hoặc weights gốc đã đổi) thì quantize từ fp32 rồi ghi
+    cache."""
+    import torch
+    from vietocr.tool.translate import build_model
+
+    cfg["device"] = "cpu"
+    cache_path = quantized_cache_path(cfg)
+    signature = _source_signature(cfg["weights"]) if os.path.isfile(cfg["weights"]) else None
+    if cache_path.is_file():
+        try:
+            payload = torch.load(cache_path, map_location="cpu", weights_only=False)
+            fresh = payload.get("format") == QUANT_FORMAT
+            if fresh and (signature is None or payload.get("source") == signature):
+                net, vocab = build_model(cfg)
+                qnet = quantize_model(net)
+                qnet.load_state_dict(payload["state_dict"])
+                logger.info("[VietOCR INT8] Load weights đã quantize từ cache: %s", cache_path)
+                return QuantizedPredictor(cfg, qnet.eval(), vocab)
+            logger.info("[VietOCR INT8] Weights gốc/cách quantize đã thay đổi, build lại cache: %s",
+                        cache_path)
+        except Exception:
+            logger.exception("[VietOCR INT8] Cache lỗi, build lại: %s", cache_path)
+
+    from vietocr.tool.predictor import Predictor
+
+    fp32 = Predictor(cfg)
+    qnet = quantize_model(fp32.model)
+    if signature is not None:
+        payload = {"format": QUANT_FORMAT, "source": signature, "state_dict": qnet.state_dict()}
+        try:
+            _write_cache(cache_path, payload)
+            logger.info("[VietOCR INT8] Đã ghi cache weights INT8: %s", cache_path)
+        except OSError:
+            logger.exception(
+                "[VietOCR INT8] Không ghi được cache %s (vẫn dùng model INT8 trong RAM)", cache_path
+            )
+    return QuantizedPredictor(cfg, qnet.eval(), fp32.vocab)
+
+
+def _edit_distance(a: str, b: str) -> int:
+    prev = list(range(len(b) + 1))
+    for i, ca in enumerate(a, 1):
+        cur = [i]
+        for j, cb in enumerate(b, 1):
+            cur.append(min(prev[j] + 1, cur[j - 1] + 1, prev[j - 1] + (ca != cb)))
+        prev = cur
+    return prev[-1]
+
+
+def _cer(pred: str, ref: str) -> float:
+    return _edit_distance(pred, ref) / max(len(ref), 1)
+
+
+def _model_bytes(net) -> int:
+    import torch
+
+    buf = io.BytesIO()
+    torch.save(net.state_dict(), buf)
+    return buf.tell()
+
+
+def compare_with_fp32(images: list[Image.Image], labels: list[str] | None = None) -> dict:
+    """Chạy cùng tập ảnh dòng bằng fp32 và INT8; trả về độ lệch (text khớp, CER, conf, thời gian,
+    kích thước). labels (tùy chọn): nội dung đúng theo thứ tự ảnh → thêm CER/accuracy của từng model
+    so với nhãn."""
+    from vietocr.tool.predictor import Predictor
+
+    from ocr_core.engines.vietocr_engine import _vietocr_cfg, predict_lines
+
+    cfg = _vietocr_cfg()
+    cfg["device"] = "cpu"
+    fp32 = Predictor(cfg)
+    int8 = load_quantized_predictor(_vietocr_cfg())
+
+    t0 = time.perf_counter()
+    rec_fp32 = predict_lines(fp32, images)
+    t_fp32 = time.perf_counter() - t0
+    t0 = time.perf_counter()
+    rec_int8 = predict_lines(int8, images)
+    t_int8 = time.perf_counter() - t0
+
+    n = max(len(images), 1)
+    report = {
+        "samples": len(images),
+        "exact_agreement": sum(a[0] == b[0] for a, b in zip(rec_fp32, rec_int8)) / n,
+        "cer_int8_vs_fp32": sum(_cer(b[0], a[0]) for a, b in zip(rec_fp32, rec_int8)) / n,
+        "mean_conf_fp32": sum(c for _, c in rec_fp32) / n,
+        "mean_conf_int8": sum(c for _, c in rec_int8) / n,
+        "time_fp32_s": t_fp32,
+        "time_int8_s": t_int8,
+        "speedup": t_fp32 / t_int8 if t_int8 > 0 else None,
+        "model_mb_fp32": _model_bytes(fp32.model) / 2**20,
+        "model_mb_int8": _model_bytes(int8.model) / 2**20,
+    }
+    if labels is not None:
+        cer_fp32 = sum(_cer(a[0], ref) for a, ref in zip(rec_fp32, labels)) / n
+        cer_int8 = sum(_cer(b[0], ref) for b, ref in zip(rec_int8, labels)) / n
+        report.update({
+            "cer_fp32": cer_fp32,
+            "cer_int8": cer_int8,
+            "cer_delta": cer_int8 - cer_fp32,
+            "acc_fp32": sum(a[0] == ref for a, ref in zip(rec_fp32, labels)) / n,
+            "acc_int8": sum(b[0] == ref for b, ref in zip(rec_int8, labels)) / n,
+        })
+        report["acc_delta"] = report["acc_int8"] - report["acc_fp32"]
+    return report
+
+
+def _load_samples(samples_dir: Path,
+                  labels_file: Path | None) -> tuple[list[Image.Image], list[str] | None]:
+    files = sorted(p for p in samples_dir.iterdir() if p.suffix.lower() in IMAGE_SUFFIXES)
+    labels = None
+    if labels_file is not None:
+        mapping = {}
+        for line in labels_file.read_text(encoding="utf-8").splitlines():
+            if "\t" in line:
+                name, text = line.split("\t", 1)
+                mapping[name.strip()] = text
+        files = [p for p in files if p.name in mapping]
+        labels = [mapping[p.name] for p in files]
+    return [Image.open(p).convert("RGB") for p in files], labels
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(
+        description="Build cache VietOCR INT8 và so sánh độ chính xác với fp32."
+    )
+    parser.add_argument("--samples", type=str, default=None, help="Thư mục ảnh dòng mẫu")
+    parser.add_argument("--labels", type=str, default=None,
+                        help="File TSV: tên_file<TAB>nội dung đúng")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+
+    from ocr_core.engines.vietocr_engine import _vietocr_cfg
+
+    if not args.samples:
+        load_quantized_predictor(_vietocr_cfg())
+        print(f"Cache INT8: {quantized_cache_path(_vietocr_cfg())}")
+        return 0
+    images, labels = _load_samples(Path(args.samples), Path(args.labels) if args.labels else None)
+    if not images:
+        print("Không có ảnh mẫu.")
+        return 1
+    report = compare_with_fp32(images, labels)
+    for key, value in report.items():
+        print(f"{key}: {value:.4f}" if isinstance(value, float) else f"{key}: {value}")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
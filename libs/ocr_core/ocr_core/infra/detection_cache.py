@@ -0,0 +1,108 @@
+"""Cache kết quả detect (box CRAFT) theo nội dung trang.
+
+Key = blake2b(pixel trang uint8 RGB, phiên bản detector). Phiên bản detector = hash weights
+craft_net/refine_net (hoặc graph đã export) + tham số ảnh hưởng kết quả (ngưỡng, long_size,
+max_side, tiling, backend). "Chạy lại Detect" và Celery autoretry trên trang không đổi trả kết quả
+ngay, không chạy CRAFT.
+
+- Hai tầng (đĩa local LRU + object storage tùy chọn) theo DiskCache (ocr_core.infra.disk_cache):
+  mỗi trang một file <key>.json; worker gắn tầng remote (detection_cache.remote_prefix).
+- Bộ đếm hit/miss: stats().
+
+Cấu hình (infra/system_config.yml):
+  detection_cache:
+    enabled: true            # env OCR_DETECT_CACHE=0 để tắt
+    directory: /tmp/ocr-detect-cache   # env OCR_DETECT_CACHE_DIR
+    max_mb: 256
+    remote_prefix: cache/detect/       # key MinIO = prefix + key; bỏ trống = chỉ cache local
+"""
+from __future__ import annotations
+
+import hashlib
+import json
+import logging
+import os
+import tempfile
+from functools import lru_cache
+
+import numpy as np
+
+from ocr_core.config_loader import get_system_config
+from ocr_core.infra.disk_cache import DiskCache
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_DIRECTORY = os.path.join(tempfile.gettempdir(), "ocr-detect-cache")
+DEFAULT_MAX_MB = 256
+
+Boxes = list[tuple[int, int, int, int]]
+
+
+def page_key(pixels: np.ndarray, detector_version: str) -> str:
+    """Key cache cho một trang: blake2b(detector_version, shape, pixels)."""
+    h = hashlib.blake2b(digest_size=16)
+    h.update(detector_version.encode("utf-8"))
+    h.update(repr(pixels.shape).encode("ascii"))
+    h.update(np.ascontiguousarray(pixels).data)
+    return h.hexdigest()
+
+
+def _encode(boxes: Boxes) -> bytes:
+    return json.dumps([list(b) for b in boxes], separators=(",", ":")).encode("utf-8")
+
+
+def _decode(data: bytes) -> Boxes:
+    return [tuple(int(v) for v in b) for b in json.loads(data)]
+
+
+class DetectionCache(DiskCache):
+    """Cache box theo trang: LRU trên đĩa local + tầng remote (tùy chọn)."""
+
+    NAME = "Detection cache"
+    SUFFIXES = (".json",)
+    DEFAULT_DIRECTORY = DEFAULT_DIRECTORY
+    DEFAULT_MAX_MB = DEFAULT_MAX_MB
+
+    def _read_local(self, key: str) -> Boxes | None:
+        (path,) = self._paths(key)
+        try:
+            data = path.read_bytes()
+            self._touch(path)
+        except OSError:
+            return None
+        try:
+            return _decode(data)
+        except ValueError:
+            return None
+
+    def get_many(self, keys: list[str]) -> list[Boxes | None]:
+        """Tra cache cho danh sách key trang; None ở vị trí miss. Đĩa local trước, phần thiếu hỏi
+        remote (trúng remote → ghi lại local)."""
+        out: list[Boxes | None] = [self._read_local(key) for key in keys]
+        local_hits = sum(v is not None for v in out)
+        remote_hits = 0
+        for i, key in enumerate(keys):
+            if out[i] is not None:
+                continue
+            data = self._remote_get(key)
+            if data is None:
+                continue
+            out[i] = _decode(data)
+            remote_hits += 1
+            self._write_local(key, data)
+        self._count(local_hits, remote_hits, len(keys) - local_hits - remote_hits)
+        return out
+
+    def put_many(self, items: list[tuple[str, Boxes]]) -> None:
+        """Ghi kết quả detect mới vào đĩa local và remote."""
+        for key, boxes in items:
+            data = _encode(boxes)
+            self._write_local(key, data)
+            self._remote_put(key, data)
+
+
+@lru_cache(maxsize=1)
+def get_detection_cache() -> DetectionCache | None:
+    """Cache dùng chung trong process theo detection_cache.* (system_config.yml) và env; None nếu
+    tắt. Tầng remote do worker gắn vào thuộc tính remote."""
+    return DetectionCache.from_config(get_system_config().detection_cache)
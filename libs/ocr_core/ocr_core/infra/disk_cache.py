@@ -0,0 +1,191 @@
+"""Khung cache hai tầng dùng chung cho detection cache và page cache.
+
+- Tầng 1: thư mục trên đĩa local của worker (dùng chung giữa các process con), giới hạn dung lượng,
+  LRU theo mtime (đọc trúng → touch). Ghi file tạm rồi os.replace nên process khác không đọc phải
+  file dở.
+- Tầng 2 (tùy chọn): object storage (MinIO) qua đối tượng có get(key) -> bytes | None và
+  put(key, data); worker gắn tầng này vào thuộc tính remote. Lỗi tầng 2 tạm bỏ qua một lúc, không
+  làm hỏng job.
+- Bộ đếm hit/miss: stats().
+
+Lớp con khai báo SUFFIXES: các file của một entry (<dir>/<key[:2]>/<key><suffix>). File đầu tiên
+là file đánh dấu: ghi sau cùng, xóa trước tiên, mtime của nó dùng cho LRU — có file đánh dấu là
+entry đủ. Định dạng nội dung (encode/decode, blob remote) do lớp con quyết định.
+"""
+from __future__ import annotations
+
+import logging
+import os
+import tempfile
+import threading
+import time
+from pathlib import Path
+from typing import Protocol
+
+logger = logging.getLogger(__name__)
+
+# Tầng remote lỗi → tạm bỏ tầng này trong khoảng này (giây) rồi thử lại
+REMOTE_RETRY_AFTER = 60.0
+
+
+class RemoteTier(Protocol):
+    def get(self, key: str) -> bytes | None: ...
+
+    def put(self, key: str, data: bytes) -> None: ...
+
+
+class DiskCache:
+    """LRU trên đĩa local + tầng remote (tùy chọn); lớp con định nghĩa định dạng entry."""
+
+    NAME = "Disk cache"
+    SUFFIXES: tuple[str, ...] = (".bin",)
+    DEFAULT_DIRECTORY = os.path.join(tempfile.gettempdir(), "ocr-disk-cache")
+    DEFAULT_MAX_MB = 256
+
+    def __init__(self, directory: str | Path | None = None, max_bytes: int | None = None,
+                 remote: RemoteTier | None = None):
+        self.directory = Path(directory or self.DEFAULT_DIRECTORY)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.max_bytes = max(0, int(self.DEFAULT_MAX_MB << 20 if max_bytes is None else max_bytes))
+        self.remote = remote
+        self._lock = threading.Lock()
+        self._remote_down_until = 0.0
+        self._size = self._scan_size()
+        self.hits = 0
+        self.remote_hits = 0
+        self.misses = 0
+
+    @classmethod
+    def from_config(cls, section) -> DiskCache | None:
+        """Cache theo một mục cấu hình (enabled, directory, max_mb); None nếu tắt hoặc không tạo
+        được thư mục. Tầng remote do worker gắn vào thuộc tính remote."""
+        if not section.enabled:
+            return None
+        directory = section.directory or cls.DEFAULT_DIRECTORY
+        max_mb = cls.DEFAULT_MAX_MB if section.max_mb is None else section.max_mb
+        logger.info("[OCR Cache] %s: directory=%s, max_mb=%s", cls.NAME, directory, max_mb)
+        try:
+            return cls(directory=directory, max_bytes=max_mb << 20)
+        except OSError:
+            logger.exception("[OCR Cache] Không tạo được thư mục %s %s; tắt cache",
+                             cls.NAME.lower(), directory)
+            return None
+
+    def _paths(self, key: str) -> tuple[Path, ...]:
+        base = self.directory / key[:2] / key
+        return tuple(base.with_suffix(suffix) for suffix in self.SUFFIXES)
+
+    def _entries(self) -> list[tuple[float, int, Path]]:
+        """(mtime, tổng dung lượng các file, file đánh dấu) mỗi entry."""
+        out = []
+        for marker in self.directory.glob(f"*/*{self.SUFFIXES[0]}"):
+            try:
+                st = marker.stat()
+                size = st.st_size
+                for suffix in self.SUFFIXES[1:]:
+                    size += marker.with_suffix(suffix).stat().st_size
+            except OSError:
+                continue
+            out.append((st.st_mtime, size, marker))
+        return out
+
+    def _scan_size(self) -> int:
+        return sum(size for _, size, _ in self._entries())
+
+    def _evict(self) -> None:
+        """Xóa entry cũ nhất (mtime) tới khi tổng dung lượng <= 90% max_bytes. Quét lại thư mục vì
+        process khác cũng ghi vào cùng thư mục. Xóa file đánh dấu trước để process khác không đọc
+        phải entry dở; file đang mmap vẫn đọc được tới khi đóng."""
+        entries = sorted(self._entries())
+        total = sum(size for _, size, _ in entries)
+        target = int(self.max_bytes * 0.9)
+        for _, size, marker in entries:
+            if total <= target:
+                break
+            try:
+                for suffix in self.SUFFIXES:
+                    marker.with_suffix(suffix).unlink()
+                total -= size
+            except OSError:
+                pass
+        self._size = total
+
+    @staticmethod
+    def _touch(path: Path) -> None:
+        """Đọc trúng → cập nhật mtime (LRU)."""
+        os.utime(path)
+
+    @staticmethod
+    def _write_file(path: Path, data: bytes) -> None:
+        fd, tmp = tempfile.mkstemp(dir=path.parent, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+            os.replace(tmp, path)
+        except OSError:
+            try:
+                os.unlink(tmp)
+            except OSError:
+                pass
+            raise
+
+    def _write_local(self, key: str, *parts: bytes) -> None:
+        """Ghi các file của entry (theo thứ tự SUFFIXES); file đánh dấu ghi sau cùng."""
+        if self.max_bytes <= 0:
+            return
+        paths = self._paths(key)
+        try:
+            paths[0].parent.mkdir(exist_ok=True)
+            for path, data in reversed(list(zip(paths, parts))):
+                self._write_file(path, data)
+        except OSError:
+            logger.warning("[OCR Cache] Không ghi được %s %s", self.NAME.lower(), paths[0],
+                           exc_info=True)
+            return
+        with self._lock:
+            self._size += sum(len(data) for data in parts)
+            if self._size > self.max_bytes:
+                self._evict()
+
+    def _remote_available(self) -> bool:
+        return self.remote is not None and time.monotonic() >= self._remote_down_until
+
+    def _remote_failed(self, action: str) -> None:
+        self._remote_down_until = time.monotonic() + REMOTE_RETRY_AFTER
+        logger.warning("[OCR Cache] %s remote lỗi khi %s; tạm bỏ qua %.0fs", self.NAME, action,
+                       REMOTE_RETRY_AFTER, exc_info=True)
+
+    def _remote_get(self, key: str) -> bytes | None:
+        """Blob của key ở tầng remote; None nếu không có, chưa gắn remote hoặc remote đang lỗi."""
+        if not self._remote_available():
+            return None
+        try:
+            return self.remote.get(key)
+        except Exception:
+            self._remote_failed("đọc")
+            return None
+
+    def _remote_put(self, key: str, data: bytes) -> None:
+        if not self._remote_available():
+            return
+        try:
+            self.remote.put(key, data)
+        except Exception:
+            self._remote_failed("ghi")
+
+    def _count(self, hits: int = 0, remote_hits: int = 0, misses: int = 0) -> None:
+        with self._lock:
+            self.hits += hits
+            self.remote_hits += remote_hits
+            self.misses += misses
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.remote_hits + self.misses
+            return {
+                "hits": self.hits,
+                "remote_hits": self.remote_hits,
+                "misses": self.misses,
+                "hit_rate": (self.hits + self.remote_hits) / lookups if lookups else 0.0,
+                "bytes": self._size,
+            }
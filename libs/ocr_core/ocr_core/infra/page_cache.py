@@ -0,0 +1,199 @@
+"""Cache ảnh trang đã render giữa các bước của job (Detect → OCR → chạy lại Detect).
+
+Key = blake2b(checksum input, số trang, kích thước render: cạnh dài, dpi tham chiếu, xám/màu, cấu
+hình lớp text). run_job render + ghi cache; run_ocr_job / run_detect_job đọc lại trang (không tải
+input từ MinIO, không render) khi đủ trang trong cache, thiếu từ trang nào thì render tiếp từ trang
+đó.
+
+- Hai tầng (đĩa local LRU + object storage tùy chọn) theo DiskCache (ocr_core.infra.disk_cache);
+  worker khác dùng lại trang đã render, trúng remote → ghi lại local.
+- Mỗi trang: <key>.npy (pixel uint8, đọc bằng mmap — không copy cả trang vào RAM lúc mở)
+  + <key>.json (kích thước tham chiếu, lớp text PDF). .json là file đánh dấu: ghi sau .npy, xóa
+  trước, có .json là trang đủ. Blob remote = độ dài meta + meta + .npy.
+
+Cấu hình (infra/system_config.yml):
+  page_cache:
+    enabled: true            # env OCR_PAGE_CACHE=0 để tắt
+    directory: /tmp/ocr-page-cache     # env OCR_PAGE_CACHE_DIR
+    max_mb: 2048                       # env OCR_PAGE_CACHE_MB
+    remote_prefix: cache/pages/        # bỏ trống = chỉ cache local
+"""
+from __future__ import annotations
+
+import hashlib
+import io
+import json
+import logging
+import os
+import struct
+import tempfile
+from collections.abc import Callable, Iterator
+from functools import lru_cache
+
+import numpy as np
+from PIL import Image
+
+from ocr_core.config_loader import get_system_config
+from ocr_core.infra.disk_cache import DiskCache
+from ocr_core.pipeline.rasterize import RasterPage, stream_pages
+from ocr_core.pipeline.text_layer import PageTextLayer, TextWord
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_DIRECTORY = os.path.join(tempfile.gettempdir(), "ocr-page-cache")
+DEFAULT_MAX_MB = 2048
+
+
+def render_version(target_side: int | None) -> str:
+    """Các tham số quyết định pixel/metadata của trang render (cùng chuỗi → cùng ảnh)."""
+    system = get_system_config()
+    return json.dumps(
+        {
+            "side": target_side,
+            "dpi": system.rasterize.dpi,
+            "gray": system.rasterize.grayscale,
+            "text_layer": system.text_layer.model_dump(),
+        },
+        sort_keys=True,
+    )
+
+
+def page_key(checksum: str, index: int, version: str) -> str:
+    h = hashlib.blake2b(digest_size=16)
+    h.update(checksum.encode("utf-8"))
+    h.update(f":{index}:".encode("ascii"))
+    h.update(version.encode("utf-8"))
+    return h.hexdigest()
+
+
+def _encode_meta(page: RasterPage) -> bytes:
+    layer = page.text_layer
+    return json.dumps(
+        {
+            "index": page.index,
+            "ref_size": list(page.ref_size),
+            "text_layer": None if layer is None else {
+                "words": [[list(w.box), w.text, w.block, w.line] for w in layer.words],
+                "lines": [[list(box), text] for box, text in layer.lines],
+            },
+        },
+        ensure_ascii=False,
+        separators=(",", ":"),
+    ).encode("utf-8")
+
+
+def _decode_meta(data: bytes, pixels: np.ndarray) -> RasterPage:
+    meta = json.loads(data)
+    layer = meta.get("text_layer")
+    if layer is not None:
+        layer = PageTextLayer(
+            [TextWord(tuple(box), text, block, line) for box, text, block, line in layer["words"]],
+            [(tuple(box), text) for box, text in layer["lines"]],
+        )
+    img = Image.fromarray(pixels, "L" if pixels.ndim == 2 else "RGB")
+    return RasterPage(meta["index"], img, tuple(meta["ref_size"]), layer)
+
+
+def _pack(meta: bytes, npy: bytes) -> bytes:
+    """Blob tầng remote: độ dài meta (4 byte) + meta + .npy."""
+    return struct.pack("<I", len(meta)) + meta + npy
+
+
+def _unpack(data: bytes) -> tuple[bytes, bytes]:
+    (n,) = struct.unpack_from("<I", data)
+    return data[4:4 + n], data[4 + n:]
+
+
+class PageImageCache(DiskCache):
+    """Cache trang render: LRU trên đĩa local (đọc mmap) + tầng remote (tùy chọn)."""
+
+    NAME = "Page cache"
+    SUFFIXES = (".json", ".npy")
+    DEFAULT_DIRECTORY = DEFAULT_DIRECTORY
+    DEFAULT_MAX_MB = DEFAULT_MAX_MB
+
+    def _read_local(self, key: str) -> RasterPage | None:
+        meta_path, npy_path = self._paths(key)
+        try:
+            meta = meta_path.read_bytes()
+            pixels = np.load(npy_path, mmap_mode="r")
+            self._touch(meta_path)
+        except (OSError, ValueError):
+            return None
+        try:
+            return _decode_meta(meta, pixels)
+        except (ValueError, KeyError, TypeError):
+            return None
+
+    def get(self, checksum: str, index: int, version: str) -> RasterPage | None:
+        """Trang index của input checksum ở kích thước render version; None nếu miss. Đĩa local
+        trước, rồi remote."""
+        key = page_key(checksum, index, version)
+        page = self._read_local(key)
+        if page is not None:
+            self._count(hits=1)
+            return page
+        data = self._remote_get(key)
+        if data is None:
+            self._count(misses=1)
+            return None
+        meta, npy = _unpack(data)
+        self._write_local(key, meta, npy)
+        page = self._read_local(key)
+        if page is None:
+            page = _decode_meta(meta, np.load(io.BytesIO(npy)))
+        self._count(remote_hits=1)
+        return page
+
+    def put(self, checksum: str, page: RasterPage, version: str) -> None:
+        """Ghi trang vừa render vào đĩa local và remote."""
+        key = page_key(checksum, page.index, version)
+        buf = io.BytesIO()
+        np.save(buf, np.asarray(page.image), allow_pickle=False)
+        npy = buf.getvalue()
+        meta = _encode_meta(page)
+        self._write_local(key, meta, npy)
+        if self.remote is not None:
+            self._remote_put(key, _pack(meta, npy))
+
+
+@lru_cache(maxsize=1)
+def get_page_cache() -> PageImageCache | None:
+    """Cache dùng chung trong process theo page_cache.* (system_config.yml) và env; None nếu tắt.
+    Tầng remote do worker gắn vào thuộc tính remote."""
+    return PageImageCache.from_config(get_system_config().page_cache)
+
+
+def cached_pages(
+    checksum: str | None,
+    page_count: int,
+    target_side: int | None,
+    load_raw: Callable[[], bytes],
+    is_pdf: bool,
+    start: int = 0,
+    stop: int | None = None,
+) -> Iterator[RasterPage]:
+    """Luồng trang [start, stop) qua page cache: trang có sẵn đọc từ cache (mmap), từ trang miss
+    đầu tiên thì lấy input (load_raw — chỉ gọi khi cần) render tiếp bằng stream_pages và ghi cache.
+    Không có checksum / cache tắt: stream_pages như cũ."""
+    cache = get_page_cache()
+    if cache is None or not checksum:
+        yield from stream_pages(load_raw(), is_pdf, target_side, start, stop)
+        return
+    version = render_version(target_side)
+    first = start
+    page_count = page_count if stop is None else min(stop, page_count)
+    while start < page_count:
+        page = cache.get(checksum, start, version)
+        if page is None:
+            break
+        yield page
+        start += 1
+    if start >= page_count:
+        return
+    if start > first:
+        logger.info("[OCR Cache] Page cache: trang %s-%s có sẵn, render tiếp từ trang %s",
+                    first, start - 1, start)
+    for page in stream_pages(load_raw(), is_pdf, target_side, start, page_count):
+        cache.put(checksum, page, version)
+        yield page
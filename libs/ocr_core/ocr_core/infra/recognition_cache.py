@@ -0,0 +1,180 @@
+"""Cache kết quả nhận dạng theo nội dung ảnh (content-addressed).
+
+Key = hash(blake2b) của ảnh dòng đã chuẩn hóa (resize về chiều cao model, uint8 RGB — đúng input của
+model) + phiên bản model. Cùng một ảnh dòng (header biểu mẫu, tiêu đề bảng lặp lại) chỉ chạy
+inference một lần.
+
+- Tầng 1: LRU trong process (giới hạn số entry, thread-safe).
+- Tầng 2 (tùy chọn): Redis dùng chung giữa các worker (recognition_cache.redis_url hoặc env
+  OCR_REC_CACHE_REDIS_URL), entry có TTL; giới hạn dung lượng do maxmemory/eviction policy của
+  Redis. Redis lỗi thì bỏ qua tầng này một lúc, không làm hỏng OCR.
+- Bộ đếm hit/miss: stats().
+
+Cấu hình (infra/system_config.yml):
+  recognition_cache:
+    enabled: true          # env OCR_REC_CACHE=0 để tắt
+    max_entries: 20000     # env OCR_REC_CACHE_SIZE
+    redis_url: redis://host:6379/2
+    redis_ttl: 604800      # giây
+"""
+from __future__ import annotations
+
+import hashlib
+import json
+import logging
+import threading
+import time
+from collections import OrderedDict
+from functools import lru_cache
+
+import numpy as np
+
+from ocr_core.config_loader import get_system_config
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_MAX_ENTRIES = 20000
+DEFAULT_REDIS_TTL = 7 * 24 * 3600
+REDIS_KEY_PREFIX = "ocr:rec:"
+# Redis lỗi → tạm bỏ tầng Redis trong khoảng này (giây) rồi thử lại
+REDIS_RETRY_AFTER = 60.0
+
+
+def image_key(pixels: np.ndarray, model_version: str) -> str:
+    """Key cache cho một ảnh dòng đã chuẩn hóa: blake2b(model_version, shape, pixels)."""
+    h = hashlib.blake2b(digest_size=16)
+    h.update(model_version.encode("utf-8"))
+    h.update(repr(pixels.shape).encode("ascii"))
+    h.update(np.ascontiguousarray(pixels).data)
+    return h.hexdigest()
+
+
+class RecognitionCache:
+    """Cache (text, conf) theo key nội dung: LRU trong process + Redis dùng chung (tùy chọn)."""
+
+    def __init__(self, max_entries: int = DEFAULT_MAX_ENTRIES, redis_url: str | None = None,
+                 redis_ttl: int = DEFAULT_REDIS_TTL):
+        self.max_entries = max(0, int(max_entries))
+        self.redis_ttl = int(redis_ttl)
+        self._entries: OrderedDict[str, tuple[str, float]] = OrderedDict()
+        self._lock = threading.Lock()
+        self._redis = None
+        self._redis_down_until = 0.0
+        self.hits = 0
+        self.redis_hits = 0
+        self.misses = 0
+        if redis_url:
+            try:
+                import redis
+
+                self._redis = redis.Redis.from_url(
+                    redis_url, socket_timeout=1.0, socket_connect_timeout=1.0
+                )
+            except Exception:
+                logger.exception(
+                    "[OCR Cache] Không khởi tạo được Redis %s; chỉ dùng cache trong process",
+                    redis_url,
+                )
+
+    def _remember(self, key: str, value: tuple[str, float]) -> None:
+        if self.max_entries <= 0:
+            return
+        with self._lock:
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def _redis_available(self) -> bool:
+        return self._redis is not None and time.monotonic() >= self._redis_down_until
+
+    def _redis_failed(self, action: str) -> None:
+        self._redis_down_until = time.monotonic() + REDIS_RETRY_AFTER
+        logger.warning("[OCR Cache] Redis lỗi khi %s; tạm bỏ qua Redis %.0fs", action,
+                       REDIS_RETRY_AFTER, exc_info=True)
+
+    def get_many(self, keys: list[str]) -> list[tuple[str, float] | None]:
+        """Tra cache cho danh sách key; None ở vị trí miss. LRU trước, phần còn thiếu hỏi Redis
+        (MGET)."""
+        out: list[tuple[str, float] | None] = [None] * len(keys)
+        missing = []
+        with self._lock:
+            for i, key in enumerate(keys):
+                value = self._entries.get(key)
+                if value is not None:
+                    self._entries.move_to_end(key)
+                    out[i] = value
+                else:
+                    missing.append(i)
+            self.hits += len(keys) - len(missing)
+        if missing and self._redis_available():
+            try:
+                raw = self._redis.mget([REDIS_KEY_PREFIX + keys[i] for i in missing])
+            except Exception:
+                self._redis_failed("đọc")
+                raw = [None] * len(missing)
+            still_missing = []
+            for i, item in zip(missing, raw):
+                if item is None:
+                    still_missing.append(i)
+                    continue
+                text, conf = json.loads(item)
+                out[i] = (text, float(conf))
+                self._remember(keys[i], out[i])
+            with self._lock:
+                self.redis_hits += len(missing) - len(still_missing)
+            missing = still_missing
+        with self._lock:
+            self.misses += len(missing)
+        return out
+
+    def put_many(self, items: list[tuple[str, tuple[str, float]]]) -> None:
+        """Ghi kết quả mới nhận dạng vào LRU và Redis (SET EX, một pipeline)."""
+        for key, value in items:
+            self._remember(key, value)
+        if items and self._redis_available():
+            try:
+                pipe = self._redis.pipeline(transaction=False)
+                for key, (text, conf) in items:
+                    pipe.set(REDIS_KEY_PREFIX + key, json.dumps([text, conf], ensure_ascii=False),
+                             ex=self.redis_ttl)
+                pipe.execute()
+            except Exception:
+                self._redis_failed("ghi")
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.redis_hits + self.misses
+            return {
+                "hits": self.hits,
+                "redis_hits": self.redis_hits,
+                "misses": self.misses,
+                "hit_rate": (self.hits + self.redis_hits) / lookups if lookups else 0.0,
+                "entries": len(self._entries),
+            }
+
+    def clear(self) -> None:
+        """Xóa tầng LRU và reset bộ đếm (không xóa Redis)."""
+        with self._lock:
+            self._entries.clear()
+            self.hits = self.redis_hits = self.misses = 0
+
+
+@lru_cache(maxsize=1)
+def get_recognition_cache() -> RecognitionCache | None:
+    """Cache dùng chung trong process theo recognition_cache.* (system_config.yml) và env; None nếu
+    tắt."""
+    rcfg = get_system_config().recognition_cache
+    if not rcfg.enabled:
+        return None
+    max_entries = DEFAULT_MAX_ENTRIES if rcfg.max_entries is None else rcfg.max_entries
+    redis_url = rcfg.redis_url
+    redis_ttl = rcfg.redis_ttl or DEFAULT_REDIS_TTL
+    logger.info(
+        "[OCR Cache] Recognition cache: max_entries=%s, redis=%s",
+        max_entries,
+        "on" if redis_url else "off",
+    )
+    return RecognitionCache(
+        max_entries=max_entries, redis_url=redis_url or None, redis_ttl=redis_ttl
+    )
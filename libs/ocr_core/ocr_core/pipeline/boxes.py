@@ -0,0 +1,314 @@
+"""Phép toán trên box (x1, y1, x2, y2) vectorized bằng NumPy: giao/IoU từng cặp, gom nhóm box chồng
+lấn (lan truyền nhãn trên danh sách cặp) và gộp mỗi nhóm thành box bao (union).
+
+Các bước so cặp (bỏ trùng, nhóm dòng, gộp ở mép tile) không dựng ma trận n x n: cặp ứng viên lấy
+bằng sort-and-sweep theo y (chỉ các box có khoảng y chồng nhau), sinh theo từng khối tối đa
+PAIR_CHUNK cặp, nên bộ nhớ gần tuyến tính theo số box (trang tile nhiều nghìn box).
+
+postprocess_boxes: bước sau detect — bỏ box gần trùng, gộp box từ cùng dòng thành box dòng (ít lần
+gọi recognizer hơn), sắp theo thứ tự đọc (cột rồi dòng) để OcrResult có thứ tự ổn định. Cấu hình
+box_postprocess trong system_config.yml."""
+from __future__ import annotations
+
+from collections.abc import Callable, Iterator
+
+import numpy as np
+
+from ocr_core.config_loader import get_system_config
+
+# Mặc định box_postprocess: ngưỡng trùng, khoảng trống nối từ (x chiều cao dòng), tỉ lệ rộng/cao tối
+# đa của box dòng (image_max_width / image_height của VietOCR: 512 / 32), khe cột (x chiều cao box
+# trung vị)
+DEDUPE_IOU = 0.5
+DEDUPE_CONTAIN = 0.9
+LINE_GAP = 1.0
+MAX_LINE_ASPECT = 16.0
+COLUMN_GAP = 1.5
+# Số cặp ứng viên tối đa mỗi khối khi quét (giới hạn bộ nhớ tạm)
+PAIR_CHUNK = 1 << 18
+
+
+def as_array(boxes) -> np.ndarray:
+    """List (x1, y1, x2, y2) hoặc mảng → float32 (N, 4)."""
+    arr = np.asarray(boxes, dtype=np.float32)
+    return arr.reshape(-1, 4)
+
+
+def areas(boxes: np.ndarray) -> np.ndarray:
+    return np.clip(boxes[:, 2] - boxes[:, 0], 0, None) * np.clip(boxes[:, 3] - boxes[:, 1], 0, None)
+
+
+def pairwise_overlap(a: np.ndarray, b: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    """Độ chồng theo từng trục giữa mọi cặp (a[i], b[j]): (overlap_x, overlap_y), mỗi mảng (len(a),
+    len(b)), âm/0 nếu không chồng."""
+    ox = np.minimum(a[:, None, 2], b[None, :, 2]) - np.maximum(a[:, None, 0], b[None, :, 0])
+    oy = np.minimum(a[:, None, 3], b[None, :, 3]) - np.maximum(a[:, None, 1], b[None, :, 1])
+    return ox, oy
+
+
+def pairwise_intersection(a: np.ndarray, b: np.ndarray) -> np.ndarray:
+    """Diện tích giao (len(a), len(b))."""
+    ox, oy = pairwise_overlap(a, b)
+    return np.clip(ox, 0, None) * np.clip(oy, 0, None)
+
+
+def pairwise_iou(a: np.ndarray, b: np.ndarray) -> np.ndarray:
+    """IoU (len(a), len(b))."""
+    inter = pairwise_intersection(a, b)
+    union = areas(a)[:, None] + areas(b)[None, :] - inter
+    return np.where(union > 0, inter / np.maximum(union, 1e-6), 0.0)
+
+
+def connected_groups(n: int, i_idx: np.ndarray, j_idx: np.ndarray) -> np.ndarray:
+    """Nhãn nhóm (n,) cho đồ thị n đỉnh với các cạnh (i_idx[k], j_idx[k]) — lan truyền nhãn nhỏ nhất
+    qua cạnh + nhảy con trỏ (vectorized, không lặp Python theo cạnh). Nhãn là chỉ số nhỏ nhất trong
+    nhóm."""
+    labels = np.arange(n)
+    if n == 0 or len(i_idx) == 0:
+        return labels
+    i_idx = np.asarray(i_idx, dtype=np.int64)
+    j_idx = np.asarray(j_idx, dtype=np.int64)
+    while True:
+        li, lj = labels[i_idx], labels[j_idx]
+        low = np.minimum(li, lj)
+        new = labels.copy()
+        # Hạ nhãn của cả hai đầu cạnh và gốc hiện tại của chúng
+        np.minimum.at(new, i_idx, low)
+        np.minimum.at(new, j_idx, low)
+        np.minimum.at(new, li, low)
+        np.minimum.at(new, lj, low)
+        while True:
+            jumped = new[new]
+            if np.array_equal(jumped, new):
+                break
+            new = jumped
+        if np.array_equal(new, labels):
+            return labels
+        labels = new
+
+
+def candidate_pairs(boxes: np.ndarray) -> Iterator[tuple[np.ndarray, np.ndarray]]:
+    """Sort-and-sweep theo y: các khối (i, j) — mỗi cặp box có khoảng y chồng nhau (> 0) đúng một
+    lần, không theo thứ tự i < j — mỗi khối tối đa ~PAIR_CHUNK cặp. Cặp không chồng theo y thì không
+    giao nhau, không cùng dòng."""
+    n = len(boxes)
+    if n < 2:
+        return
+    order = np.argsort(boxes[:, 1], kind="stable")
+    y1 = boxes[order, 1]
+    # Box sau (theo y1) chồng với box p khi y1 của nó < y2 của p
+    stop = np.searchsorted(y1, boxes[order, 3], side="left")
+    first = np.arange(1, n + 1)
+    count = np.maximum(stop - first, 0)
+    cum = np.cumsum(count)
+    a = 0
+    while a < n:
+        base = cum[a - 1] if a else 0
+        b = max(a + 1, int(np.searchsorted(cum, base + PAIR_CHUNK, side="right")))
+        c = count[a:b]
+        total = int(c.sum())
+        if total:
+            offsets = np.cumsum(c) - c
+            p = np.repeat(np.arange(a, b), c)
+            q = np.repeat(first[a:b] - offsets, c) + np.arange(total)
+            yield order[p], order[q]
+        a = b
+
+
+def select_pairs(
+    boxes: np.ndarray, keep: Callable[[np.ndarray, np.ndarray], np.ndarray],
+) -> tuple[np.ndarray, np.ndarray]:
+    """Các cặp ứng viên (candidate_pairs) thỏa keep(i, j) → mask bool; trả về (i_idx, j_idx)."""
+    out_i: list[np.ndarray] = []
+    out_j: list[np.ndarray] = []
+    for i, j in candidate_pairs(boxes):
+        mask = keep(i, j)
+        out_i.append(i[mask])
+        out_j.append(j[mask])
+    if not out_i:
+        empty = np.zeros(0, dtype=np.int64)
+        return empty, empty
+    return np.concatenate(out_i), np.concatenate(out_j)
+
+
+def merge_groups(boxes: np.ndarray, labels: np.ndarray) -> np.ndarray:
+    """Gộp box cùng nhãn thành box bao; thứ tự theo lần xuất hiện đầu tiên của nhãn."""
+    uniq, first, inverse = np.unique(labels, return_index=True, return_inverse=True)
+    order = np.argsort(first)
+    rank = np.empty_like(order)
+    rank[order] = np.arange(len(order))
+    inverse = rank[inverse]
+    out = np.empty((len(uniq), 4), dtype=boxes.dtype)
+    out[:, :2] = np.inf
+    out[:, 2:] = -np.inf
+    np.minimum.at(out[:, 0], inverse, boxes[:, 0])
+    np.minimum.at(out[:, 1], inverse, boxes[:, 1])
+    np.maximum.at(out[:, 2], inverse, boxes[:, 2])
+    np.maximum.at(out[:, 3], inverse, boxes[:, 3])
+    return out
+
+
+def suppress_duplicates(boxes: np.ndarray, iou: float, contain: float) -> np.ndarray:
+    """Chỉ số box giữ lại sau khi bỏ box gần trùng: box i bị bỏ nếu có box j lớn hơn (cùng diện tích
+    thì chỉ số nhỏ hơn) với IoU >= iou hoặc phần giao chiếm >= contain diện tích box i. Vectorized
+    trên cặp ứng viên (chồng theo y), không lặp tham lam."""
+    n = len(boxes)
+    if n < 2:
+        return np.arange(n)
+    area = areas(boxes)
+    removed = np.zeros(n, dtype=bool)
+    for i, j in candidate_pairs(boxes):
+        a, b = boxes[i], boxes[j]
+        ox = np.minimum(a[:, 2], b[:, 2]) - np.maximum(a[:, 0], b[:, 0])
+        oy = np.minimum(a[:, 3], b[:, 3]) - np.maximum(a[:, 1], b[:, 1])
+        inter = np.clip(ox, 0, None) * np.clip(oy, 0, None)
+        ai, aj = area[i], area[j]
+        near = inter >= iou * (ai + aj - inter)
+        # i bỏ vì j (j lớn hơn), và ngược lại
+        drop_i = ((near | (inter >= contain * np.maximum(ai, 1e-6)))
+                  & ((aj > ai) | ((aj == ai) & (j < i))))
+        drop_j = ((near | (inter >= contain * np.maximum(aj, 1e-6)))
+                  & ((ai > aj) | ((ai == aj) & (i < j))))
+        removed[i[drop_i]] = True
+        removed[j[drop_j]] = True
+    return np.flatnonzero(~removed)
+
+
+def row_groups(boxes: np.ndarray, align: float, height_ratio: float) -> np.ndarray:
+    """Nhãn dòng: hai box cùng dòng nếu chồng theo trục y >= align x chiều cao box thấp hơn và tỉ lệ
+    chiều cao >= height_ratio; nhóm = thành phần liên thông."""
+    n = len(boxes)
+    if n < 2:
+        return np.zeros(n, dtype=np.int64)
+    ht = np.maximum(boxes[:, 3] - boxes[:, 1], 1e-6)
+
+    def same_row(i: np.ndarray, j: np.ndarray) -> np.ndarray:
+        oy = np.minimum(boxes[i, 3], boxes[j, 3]) - np.maximum(boxes[i, 1], boxes[j, 1])
+        lo = np.minimum(ht[i], ht[j])
+        hi = np.maximum(ht[i], ht[j])
+        return (oy >= align * lo) & (lo >= height_ratio * hi)
+
+    return connected_groups(n, *select_pairs(boxes, same_row))
+
+
+def merge_lines(boxes: np.ndarray, gap: float, max_aspect: float, align: float = 0.6,
+                height_ratio: float = 0.5) -> np.ndarray:
+    """Gộp box từ cùng dòng (row_groups) thành box dòng: trong mỗi dòng, box theo x được nối khi
+    khoảng trống tới phần đã gộp <= gap x chiều cao dòng và box dòng không vượt max_aspect
+    (rộng/cao, giới hạn ảnh dòng của recognizer). Trả về box dòng (thứ tự chưa sắp xếp)."""
+    n = len(boxes)
+    if n < 2:
+        return boxes
+    rows = row_groups(boxes, align, height_ratio)
+    labels = np.empty(n, dtype=np.int64)
+    next_label = 0
+    # Một lần sắp (dòng, x) rồi cắt theo dòng — không quét lại cả mảng cho từng dòng
+    ordered = np.lexsort((boxes[:, 0], rows))
+    bounds = np.flatnonzero(np.diff(rows[ordered])) + 1
+    for idx in np.split(ordered, bounds):
+        b = boxes[idx]
+        height = float(np.median(b[:, 3] - b[:, 1]))
+        # Khoảng trống tới mép phải xa nhất của các box trước (vectorized); vượt ngưỡng → bắt đầu
+        # đoạn mới
+        reach = np.maximum.accumulate(b[:, 2])
+        breaks = np.ones(len(idx), dtype=bool)
+        breaks[1:] = b[1:, 0] - reach[:-1] > gap * height
+        seg = np.cumsum(breaks) - 1
+        # Đoạn quá dài so với chiều cao → cắt tiếp theo max_aspect (quét tuần tự trong đoạn)
+        start_x = b[0, 0]
+        top = b[0, 1]
+        bottom = b[0, 3]
+        extra = 0
+        for k in range(len(idx)):
+            if breaks[k]:
+                start_x, top, bottom = b[k, 0], b[k, 1], b[k, 3]
+            else:
+                top, bottom = min(top, b[k, 1]), max(bottom, b[k, 3])
+                if b[k, 2] - start_x > max_aspect * (bottom - top):
+                    extra += 1
+                    start_x, top, bottom = b[k, 0], b[k, 1], b[k, 3]
+            seg[k] += extra
+        labels[idx] = next_label + seg
+        next_label += int(seg[-1]) + 1
+    return merge_groups(boxes, labels)
+
+
+def _split_axis(boxes: np.ndarray, axis: int, min_gap: float) -> list[np.ndarray]:
+    """Chia box theo khe trống trên hình chiếu trục (0 = x, 1 = y) rộng >= min_gap; nhóm theo thứ tự
+    trục."""
+    order = np.argsort(boxes[:, axis], kind="stable")
+    start = boxes[order, axis]
+    reach = np.maximum.accumulate(boxes[order, axis + 2])
+    cuts = np.flatnonzero(start[1:] - reach[:-1] >= min_gap) + 1
+    return np.split(order, cuts)
+
+
+def _merge_column_runs(boxes: np.ndarray, groups: list[np.ndarray],
+                       min_gap: float) -> list[np.ndarray]:
+    """Sau khi cắt ngang: gộp lại các dải liên tiếp đều có nhiều cột (vd. các dòng của bố cục 2 cột
+    dưới tiêu đề) để lần cắt sau tách theo cột thay vì đọc ngang qua cột. Không gộp nếu cả nút là
+    một dải (tránh lặp vô hạn)."""
+    multi = [len(g) > 1 and len(_split_axis(boxes[g], 0, min_gap)) > 1 for g in groups]
+    if all(multi):
+        return groups
+    out: list[np.ndarray] = []
+    run: list[np.ndarray] = []
+    for g, m in zip(groups, multi):
+        if m:
+            run.append(g)
+            continue
+        if run:
+            out.append(np.concatenate(run))
+            run = []
+        out.append(g)
+    if run:
+        out.append(np.concatenate(run))
+    return out
+
+
+def reading_order(boxes: np.ndarray, column_gap: float) -> np.ndarray:
+    """Thứ tự đọc (chỉ số): XY-cut đệ quy — cắt cột theo khe dọc >= column_gap x chiều cao box trung
+    vị (trái → phải), không cắt được thì cắt theo khe ngang (trên → dưới, các dải nhiều cột liên
+    tiếp giữ chung một khối); lá sắp theo dòng rồi x."""
+    n = len(boxes)
+    if n < 2:
+        return np.arange(n)
+    height = float(np.median(boxes[:, 3] - boxes[:, 1]))
+    out: list[int] = []
+    stack = [np.arange(n)]
+    while stack:
+        idx = stack.pop()
+        b = boxes[idx]
+        groups = _split_axis(b, 0, column_gap * height) if len(idx) > 1 else [np.arange(1)]
+        if len(groups) == 1 and len(idx) > 1:
+            groups = _split_axis(b, 1, 1e-3)
+            if len(groups) > 1:
+                groups = _merge_column_runs(b, groups, column_gap * height)
+        if len(groups) > 1:
+            stack.extend(idx[g] for g in reversed(groups))
+            continue
+        # Lá: dòng theo tâm y (ngắt khi tâm cách nhau > nửa chiều cao), trong dòng theo x
+        cy = (b[:, 1] + b[:, 3]) / 2
+        order = np.argsort(cy, kind="stable")
+        line = np.zeros(len(idx), dtype=np.int64)
+        line[order[1:]] = np.cumsum(np.diff(cy[order]) > 0.5 * height)
+        out.extend(idx[np.lexsort((b[:, 0], line))].tolist())
+    return np.asarray(out, dtype=np.int64)
+
+
+def postprocess_boxes(boxes) -> list[tuple[int, int, int, int]]:
+    """Box detect của một trang → bỏ trùng, gộp dòng (box_postprocess.merge_lines), sắp thứ tự đọc.
+    box_postprocess.enabled = false (env OCR_BOX_POSTPROCESS=0) → trả nguyên danh sách."""
+    cfg = get_system_config().box_postprocess
+    if not cfg.enabled or len(boxes) == 0:
+        return [tuple(b) for b in boxes]
+    arr = as_array(boxes)
+    arr = arr[suppress_duplicates(
+        arr,
+        DEDUPE_IOU if cfg.dedupe_iou is None else cfg.dedupe_iou,
+        DEDUPE_CONTAIN if cfg.dedupe_contain is None else cfg.dedupe_contain,
+    )]
+    if cfg.merge_lines:
+        arr = merge_lines(arr, cfg.line_gap or LINE_GAP, cfg.max_line_aspect or MAX_LINE_ASPECT)
+    arr = arr[reading_order(arr, cfg.column_gap or COLUMN_GAP)]
+    return [tuple(b) for b in arr.astype(int).tolist()]
@@ -1,16 +1,62 @@
-"""CRAFT text detection: load detector 1 lần/process (lru_cache). Config từ infra/system_config.yml + get_config."""
+"""CRAFT text detection: load detector 1 lần/process (lru_cache). Config từ infra/system_config.yml
++ get_config. detect_text_boxes_batch: nhiều trang letterbox vào canvas chung theo bucket kích
+thước, CRAFT + refiner chạy theo batch (thay vì một forward batch 1 cho mỗi trang). Forward qua
+get_craft_backend(): eager torch (mặc định) hoặc graph đã export ONNX/TorchScript
+(ocr_core.engines.craft_backend). Kết quả theo trang được cache theo pixel + phiên bản detector
+(ocr_core.infra.detection_cache)."""
 from __future__ import annotations
+
+import hashlib
+import json
 import os
 from functools import lru_cache
-from typing import List, Tuple
+from typing import NamedTuple
 
 import cv2
 import numpy as np
 from PIL import Image
 
-from ocr_core.config_loader import get_config, load_system_config, resolve_path
+from ocr_core.config_loader import get_system_config
+from ocr_core.infra.detection_cache import get_detection_cache, page_key
+from ocr_core.pipeline.boxes import (
+    areas,
+    connected_groups,
+    merge_groups,
+    postprocess_boxes,
+    select_pairs,
+)
+from ocr_core.pipeline.preprocess import is_blank_page, to_rgb_array
+
+Box = tuple[int, int, int, int]
 
-Box = Tuple[int, int, int, int]
+# Batch detect: số trang mỗi forward CRAFT và bước làm tròn kích thước canvas (px) khi gom trang
+# theo bucket
+DETECT_BATCH_SIZE = 4
+DETECT_BUCKET = 64
+# Ngân sách bộ nhớ mỗi forward CRAFT (MB) và ước lượng activation CRAFT + refiner (byte / pixel
+# input, đo trên CPU)
+DETECT_MEMORY_MB = 2048
+DETECT_BYTES_PER_PIXEL = 768
+# Tiled detection (craft_net.tiling): cạnh tile và độ chồng (px, độ phân giải trang)
+TILE_SIZE = 1024
+TILE_OVERLAP = 128
+# Độ phân giải thích ứng (craft_net.adaptive): chiều cao chữ tối thiểu trong input CRAFT (px) và
+# giới hạn cạnh dài; ước lượng chữ trên bản thu nhỏ cạnh dài GLYPH_ESTIMATE_SIDE, cần >=
+# GLYPH_MIN_COMPONENTS component giống ký tự, chữ đo được < GLYPH_MIN_MEASURABLE px ở bản thu nhỏ
+# coi là quá nhỏ (dùng cạnh dài tối đa)
+ADAPTIVE_MIN_GLYPH = 12
+ADAPTIVE_MIN_SIDE = 512
+ADAPTIVE_MAX_SIDE = 2560
+GLYPH_ESTIMATE_SIDE = 1024
+GLYPH_MIN_COMPONENTS = 20
+GLYPH_MIN_MEASURABLE = 4
+# Gộp box ở đường nối tile: IoU, tỉ lệ giao / box nhỏ, tỉ lệ chồng theo trục (cùng dòng/cột)
+SEAM_IOU = 0.3
+SEAM_CONTAIN = 0.5
+SEAM_ALIGN = 0.6
+# Chuẩn hóa input CRAFT (image_utils.normalizeMeanVariance), thang 0..255
+CRAFT_MEAN = np.array([0.485, 0.456, 0.406], dtype=np.float32) * 255.0
+CRAFT_STD = np.array([0.229, 0.224, 0.225], dtype=np.float32) * 255.0
 
 
 def _resize_by_max_side(img: np.ndarray, max_side: int) -> np.ndarray:
@@ -23,51 +69,45 @@ def _resize_by_max_side(img: np.ndarray, max_side: int) -> np.ndarray:
     return cv2.resize(img, (new_w, new_h), interpolation=cv2.INTER_AREA)
 
 
+_params_cache: dict = {"config": None, "params": None}
+
+
 def _craft_params():
-    """Đọc tham số CRAFT từ system_config.yml (nếu có) hoặc env. Tham chiếu OCRPipelineV2."""
-    system_config, base = load_system_config()
-    device = os.getenv("OCR_DEVICE", "cpu")
-    cuda = "cuda" in device
-
-    detect_lines = os.getenv("CRAFT_REFINER", "true").lower() in ("true", "1")
-    if system_config and get_config(system_config, ["craft_net"]) is not None:
-        pass  # giữ detect_lines từ env; có thể bổ sung key trong yml sau
-
-    weight_craft = get_config(system_config, ["craft_net", "weights"])
-    weight_refine = get_config(system_config, ["refine_net", "weights"])
-    if weight_craft is not None:
-        weight_craft = resolve_path(weight_craft, base)
-    if weight_refine is not None:
-        weight_refine = resolve_path(weight_refine, base)
-    if weight_craft is None:
-        weight_craft = os.getenv("CRAFT_WEIGHTS_CRAFT_NET") or None
-    if weight_refine is None:
-        weight_refine = os.getenv("CRAFT_WEIGHTS_REFINE_NET") or None
-
-    max_side = 0
-    if system_config:
-        max_side = get_config(system_config, ["craft_net", "max_side"]) or 0
-    if not max_side:
-        try:
-            max_side = int(os.getenv("CRAFT_MAX_SIDE", "0"))
-        except ValueError:
-            max_side = 0
-
-    return {
-        "refiner": detect_lines,
+    """Tham số CRAFT từ system_config.yml (craft_net/refine_net) + env, qua config registry. Tham
+    chiếu OCRPipelineV2. Tính lại chỉ khi config đổi (reload hoặc file đổi mtime) —
+    detect_text_boxes gọi mỗi trang."""
+    system = get_system_config()
+    if _params_cache["config"] is system:
+        return _params_cache["params"]
+    device = system.vietocr.device or "cpu"
+    params = {
+        "refiner": system.craft_net.refiner,
         "output_dir": None,
         "crop_type": "box",
-        "cuda": cuda,
+        "cuda": "cuda" in device,
         "export_extra": False,
-        "weight_path_craft_net": weight_craft,
-        "weight_path_refine_net": weight_refine,
-        "max_side": max_side,
+        "weight_path_craft_net": system.resolve(system.craft_net.weights),
+        "weight_path_refine_net": system.resolve(system.refine_net.weights),
+        "max_side": system.craft_net.max_side or 0,
     }
+    _params_cache["config"] = system
+    _params_cache["params"] = params
+    return params
+
+
+@lru_cache(maxsize=1)
+def get_craft_backend():
+    """Backend forward CRAFT + refiner theo craft_net.backend (torch | onnx | torchscript), cache
+    theo process. Backend torch dùng Craft eager của get_craft_detector()."""
+    from ocr_core.engines.craft_backend import load_craft_backend
+
+    return load_craft_backend(get_craft_detector)
 
 
 @lru_cache(maxsize=1)
 def get_craft_detector():
-    """Load CRAFT detector 1 lần; cache theo process. Config từ system_config.yml (craft_net/refine_net)."""
+    """Load CRAFT detector 1 lần; cache theo process. Config từ system_config.yml
+    (craft_net/refine_net)."""
     from craft_text_detector import Craft
 
     params = _craft_params()
@@ -82,38 +122,399 @@ def get_craft_detector():
     )
 
 
-def detect_text_boxes(img: Image.Image) -> List[Box]:
-    """Detect text regions; trả về list (x1, y1, x2, y2) từ polygon CRAFT. Có resize theo max_side nếu cấu hình."""
-    craft = get_craft_detector()
-    np_img = np.array(img)  # RGB
+def _polys_to_array(raw) -> np.ndarray:
+    """Polygon/box CRAFT (N,4,2) → float32 (M, 4) (x1, y1, x2, y2), bỏ box suy biến (vectorized)."""
+    if raw is None:
+        return np.zeros((0, 4), dtype=np.float32)
+    arr = np.asarray(raw, dtype=np.float32)
+    if arr.size == 0:
+        return np.zeros((0, 4), dtype=np.float32)
+    out = np.stack([arr[..., 0].min(axis=1), arr[..., 1].min(axis=1),
+                    arr[..., 0].max(axis=1), arr[..., 1].max(axis=1)], axis=1)
+    return out[(out[:, 2] > out[:, 0]) & (out[:, 3] > out[:, 1])]
+
+
+def _to_boxes(arr: np.ndarray) -> list[Box]:
+    if len(arr) == 0:
+        return []
+    return [tuple(b) for b in arr.astype(int).tolist()]
+
+
+def _polys_to_boxes(raw, scale: float) -> list[Box]:
+    """Polygon/box CRAFT (N,4,2) → list (x1, y1, x2, y2) (vectorized như pipeline tham chiếu), nhân
+    scale nếu ảnh đã bị thu nhỏ theo max_side trước khi detect."""
+    arr = _polys_to_array(raw)
+    if scale > 1:
+        arr = arr * scale
+    return _to_boxes(arr)
+
+
+def _round_up(value: int, multiple: int) -> int:
+    return -(-value // multiple) * multiple
+
+
+def _detect_batch_params() -> tuple[int, int]:
+    """(số trang mỗi forward, bước làm tròn kích thước bucket) từ craft_net.batch_size /
+    craft_net.bucket."""
+    cfg = get_system_config().craft_net
+    return cfg.batch_size or DETECT_BATCH_SIZE, cfg.bucket or DETECT_BUCKET
+
+
+def estimate_glyph_height(img: np.ndarray) -> float | None:
+    """Ước lượng chiều cao ký tự chủ đạo (px, theo tọa độ img) từ thống kê connected component trên
+    bản thu nhỏ (cạnh dài <= GLYPH_ESTIMATE_SIDE, nhị phân Otsu). None nếu quá ít component giống ký
+    tự (trang trống/ảnh); 0.0 nếu chữ quá nhỏ để đo ở độ phân giải ước lượng (gọi phía dùng độ phân
+    giải tối đa)."""
+    h, w = img.shape[:2]
+    s = min(1.0, GLYPH_ESTIMATE_SIDE / max(h, w))
+    if s >= 1.0:
+        small = img
+    else:
+        small = cv2.resize(img, (max(1, int(w * s)), max(1, int(h * s))),
+                           interpolation=cv2.INTER_AREA)
+    gray = cv2.cvtColor(small, cv2.COLOR_RGB2GRAY)
+    _, ink = cv2.threshold(gray, 0, 255, cv2.THRESH_BINARY_INV | cv2.THRESH_OTSU)
+    n, _, stats, _ = cv2.connectedComponentsWithStats(ink, connectivity=8)
+    cw = stats[1:, cv2.CC_STAT_WIDTH]
+    ch = stats[1:, cv2.CC_STAT_HEIGHT]
+    fill = stats[1:, cv2.CC_STAT_AREA] / np.maximum(cw * ch, 1)
+    # Giống ký tự: không quá nhỏ (nhiễu), không quá lớn (khung, ảnh), tỉ lệ rộng/cao hợp lý, mật độ
+    # mực vừa phải
+    glyph = (ch >= 2) & (ch <= 0.2 * ink.shape[0]) & (cw <= 3 * ch) & (ch <= 8 * cw) & (fill >= 0.1)
+    if glyph.sum() < GLYPH_MIN_COMPONENTS:
+        return None
+    height = float(np.median(ch[glyph]))
+    if height < GLYPH_MIN_MEASURABLE:
+        return 0.0
+    return height / s
+
+
+def _adaptive_params() -> tuple[int, int, int] | None:
+    """(chiều cao chữ tối thiểu trong input CRAFT, cạnh dài tối thiểu, cạnh dài tối đa) nếu bật
+    craft_net.adaptive."""
+    cfg = get_system_config().craft_net
+    if not cfg.adaptive:
+        return None
+    return (cfg.adaptive_min_glyph or ADAPTIVE_MIN_GLYPH,
+            cfg.adaptive_min_side or ADAPTIVE_MIN_SIDE,
+            cfg.adaptive_max_side or ADAPTIVE_MAX_SIDE)
+
+
+def _adaptive_long_size(img: np.ndarray, long_size: int, adaptive: tuple[int, int, int]) -> int:
+    """Cạnh dài input CRAFT nhỏ nhất giữ chữ chủ đạo >= min_glyph px, trong [min_side, max_side].
+    Không ước lượng được (trang trống/ảnh) → long_size mặc định; chữ quá nhỏ để đo → max_side."""
+    min_glyph, min_side, max_side = adaptive
+    glyph = estimate_glyph_height(img)
+    if glyph is None:
+        return long_size
+    if glyph <= 0:
+        return max_side
+    target = max(img.shape[:2]) * min_glyph / glyph
+    return int(min(max(_round_up(int(target), 32), min_side), max_side))
+
+
+def _prepare_page(img: Image.Image | np.ndarray, max_side: int, long_size: int,
+                  adaptive: tuple[int, int, int] | None = None):
+    """Một trang → (ảnh đã resize về long_size cạnh dài như CRAFT, target_ratio, (h32, w32), scale
+    max_side). Giống image_utils.resize_aspect_ratio nhưng chưa pad — pad chung khi ghép batch.
+    adaptive: chọn long_size theo chiều cao chữ ước lượng (_adaptive_long_size) thay vì cố định."""
+    np_img = to_rgb_array(img)
     h0, w0 = np_img.shape[:2]
-    params = _craft_params()
-    max_side = params.get("max_side") or 0
     scale = 1.0
     if max_side > 0:
         scale = max(h0, w0) / max_side
         if scale > 1:
             np_img = _resize_by_max_side(np_img, max_side)
-    prediction_result = craft.detect_text(np_img)
-    # CRAFT trả về "boxes" (N,4,2); xử lý vectorized như pipeline tham chiếu
-    raw = prediction_result.get("boxes")
-    if raw is None:
-        return []
-    arr = np.asarray(raw, dtype=np.float32)
-    if arr.size == 0:
+    h, w = np_img.shape[:2]
+    if adaptive is not None:
+        long_size = _adaptive_long_size(np_img, long_size, adaptive)
+    ratio = long_size / max(h, w)
+    target_h, target_w = int(h * ratio), int(w * ratio)
+    resized = cv2.resize(np_img, (target_w, target_h), interpolation=cv2.INTER_LINEAR)
+    return resized, ratio, (_round_up(target_h, 32), _round_up(target_w, 32)), scale
+
+
+def detect_input_side() -> int | None:
+    """Cạnh dài trang mà detect thực sự dùng (craft_net.max_side hoặc long_size mặc định của CRAFT)
+    — render PDF ở kích thước này thì không phải resize lại. None khi tiling/adaptive (cần độ phân
+    giải gốc của trang)."""
+    from ocr_core.engines.craft_backend import LONG_SIZE
+
+    if _tile_params() is not None or _adaptive_params() is not None:
+        return None
+    max_side = _craft_params().get("max_side") or 0
+    return min(max_side, LONG_SIZE) if max_side else LONG_SIZE
+
+
+def _tile_params() -> tuple[int, int] | None:
+    """(tile_size, tile_overlap) nếu bật craft_net.tiling, ngược lại None."""
+    cfg = get_system_config().craft_net
+    if not cfg.tiling:
+        return None
+    size = cfg.tile_size or TILE_SIZE
+    overlap = TILE_OVERLAP if cfg.tile_overlap is None else cfg.tile_overlap
+    return size, min(overlap, size // 2)
+
+
+def _memory_limit(height: int, width: int) -> int:
+    """Số ảnh tối đa mỗi forward để activation CRAFT (ước lượng DETECT_BYTES_PER_PIXEL) nằm trong
+    craft_net.memory_mb (env CRAFT_MEMORY_MB); tối thiểu 1."""
+    budget = (get_system_config().craft_net.memory_mb or DETECT_MEMORY_MB) * 1024 * 1024
+    return max(1, int(budget // (height * width * DETECT_BYTES_PER_PIXEL)))
+
+
+def _tile_starts(length: int, size: int, overlap: int) -> list[int]:
+    """Vị trí bắt đầu các tile phủ [0, length) với bước size - overlap; tile cuối căn sát mép."""
+    if length <= size:
+        return [0]
+    step = size - overlap
+    n = -(-(length - overlap) // step)
+    return np.minimum(np.arange(n) * step, length - size).tolist()
+
+
+class _DetectUnit(NamedTuple):
+    """Một ảnh đưa vào CRAFT: cả trang (đã resize theo long_size) hoặc một tile (độ phân giải gốc).
+    ratio: kích thước input / kích thước trang (đã max_side); scale: hệ số max_side; offset: góc
+    tile (x, y)."""
+    page: int
+    image: np.ndarray
+    ratio: float
+    shape32: tuple[int, int]
+    scale: float
+    offset: tuple[int, int]
+
+
+def _page_units(page: int, img: Image.Image | np.ndarray, max_side: int, long_size: int,
+                tiling: tuple[int, int] | None,
+                adaptive: tuple[int, int, int] | None = None) -> list[_DetectUnit]:
+    """Trang → unit CRAFT. Khi bật tiling và trang lớn hơn long_size (CRAFT sẽ thu nhỏ), chia trang
+    ở độ phân giải gốc thành các tile chồng nhau (không áp max_side) để giữ chữ nhỏ; tile là view,
+    không copy."""
+    np_img = to_rgb_array(img)
+    h, w = np_img.shape[:2]
+    if tiling is not None and max(h, w) > max(long_size, tiling[0]):
+        size, overlap = tiling
+        units = []
+        for y0 in _tile_starts(h, size, overlap):
+            for x0 in _tile_starts(w, size, overlap):
+                tile = np_img[y0:y0 + size, x0:x0 + size]
+                th, tw = tile.shape[:2]
+                shape32 = (_round_up(th, 32), _round_up(tw, 32))
+                units.append(_DetectUnit(page, tile, 1.0, shape32, 1.0, (x0, y0)))
+        return units
+    resized, ratio, shape32, scale = _prepare_page(np_img, max_side, long_size, adaptive)
+    return [_DetectUnit(page, resized, ratio, shape32, scale, (0, 0))]
+
+
+def _merge_seam_boxes(boxes: np.ndarray, tile_ids: np.ndarray,
+                      seams: list[tuple[int, int, int]]) -> np.ndarray:
+    """Gộp box bị cắt/lặp ở vùng chồng giữa các tile. Chỉ xét box chạm dải chồng (seams: (trục, lo,
+    hi), trục 0 = x, 1 = y); hai box của hai tile khác nhau được gộp nếu giao nhau và IoU >=
+    SEAM_IOU, hoặc phần giao chiếm >= SEAM_CONTAIN box nhỏ hơn, hoặc cùng dòng/cột (chồng >=
+    SEAM_ALIGN theo trục vuông góc)."""
+    if len(boxes) < 2 or not seams:
+        return boxes
+    near = np.zeros(len(boxes), dtype=bool)
+    for axis, lo, hi in seams:
+        near |= (boxes[:, axis] < hi) & (boxes[:, axis + 2] > lo)
+    cand = np.flatnonzero(near)
+    if len(cand) < 2:
+        return boxes
+    c = boxes[cand]
+    area = areas(c)
+    wd = c[:, 2] - c[:, 0]
+    ht = c[:, 3] - c[:, 1]
+    tiles = tile_ids[cand]
+
+    def should_merge(i: np.ndarray, j: np.ndarray) -> np.ndarray:
+        ox = np.minimum(c[i, 2], c[j, 2]) - np.maximum(c[i, 0], c[j, 0])
+        oy = np.minimum(c[i, 3], c[j, 3]) - np.maximum(c[i, 1], c[j, 1])
+        inter = np.clip(ox, 0, None) * np.clip(oy, 0, None)
+        union = area[i] + area[j] - inter
+        min_area = np.maximum(np.minimum(area[i], area[j]), 1e-6)
+        min_h = np.maximum(np.minimum(ht[i], ht[j]), 1e-6)
+        min_w = np.maximum(np.minimum(wd[i], wd[j]), 1e-6)
+        merge = (inter > 0) & (
+            (inter >= SEAM_IOU * union) | (inter >= SEAM_CONTAIN * min_area)
+            | (oy >= SEAM_ALIGN * min_h) | (ox >= SEAM_ALIGN * min_w)
+        )
+        return merge & (tiles[i] != tiles[j])
+
+    # Cặp ứng viên bằng sweep theo y (merge cần giao nhau) — không dựng ma trận n x n
+    i_idx, j_idx = select_pairs(c, should_merge)
+    if len(i_idx) == 0:
+        return boxes
+    labels = np.arange(len(boxes))
+    labels[cand] = cand[connected_groups(len(cand), i_idx, j_idx)]
+    return merge_groups(boxes, labels)
+
+
+def _seams(units: list[_DetectUnit]) -> list[tuple[int, int, int]]:
+    """Dải chồng giữa các tile liền kề: (trục, lo, hi) theo tọa độ trang."""
+    seams = []
+    for axis in (0, 1):
+        spans = sorted({(u.offset[axis], u.offset[axis] + u.image.shape[1 - axis]) for u in units})
+        for (_, prev_end), (next_start, _) in zip(spans, spans[1:]):
+            if next_start < prev_end:
+                seams.append((axis, next_start, prev_end))
+    return seams
+
+
+def _forward_batch(backend, images: list[np.ndarray], height: int,
+                   width: int) -> tuple[np.ndarray, np.ndarray]:
+    """Letterbox các trang (pad 0 ở dưới/phải như CRAFT) vào canvas height x width, chuẩn hóa
+    mean/variance một lần cho cả batch, chạy CRAFT + refiner (backend torch/onnx/torchscript) trên
+    tensor xếp chồng. Trả về (score_text, score_link) BxH/2xW/2."""
+    canvas = np.zeros((len(images), height, width, 3), dtype=np.float32)
+    for i, im in enumerate(images):
+        canvas[i, :im.shape[0], :im.shape[1]] = im
+    canvas -= CRAFT_MEAN
+    canvas /= CRAFT_STD
+    return backend.forward(np.ascontiguousarray(canvas.transpose(0, 3, 1, 2)))
+
+
+def _detect_pages(pages: list[np.ndarray]) -> list[list[Box]]:
+    """Detect nhiều trang được resize như CRAFT (cạnh dài long_size, bội 32), gom theo bucket kích
+    thước (làm tròn lên craft_net.bucket px), letterbox vào canvas chung và chạy CRAFT + refiner
+    theo batch (craft_net.batch_size trang/forward, giới hạn thêm bởi craft_net.memory_mb). Bật
+    craft_net.tiling: trang lớn chạy theo tile chồng nhau ở độ phân giải gốc, box ở đường nối tile
+    được gộp (_merge_seam_boxes). Box trả về theo tọa độ của từng trang, cùng thứ tự pages."""
+    from craft_text_detector import craft_utils
+
+    backend = get_craft_backend()
+    max_side = _craft_params().get("max_side") or 0
+    batch_size, bucket = _detect_batch_params()
+    tiling = _tile_params()
+    adaptive = _adaptive_params()
+    units = [
+        u for i, img in enumerate(pages)
+        for u in _page_units(i, img, max_side, backend.long_size, tiling, adaptive)
+    ]
+    buckets: dict[tuple[int, int], list[int]] = {}
+    for k, u in enumerate(units):
+        key = (_round_up(u.shape32[0], bucket), _round_up(u.shape32[1], bucket))
+        buckets.setdefault(key, []).append(k)
+
+    found: list[list[np.ndarray]] = [[] for _ in pages]
+    tile_ids: list[list[np.ndarray]] = [[] for _ in pages]
+    for (height, width), idx_all in buckets.items():
+        step = min(batch_size, _memory_limit(height, width))
+        for start in range(0, len(idx_all), step):
+            idx = idx_all[start:start + step]
+            images = [units[k].image for k in idx]
+            score_text, score_link = _forward_batch(backend, images, height, width)
+            for j, k in enumerate(idx):
+                u = units[k]
+                h32, w32 = u.shape32
+                # Chỉ lấy vùng heatmap của unit (bỏ phần letterbox), heatmap = 1/2 kích thước input
+                text = score_text[j, :h32 // 2, :w32 // 2]
+                link = score_link[j, :h32 // 2, :w32 // 2]
+                boxes, _ = craft_utils.getDetBoxes(
+                    text, link, backend.text_threshold, backend.link_threshold, backend.low_text,
+                    False,
+                )
+                boxes = craft_utils.adjustResultCoordinates(boxes, 1 / u.ratio, 1 / u.ratio)
+                arr = _polys_to_array(boxes)
+                if u.scale > 1:
+                    arr = arr * u.scale
+                arr[:, [0, 2]] += u.offset[0]
+                arr[:, [1, 3]] += u.offset[1]
+                found[u.page].append(arr)
+                tile_ids[u.page].append(np.full(len(arr), k))
+
+    out: list[list[Box]] = []
+    for page, arrs in enumerate(found):
+        arr = np.concatenate(arrs) if arrs else np.zeros((0, 4), dtype=np.float32)
+        page_units = [u for u in units if u.page == page]
+        if len(page_units) > 1:
+            arr = _merge_seam_boxes(arr, np.concatenate(tile_ids[page]), _seams(page_units))
+        out.append(_to_boxes(arr))
+    return out
+
+
+_version_cache: dict = {"key": None, "version": None}
+
+
+def _file_digest(h, path: str | None) -> None:
+    if path and os.path.isfile(path):
+        with open(path, "rb") as f:
+            for chunk in iter(lambda: f.read(1 << 20), b""):
+                h.update(chunk)
+    else:
+        h.update(str(path).encode("utf-8"))
+
+
+def detector_version() -> str:
+    """Hash weights detector (craft_net/refine_net hoặc graph ONNX/TorchScript đang dùng) + tham số
+    ảnh hưởng box (backend, ngưỡng, long_size, max_side, tiling, adaptive). Đổi weights/config → key
+    detection cache mới. Tính lại chỉ khi config đổi."""
+    system = get_system_config()
+    backend = get_craft_backend()
+    if _version_cache["key"] == (system, backend):
+        return _version_cache["version"]
+    from ocr_core.engines.craft_backend import export_paths
+
+    params = _craft_params()
+    h = hashlib.blake2b(digest_size=8)
+    if backend.name in ("onnx", "torchscript"):
+        _file_digest(h, str(export_paths()[backend.name]))
+    else:
+        _file_digest(h, params["weight_path_craft_net"])
+        if params["refiner"]:
+            _file_digest(h, params["weight_path_refine_net"])
+    h.update(json.dumps({
+        "backend": backend.name,
+        "refiner": params["refiner"],
+        "thresholds": [backend.text_threshold, backend.link_threshold, backend.low_text],
+        "long_size": backend.long_size,
+        "max_side": params["max_side"],
+        "tiling": _tile_params(),
+        "adaptive": _adaptive_params(),
+    }, sort_keys=True).encode("utf-8"))
+    _version_cache["key"] = (system, backend)
+    _version_cache["version"] = h.hexdigest()
+    return _version_cache["version"]
+
+
+def detect_text_boxes_batch(pages: list[Image.Image | np.ndarray], use_cache: bool = True,
+                            skip_blank: bool = True) -> list[list[Box]]:
+    """Detect nhiều trang: trang được resize như CRAFT (cạnh dài long_size, bội 32), gom theo bucket
+    kích thước (làm tròn lên craft_net.bucket px), letterbox vào canvas chung và chạy CRAFT +
+    refiner theo batch (craft_net.batch_size trang/forward, giới hạn thêm bởi craft_net.memory_mb).
+    Bật craft_net.tiling: trang lớn chạy theo tile chồng nhau ở độ phân giải gốc, box ở đường nối
+    tile được gộp. Trang trắng (is_blank_page, khi skip_blank) trả [] không qua model; trang đã
+    detect với cùng pixel + detector (detector_version) lấy từ detection cache, chỉ trang miss chạy
+    CRAFT. Box thô qua postprocess_boxes (bỏ trùng, gộp dòng, thứ tự đọc). Box theo tọa độ của từng
+    trang, cùng thứ tự pages."""
+    if not pages:
         return []
-    xs = arr[..., 0]
-    ys = arr[..., 1]
-    x_min = xs.min(axis=1)
-    x_max = xs.max(axis=1)
-    y_min = ys.min(axis=1)
-    y_max = ys.max(axis=1)
-    valid = (x_max > x_min) & (y_max > y_min)
-    x1 = x_min[valid]
-    y1 = y_min[valid]
-    x2 = x_max[valid]
-    y2 = y_max[valid]
-    if scale > 1:
-        x1, x2 = x1 * scale, x2 * scale
-        y1, y2 = y1 * scale, y2 * scale
-    return list(zip(x1.astype(int).tolist(), y1.astype(int).tolist(), x2.astype(int).tolist(), y2.astype(int).tolist()))
\ No newline at end of file
+    arrays = [to_rgb_array(img) for img in pages]
+    out: list[list[Box]] = [[] for _ in arrays]
+    todo = [i for i, a in enumerate(arrays) if not (skip_blank and is_blank_page(a))]
+    if todo:
+        for i, boxes in zip(todo, _detect_cached([arrays[i] for i in todo], use_cache)):
+            out[i] = postprocess_boxes(boxes)
+    return out
+
+
+def _detect_cached(arrays: list[np.ndarray], use_cache: bool) -> list[list[Box]]:
+    """Box CRAFT thô (chưa postprocess) theo trang: trang trúng detection cache không chạy CRAFT."""
+    cache = get_detection_cache() if use_cache else None
+    if cache is None:
+        return _detect_pages(arrays)
+    version = detector_version()
+    keys = [page_key(a, version) for a in arrays]
+    out = cache.get_many(keys)
+    todo = [i for i, boxes in enumerate(out) if boxes is None]
+    if todo:
+        for i, boxes in zip(todo, _detect_pages([arrays[i] for i in todo])):
+            out[i] = boxes
+        cache.put_many([(keys[i], out[i]) for i in todo])
+    return out
+
+
+def detect_text_boxes(img: Image.Image | np.ndarray) -> list[Box]:
+    """Detect text regions; trả về list (x1, y1, x2, y2) từ polygon CRAFT. Có resize theo max_side
+    nếu cấu hình. img: mảng uint8 HxWx3 RGB (preprocess_array, dùng trực tiếp không copy) hoặc ảnh
+    PIL. Một trang = detect_text_boxes_batch với batch 1."""
+    return detect_text_boxes_batch([img])[0]
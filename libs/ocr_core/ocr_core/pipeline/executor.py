@@ -0,0 +1,164 @@
+"""Executor pipeline theo stage: các stage chạy đồng thời, nối với nhau bằng hàng đợi có giới hạn.
+
+Mỗi stage là một hàm xử lý một phần tử, chạy trên `workers` thread riêng; giữa hai stage là
+queue.Queue(maxsize) nên stage nhanh bị chặn khi stage sau chưa kịp tiêu thụ (back-pressure, bộ nhớ
+giới hạn theo số phần tử trong hàng đợi). Stage nặng (CRAFT, VietOCR) chạy trong torch/ONNX
+Runtime/cv2 — nhả GIL — nên vd. detect trang n+1 chạy song song với recognize trang n.
+
+- Kết quả trả về đúng thứ tự đầu vào (stage nhiều worker có thể xong lệch thứ tự → sắp lại ở đầu
+  ra).
+- Lỗi ở bất kỳ stage nào dừng toàn pipeline và được raise lại ở phía tiêu thụ; đóng generator sớm
+  cũng dừng. Khi dừng (hết, lỗi, đóng sớm) iterator nguồn được close() ngay và mọi thread được join
+  trước khi run() trả về.
+- stats(): thời gian bận của từng stage (cộng các worker), để biết stage nghẽn.
+"""
+from __future__ import annotations
+
+import logging
+import queue
+import threading
+import time
+from collections.abc import Callable, Iterable, Iterator
+from typing import Any, NamedTuple
+
+logger = logging.getLogger(__name__)
+
+# Phần tử kết thúc luồng trong hàng đợi
+_END = object()
+# Chu kỳ kiểm tra cờ dừng khi chờ hàng đợi (giây)
+_POLL = 0.1
+
+
+class Stage(NamedTuple):
+    name: str
+    fn: Callable[[Any], Any]
+    workers: int = 1
+
+
+class StagedPipeline:
+    """Chạy items qua các stage nối tiếp. Dùng: `for out in StagedPipeline(stages,
+    maxsize).run(items): ...`."""
+
+    def __init__(self, stages: list[Stage], maxsize: int = 2):
+        if not stages:
+            raise ValueError("Pipeline cần ít nhất một stage")
+        self.stages = [s._replace(workers=max(1, s.workers)) for s in stages]
+        self.maxsize = max(1, maxsize)
+        self._stop = threading.Event()
+        self._error: BaseException | None = None
+        self._lock = threading.Lock()
+        self._busy = {s.name: 0.0 for s in self.stages}
+        self._count = {s.name: 0 for s in self.stages}
+
+    def _fail(self, error: BaseException) -> None:
+        with self._lock:
+            if self._error is None:
+                self._error = error
+        self._stop.set()
+
+    def _put(self, q: queue.Queue, item) -> bool:
+        while not self._stop.is_set():
+            try:
+                q.put(item, timeout=_POLL)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def _get(self, q: queue.Queue):
+        while not self._stop.is_set():
+            try:
+                return q.get(timeout=_POLL)
+            except queue.Empty:
+                continue
+        return _END
+
+    def _feed(self, items: Iterable, out: queue.Queue) -> None:
+        """Stage nguồn: đánh số thứ tự và đẩy items vào hàng đợi đầu (iterator lười, vd. luồng trang
+        render). Iterator được close() khi thoát (kể cả pipeline dừng giữa chừng) để nhả tài nguyên
+        của nó ngay."""
+        it = iter(items)
+        try:
+            for seq, item in enumerate(it):
+                if not self._put(out, (seq, item)):
+                    return
+            self._put(out, _END)
+        except BaseException as e:
+            self._fail(e)
+        finally:
+            close = getattr(it, "close", None)
+            if close is not None:
+                try:
+                    close()
+                except BaseException as e:
+                    logger.exception("[OCR Pipeline] Lỗi khi đóng nguồn pipeline")
+                    self._fail(e)
+
+    def _work(self, stage: Stage, inp: queue.Queue, out: queue.Queue, remaining: list[int]) -> None:
+        """Worker của một stage. _END được trả lại hàng đợi vào cho worker cùng stage; worker cuối
+        cùng thoát mới đẩy _END sang stage sau."""
+        try:
+            while True:
+                entry = self._get(inp)
+                if entry is _END:
+                    if not self._stop.is_set():
+                        self._put(inp, _END)
+                    break
+                seq, item = entry
+                t0 = time.perf_counter()
+                result = stage.fn(item)
+                with self._lock:
+                    self._busy[stage.name] += time.perf_counter() - t0
+                    self._count[stage.name] += 1
+                if not self._put(out, (seq, result)):
+                    break
+        except BaseException as e:
+            logger.exception("[OCR Pipeline] Stage %s lỗi", stage.name)
+            self._fail(e)
+        finally:
+            with self._lock:
+                remaining[0] -= 1
+                last = remaining[0] == 0
+            if last and not self._stop.is_set():
+                self._put(out, _END)
+
+    def run(self, items: Iterable) -> Iterator:
+        """Kết quả stage cuối theo thứ tự items."""
+        queues = [queue.Queue(maxsize=self.maxsize) for _ in range(len(self.stages) + 1)]
+        threads = [threading.Thread(target=self._feed, args=(items, queues[0]),
+                                    name="ocr-pipe-source", daemon=True)]
+        for i, stage in enumerate(self.stages):
+            remaining = [stage.workers]
+            for w in range(stage.workers):
+                threads.append(threading.Thread(
+                    target=self._work, args=(stage, queues[i], queues[i + 1], remaining),
+                    name=f"ocr-pipe-{stage.name}-{w}", daemon=True,
+                ))
+        for t in threads:
+            t.start()
+        pending: dict[int, Any] = {}
+        next_seq = 0
+        try:
+            while True:
+                entry = self._get(queues[-1])
+                if entry is _END:
+                    break
+                seq, result = entry
+                pending[seq] = result
+                while next_seq in pending:
+                    yield pending.pop(next_seq)
+                    next_seq += 1
+            if self._error is not None:
+                raise self._error
+        finally:
+            self._stop.set()
+            for t in threads:
+                t.join()
+
+    def stats(self) -> dict:
+        """{stage: {"items": n, "busy_s": giây}} — tổng thời gian xử lý của các worker mỗi stage."""
+        with self._lock:
+            return {
+                name: {"items": self._count[name], "busy_s": round(self._busy[name], 3)}
+                for name in self._busy
+            }
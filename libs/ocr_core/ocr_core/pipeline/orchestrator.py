@@ -3,19 +3,38 @@ Pipeline OCR: Preprocess → CRAFT (detect) → VietOCR (recognize) → Postproc
 
 - CRAFT chỉ phát hiện vùng (box); user có thể chỉnh sửa/gộp vùng rồi lưu vào cột detect_result (DB).
 - run_ocr_with_boxes: đọc boxes từ detect_result (DB), Recognize bằng VietOCR. Vùng cao (nhiều dòng)
-  được VietOCR engine tách thành từng dòng rồi ghép kết quả để nội dung khớp PDF.
+  được VietOCR engine tách thành từng dòng rồi ghép kết quả để nội dung khớp PDF. Dòng/strip của mọi
+  trang được gom chung một hàng đợi batch (recognize_pages) theo cửa sổ trang (page_stream.window)
+  thay vì nhận dạng từng box; trang có thể đến dạng luồng (rasterize.stream_pages) nên bộ nhớ không
+  tăng theo số trang.
+- PDF born-digital: box nằm trên lớp text PDF (text_layers) lấy text thẳng, không qua VietOCR
+  (OcrPage/OcrBlock.source).
+- run_ocr (tự động, không chỉnh box): các bước chạy đồng thời theo stage, nối bằng hàng đợi có giới
+  hạn (ocr_core.pipeline.executor) thay vì tuần tự từng trang.
+- Trang được giữ một lần dưới dạng mảng uint8 HxWx3 (preprocess_array) cho detect và recognize; crop
+  là view.
 """
 from __future__ import annotations
-from PIL import Image
+
 import logging
 import time
 import uuid
+from collections.abc import Iterable
+
+import numpy as np
+from PIL import Image
 
-from ocr_core.domain.models import OcrResult, OcrPage, OcrBlock
-from ocr_core.pipeline.preprocess import preprocess_image
-from ocr_core.pipeline.detect import detect_text_boxes
-from ocr_core.pipeline.recognize import recognize
+from ocr_core.config_loader import get_system_config
+from ocr_core.domain.models import OcrBlock, OcrPage, OcrResult
+from ocr_core.engines.vietocr_engine import get_vietocr_model
+from ocr_core.infra.recognition_cache import get_recognition_cache
+from ocr_core.pipeline.detect import detect_text_boxes, get_craft_backend
+from ocr_core.pipeline.executor import Stage, StagedPipeline
 from ocr_core.pipeline.postprocess import postprocess_texts
+from ocr_core.pipeline.preprocess import preprocess_array
+from ocr_core.pipeline.rasterize import RasterPage, chunked, page_stream_params
+from ocr_core.pipeline.recognize import crop_regions, recognize, recognize_pages
+from ocr_core.pipeline.text_layer import PageTextLayer
 
 logger = logging.getLogger(__name__)
 
@@ -31,144 +50,261 @@ def _box_from_detect_box(b: dict) -> tuple[int, int, int, int]:
     return (int(b["x1"]), int(b["y1"]), int(b["x2"]), int(b["y2"]))
 
 
-def run_ocr(job_id: str, pages: list[Image.Image]) -> OcrResult:
-    logger.info(f"[OCR Pipeline] Bắt đầu: job_id={job_id}, số_trang={len(pages)}")
-    ocr_pages = []
-    for page_index, img in enumerate(pages):
-        t_page = time.perf_counter()
-        logger.info(f"[OCR Pipeline] Trang {page_index + 1}/{len(pages)}: bắt đầu xử lý")
+PIPELINE_QUEUE = 2
 
-        # Preprocess
-        t0 = time.perf_counter()
-        img = preprocess_image(img)
-        w, h = img.size
-        logger.info(
-            f"[OCR Pipeline]   - Preprocess xong: kích thước {w}x{h} px, "
-            f"thời gian={time.perf_counter() - t0:.3f}s"
-        )
 
-        # Detect
-        t0 = time.perf_counter()
-        boxes = detect_text_boxes(img)
-        logger.info(
-            f"[OCR Pipeline]   - Detect text boxes: phát hiện {len(boxes)} vùng, "
-            f"thời gian={time.perf_counter() - t0:.3f}s"
-        )
+def _pipeline_stages() -> tuple[list[Stage], int]:
+    """Stage của run_ocr + kích thước hàng đợi giữa các stage từ pipeline.* (system_config.yml)."""
+    cfg = get_system_config().pipeline
+    stages = [
+        Stage("preprocess", _stage_preprocess, cfg.preprocess_workers or 1),
+        Stage("detect", _stage_detect, cfg.detect_workers or 1),
+        Stage("recognize", _stage_recognize, cfg.recognize_workers or 1),
+    ]
+    return stages, cfg.queue_size or PIPELINE_QUEUE
 
-        # Recognize
-        t0 = time.perf_counter()
-        rec = recognize(img, boxes)
-        logger.info(
-            f"[OCR Pipeline]   - Recognize: nhận dạng {len(rec)} đoạn, "
-            f"thời gian={time.perf_counter() - t0:.3f}s"
-        )
 
-        # Postprocess
-        t0 = time.perf_counter()
-        texts = postprocess_texts([t for t, _ in rec])
-        logger.info(
-            f"[OCR Pipeline]   - Postprocess: {len(texts)} text đã xử lý, "
-            f"thời gian={time.perf_counter() - t0:.3f}s"
-        )
+# Loader model của stage (lru_cache không khóa lần miss: nhiều thread gọi cùng lúc sẽ load trùng
+# weights)
+_STAGE_LOADERS = {"detect": get_craft_backend, "recognize": get_vietocr_model}
 
-        # Đảm bảo số lượng khớp (boxes từ CRAFT, rec/texts từ VietOCR)
-        n = min(len(boxes), len(rec), len(texts))
-        if n != len(boxes) or n != len(rec):
-            logger.warning(
-                "[OCR Pipeline] Số boxes/rec/texts không khớp: boxes=%s, rec=%s, texts=%s; dùng n=%s",
-                len(boxes), len(rec), len(texts), n,
-            )
-        blocks = []
-        for i in range(n):
-            box = boxes[i]
-            raw_text, conf = rec[i]
-            text = texts[i]
-            blocks.append(
-                OcrBlock(
-                    block_id=f"{page_index}-{i}-{uuid.uuid4().hex[:8]}",
-                    box=box,
-                    score=1.0,
-                    text=text,
-                    conf=conf,
-                )
-            )
-        if blocks:
-            logger.debug(
-                f"[OCR Pipeline]   - Blocks trang {page_index}: "
-                f"conf trung bình={sum(b.conf for b in blocks) / len(blocks):.3f}"
+
+def _warm_models(stages: list[Stage]) -> None:
+    """Load trước model của stage nhiều worker, trên thread gọi — trước khi các thread stage chạy.
+    Stage một worker vẫn load lười (tài liệu toàn trang trắng không load VietOCR)."""
+    for stage in stages:
+        loader = _STAGE_LOADERS.get(stage.name)
+        if loader is not None and stage.workers > 1:
+            loader()
+
+
+def _numbered(pages: Iterable[Image.Image | RasterPage]):
+    """(chỉ số trang, trang) cho stage nguồn; đóng luồng trang (look-ahead, document fitz, shared
+    memory) ngay khi pipeline dừng thay vì chờ GC."""
+    try:
+        for i, page in enumerate(pages):
+            yield (page.index if isinstance(page, RasterPage) else i), page
+    finally:
+        close = getattr(pages, "close", None)
+        if close is not None:
+            close()
+
+
+def _stage_preprocess(item: tuple[int, Image.Image | RasterPage]) -> tuple[int, np.ndarray]:
+    page_index, page = item
+    img = page.image if isinstance(page, RasterPage) else page
+    return page_index, preprocess_array(img)
+
+
+def _stage_detect(item: tuple[int, np.ndarray]) -> tuple[int, np.ndarray, list]:
+    page_index, img = item
+    return page_index, img, detect_text_boxes(img)
+
+
+def _stage_recognize(item: tuple[int, np.ndarray, list]) -> OcrPage:
+    """Recognize + postprocess một trang → OcrPage (trang trắng / không có box: không load/gọi
+    VietOCR)."""
+    page_index, img, boxes = item
+    h, w = img.shape[:2]
+    rec = recognize(img, boxes) if boxes else []
+    texts = postprocess_texts([t for t, _ in rec])
+
+    # Đảm bảo số lượng khớp (boxes từ CRAFT, rec/texts từ VietOCR)
+    n = min(len(boxes), len(rec), len(texts))
+    if n != len(boxes) or n != len(rec):
+        logger.warning(
+            "[OCR Pipeline] Số boxes/rec/texts không khớp: boxes=%s, rec=%s, texts=%s; dùng n=%s",
+            len(boxes), len(rec), len(texts), n,
+        )
+    blocks = []
+    for i in range(n):
+        box = boxes[i]
+        raw_text, conf = rec[i]
+        text = texts[i]
+        blocks.append(
+            OcrBlock(
+                block_id=f"{page_index}-{i}-{uuid.uuid4().hex[:8]}",
+                box=box,
+                score=1.0,
+                text=text,
+                conf=conf,
             )
+        )
+    if blocks:
+        logger.debug(
+            f"[OCR Pipeline]   - Blocks trang {page_index}: "
+            f"conf trung bình={sum(b.conf for b in blocks) / len(blocks):.3f}"
+        )
+    return OcrPage(page_index=page_index, width=w, height=h, blocks=blocks)
+
 
-        ocr_pages.append(OcrPage(page_index=page_index, width=w, height=h, blocks=blocks))
-        elapsed_page = time.perf_counter() - t_page
+def run_ocr(job_id: str, pages: Iterable[Image.Image | RasterPage]) -> OcrResult:
+    """OCR tự động (không chỉnh box): preprocess → detect → recognize + postprocess chạy đồng thời
+    theo stage (StagedPipeline), nối bằng hàng đợi có giới hạn pipeline.queue_size — vd. detect
+    trang n+1 trong khi recognize trang n. Số worker mỗi stage:
+    pipeline.{preprocess,detect,recognize}_workers. pages có thể là luồng (rasterize.stream_pages) —
+    stage nguồn kéo trang lười nên render cũng chồng lên detect/recognize."""
+    t_start = time.perf_counter()
+    stages, queue_size = _pipeline_stages()
+    logger.info(
+        f"[OCR Pipeline] Bắt đầu: job_id={job_id}, stages="
+        f"{[(st.name, st.workers) for st in stages]}, queue={queue_size}"
+    )
+    _warm_models(stages)
+    pipeline = StagedPipeline(stages, queue_size)
+    ocr_pages = []
+    for page in pipeline.run(_numbered(pages)):
+        ocr_pages.append(page)
         logger.info(
-            f"[OCR Pipeline] Trang {page_index + 1}/{len(pages)} xong: "
-            f"{len(blocks)} blocks, tổng thời gian trang={elapsed_page:.3f}s"
+            f"[OCR Pipeline] Trang {page.page_index + 1} xong: {len(page.blocks)} blocks, "
+            f"kích thước {page.width}x{page.height} px"
         )
 
     total_blocks = sum(len(p.blocks) for p in ocr_pages)
     logger.info(
         f"[OCR Pipeline] Kết thúc: job_id={job_id}, {len(ocr_pages)} trang, "
-        f"{total_blocks} blocks"
+        f"{total_blocks} blocks, thời gian={time.perf_counter() - t_start:.3f}s, "
+        f"stage={pipeline.stats()}"
     )
     return OcrResult(job_id=job_id, pages=ocr_pages)
 
 
+def _prepare_boxes_page(page_index: int, img: Image.Image, page_data: dict,
+                       layer: PageTextLayer | None):
+    """Một trang của run_ocr_with_boxes → (meta, rec_item | None). Box có từ của lớp text PDF lấy
+    text thẳng; box còn lại được crop (view trên ảnh đã preprocess) để nhận dạng."""
+    raw_boxes = page_data.get("boxes") or []
+    w_orig = page_data.get("width") or img.size[0]
+    h_orig = page_data.get("height") or img.size[1]
+    if not raw_boxes:
+        return (page_index, w_orig, h_orig, [], {}, []), None
+    # Box gốc từ DB (detect_result) — dùng để lưu vào block (khớp PDF)
+    boxes_orig = [_box_from_detect_box(b) for b in raw_boxes]
+    layer_texts: dict[int, str] = {}
+    if layer is not None:
+        for i, box in enumerate(boxes_orig):
+            text = layer.text_in_box(box)
+            if text is not None:
+                layer_texts[i] = text
+    ocr_idx = [i for i in range(len(boxes_orig)) if i not in layer_texts]
+    meta = (page_index, w_orig, h_orig, boxes_orig, layer_texts, ocr_idx)
+    if not ocr_idx:
+        return meta, None
+    img_prep = preprocess_array(img)
+    h_prep, w_prep = img_prep.shape[:2]
+    scale_x = w_prep / w_orig if w_orig else 1.0
+    scale_y = h_prep / h_orig if h_orig else 1.0
+    boxes_for_crop = []
+    original_heights = []
+    for i in ocr_idx:
+        x1, y1, x2, y2 = boxes_orig[i]
+        x1_s = int(x1 * scale_x)
+        y1_s = int(y1 * scale_y)
+        x2_s = int(x2 * scale_x)
+        y2_s = int(y2 * scale_y)
+        boxes_for_crop.append((x1_s, y1_s, x2_s, y2_s))
+        original_heights.append(y2 - y1)
+    return meta, (crop_regions(img_prep, boxes_for_crop), original_heights)
+
+
+def _build_boxes_page(meta, rec_ocr: list[tuple[str, float]] | None) -> OcrPage:
+    """Ghép text PDF + kết quả VietOCR theo thứ tự box → OcrPage (postprocess text)."""
+    page_index, w_orig, h_orig, boxes_orig, layer_texts, ocr_idx = meta
+    if not boxes_orig:
+        return OcrPage(page_index=page_index, width=w_orig, height=h_orig, blocks=[])
+    # (text thô, conf, source) theo thứ tự box
+    rec: list = [None] * len(boxes_orig)
+    for i, text in layer_texts.items():
+        rec[i] = (text, 1.0, "text_layer")
+    for i, (text, conf) in zip(ocr_idx, rec_ocr or []):
+        rec[i] = (text, conf, "ocr")
+    rec = [r for r in rec if r is not None]
+    texts = postprocess_texts([t for t, _, _ in rec])
+    n = min(len(boxes_orig), len(rec), len(texts))
+    blocks = []
+    for i in range(n):
+        raw_text, conf, source = rec[i]
+        text = texts[i]
+        box_for_output = boxes_orig[i]
+        blocks.append(
+            OcrBlock(
+                block_id=f"{page_index}-{i}-{uuid.uuid4().hex[:8]}",
+                box=box_for_output,
+                score=1.0,
+                text=text,
+                conf=conf,
+                source=source,
+            )
+        )
+    if not ocr_idx:
+        page_source = "text_layer"
+    elif layer_texts:
+        page_source = "hybrid"
+    else:
+        page_source = "ocr"
+    return OcrPage(page_index=page_index, width=w_orig, height=h_orig, source=page_source,
+                   blocks=blocks)
+
+
 def run_ocr_with_boxes(
     job_id: str,
-    pages: list[Image.Image],
+    pages: Iterable[Image.Image | RasterPage],
     detect_pages: list[dict],
+    text_layers: list[PageTextLayer | None] | None = None,
 ) -> OcrResult:
     """Chạy OCR theo vùng đã detect lưu trong CSDL: boxes lấy từ cột detect_result (DB).
     Tọa độ trong blocks.box luôn lấy nguyên từ detect_result để khớp với PDF.
     Nếu ảnh bị preprocess (resize) thì chỉ scale box khi crop cho VietOCR, không đổi giá trị lưu.
+    text_layers (theo trang, PDF born-digital; RasterPage mang sẵn text_layer): box có từ của lớp
+    text PDF lấy text thẳng (conf=1.0, source=text_layer); chỉ box còn lại (trang scan, box vẽ thêm
+    lên vùng ảnh) mới qua VietOCR. pages có thể là luồng (stream_pages): xử lý theo cửa sổ
+    page_stream.window trang, crop của các trang trong cửa sổ gom chung một lượt recognize; ảnh
+    trang được giải phóng sau mỗi cửa sổ.
     """
     logger.info(
         "[OCR Pipeline] Bắt đầu với boxes có sẵn: job_id=%s, số_trang=%s",
-        job_id, len(pages),
+        job_id, len(detect_pages),
     )
     by_index = {p["page_index"]: p for p in detect_pages}
+    text_layers = text_layers or []
+    _, window = page_stream_params()
     ocr_pages = []
-    for page_index, img in enumerate(pages):
-        page_data = by_index.get(page_index, {})
-        raw_boxes = page_data.get("boxes") or []
-        if not raw_boxes:
-            w_orig = page_data.get("width") or img.size[0]
-            h_orig = page_data.get("height") or img.size[1]
-            ocr_pages.append(OcrPage(page_index=page_index, width=w_orig, height=h_orig, blocks=[]))
-            continue
-        # Box gốc từ DB (detect_result) — dùng để lưu vào block (khớp PDF)
-        boxes_orig = [_box_from_detect_box(b) for b in raw_boxes]
-        img_prep = preprocess_image(img)
-        w_prep, h_prep = img_prep.size
-        w_orig = page_data.get("width") or img.size[0]
-        h_orig = page_data.get("height") or img.size[1]
-        scale_x = w_prep / w_orig if w_orig else 1.0
-        scale_y = h_prep / h_orig if h_orig else 1.0
-        boxes_for_crop = []
-        original_heights = []
-        for (x1, y1, x2, y2) in boxes_orig:
-            x1_s = int(x1 * scale_x)
-            y1_s = int(y1 * scale_y)
-            x2_s = int(x2 * scale_x)
-            y2_s = int(y2 * scale_y)
-            boxes_for_crop.append((x1_s, y1_s, x2_s, y2_s))
-            original_heights.append(y2 - y1)
-        rec = recognize(img_prep, boxes_for_crop, original_heights=original_heights)
-        texts = postprocess_texts([t for t, _ in rec])
-        n = min(len(boxes_orig), len(rec), len(texts))
-        blocks = []
-        for i in range(n):
-            raw_text, conf = rec[i]
-            text = texts[i]
-            box_for_output = boxes_orig[i]
-            blocks.append(
-                OcrBlock(
-                    block_id=f"{page_index}-{i}-{uuid.uuid4().hex[:8]}",
-                    box=box_for_output,
-                    score=1.0,
-                    text=text,
-                    conf=conf,
-                )
-            )
-        ocr_pages.append(OcrPage(page_index=page_index, width=w_orig, height=h_orig, blocks=blocks))
+    n_ocr = n_text_layer = 0
+    t_rec = 0.0
+    for chunk in chunked(enumerate(pages), window):
+        # Bước 1: text PDF cho box có lớp text; preprocess + crop box cần OCR
+        metas = []
+        rec_items = []
+        for page_index, page in chunk:
+            if isinstance(page, RasterPage):
+                # Số trang tuyệt đối (luồng có thể bắt đầu giữa tài liệu — shard trang)
+                page_index, img, layer = page.index, page.image, page.text_layer
+            else:
+                img = page
+                layer = text_layers[page_index] if page_index < len(text_layers) else None
+            meta, item = _prepare_boxes_page(page_index, img, by_index.get(page_index, {}), layer)
+            metas.append(meta)
+            n_text_layer += len(meta[4])
+            if item is not None:
+                rec_items.append(item)
+                n_ocr += len(item[0])
+        del chunk
+
+        # Bước 2: recognize batch các trang trong cửa sổ
+        t0 = time.perf_counter()
+        rec_pages = iter(recognize_pages(rec_items)) if rec_items else iter(())
+        t_rec += time.perf_counter() - t0
+        del rec_items
+
+        # Bước 3: postprocess + dựng OcrPage theo thứ tự trang
+        for meta in metas:
+            ocr_pages.append(_build_boxes_page(meta, next(rec_pages) if meta[5] else None))
+    logger.info(
+        "[OCR Pipeline] Recognize (theo cửa sổ %s trang): %s vùng, %s vùng lấy từ lớp text PDF, "
+        "thời gian=%.3fs",
+        window, n_ocr, n_text_layer, t_rec,
+    )
+    cache = get_recognition_cache()
+    if cache is not None:
+        logger.info("[OCR Pipeline] Recognition cache: %s", cache.stats())
     return OcrResult(job_id=job_id, pages=ocr_pages)
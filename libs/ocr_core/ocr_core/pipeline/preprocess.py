@@ -1,11 +1,35 @@
-"""Preprocess ảnh: resize theo max_side (giữ tỉ lệ), convert RGB. Tham chiếu OCRPipelineV2.resize."""
+"""Preprocess ảnh: resize theo max_side (giữ tỉ lệ), convert RGB. Tham chiếu OCRPipelineV2.resize.
+preprocess_array: trang giữ dưới dạng một mảng NumPy uint8 HxWx3 (RGB, C-contiguous) dùng chung cho
+detect và recognize (crop là view của mảng này, không copy từng box).
+is_blank_page: lọc trang trắng/gần trắng (trang phân cách, mặt sau scan) bằng độ lệch chuẩn + mật độ
+mực trên bản thu nhỏ, trước khi gọi model.
+"""
 from __future__ import annotations
-import os
+
+import cv2
+import numpy as np
 from PIL import Image
 
+from ocr_core.config_loader import get_system_config
+
+# Trang trắng: đo trên ảnh xám độ phân giải gốc (nét chữ mảnh không bị làm mờ); pixel là "mực" khi
+# tối hơn nền (trung vị, từ histogram) ít nhất min_contrast mức xám; trắng nếu độ lệch chuẩn <
+# min_std hoặc tỉ lệ mực < ink_ratio (mặc định ~ vài ký tự trên trang A4 150 dpi: số trang, vết bẩn
+# vẫn coi là trắng)
+BLANK_MIN_STD = 2.0
+BLANK_MIN_CONTRAST = 40
+BLANK_INK_RATIO = 0.0002
+
 
 def _max_side() -> int:
-    return int(os.getenv("OCR_MAX_SIDE", "1200"))
+    """preprocess.max_side (env OCR_MAX_SIDE, mặc định 1200) từ config registry."""
+    return get_system_config().preprocess.max_side
+
+
+def preprocess_side() -> int:
+    """Cạnh dài tối đa của trang khi recognize — render PDF ở kích thước này thì preprocess không
+    resize lại."""
+    return _max_side()
 
 
 def preprocess_image(img: Image.Image) -> Image.Image:
@@ -18,3 +42,54 @@ def preprocess_image(img: Image.Image) -> Image.Image:
         new_h = int(h / scale)
         img = img.resize((new_w, new_h), Image.Resampling.LANCZOS)
     return img
+
+
+def to_rgb_array(img: Image.Image | np.ndarray) -> np.ndarray:
+    """Ảnh PIL hoặc mảng (HxW, HxWx3, HxWx4) → uint8 HxWx3 RGB. Mảng RGB uint8 trả về nguyên (không
+    copy)."""
+    if isinstance(img, Image.Image):
+        return np.asarray(img.convert("RGB"))
+    arr = np.asarray(img)
+    if arr.dtype != np.uint8:
+        arr = np.clip(arr, 0, 255).astype(np.uint8)
+    if arr.ndim == 2:
+        return cv2.cvtColor(arr, cv2.COLOR_GRAY2RGB)
+    if arr.shape[2] == 4:
+        return arr[:, :, :3]
+    return arr
+
+
+def preprocess_array(img: Image.Image | np.ndarray) -> np.ndarray:
+    """Như preprocess_image nhưng trả về mảng uint8 HxWx3 RGB C-contiguous (một lần convert cho cả
+    trang). Ảnh PIL resize bằng LANCZOS như preprocess_image; mảng resize bằng cv2 INTER_AREA."""
+    max_side = _max_side()
+    if isinstance(img, Image.Image):
+        return np.ascontiguousarray(to_rgb_array(preprocess_image(img)))
+    arr = to_rgb_array(img)
+    h, w = arr.shape[:2]
+    scale = max(w, h) / max_side
+    if scale > 1:
+        arr = cv2.resize(arr, (int(w / scale), int(h / scale)), interpolation=cv2.INTER_AREA)
+    return np.ascontiguousarray(arr)
+
+
+def is_blank_page(img: Image.Image | np.ndarray) -> bool:
+    """True nếu trang trắng/gần trắng (không cần detect). Cấu hình blank_page.* (env
+    OCR_BLANK_PAGE=0 để tắt, OCR_BLANK_INK_RATIO); vết bẩn nhỏ và chữ in hằn mờ từ mặt sau (tương
+    phản thấp) không tính là mực."""
+    cfg = get_system_config().blank_page
+    if not cfg.enabled:
+        return False
+    arr = to_rgb_array(img)
+    if arr.size == 0:
+        return True
+    gray = cv2.cvtColor(arr, cv2.COLOR_RGB2GRAY)
+    _, std = cv2.meanStdDev(gray)
+    if float(std[0, 0]) < (cfg.min_std if cfg.min_std is not None else BLANK_MIN_STD):
+        return True
+    hist = cv2.calcHist([gray], [0], None, [256], [0, 256]).ravel()
+    background = int(np.searchsorted(np.cumsum(hist), gray.size / 2))
+    contrast = cfg.min_contrast if cfg.min_contrast is not None else BLANK_MIN_CONTRAST
+    # Số pixel tối hơn nền - contrast = tổng histogram các mức xám dưới ngưỡng
+    ink = hist[:max(0, background - contrast)].sum() / gray.size
+    return ink < (cfg.ink_ratio if cfg.ink_ratio is not None else BLANK_INK_RATIO)
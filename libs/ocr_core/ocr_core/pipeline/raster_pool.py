@@ -0,0 +1,225 @@
+"""Rasterize PDF song song bằng process pool nhỏ (PyMuPDF render đơn luồng, giữ GIL).
+
+- Bytes PDF được đặt một lần vào shared memory; mỗi process con mở document fitz riêng từ đó
+  (cache theo tên segment — một process render nhiều trang của cùng job chỉ mở document một lần).
+  Process con mở document thẳng trên vùng nhớ segment (memoryview, không copy bytes PDF).
+- Mỗi trang render xong được ghi vào một segment shared memory riêng; process chính dựng ảnh PIL
+  trực tiếp từ segment (copy đúng một lần vào bộ nhớ của ảnh) rồi unlink ngay, không pickle pixel
+  qua pipe.
+- Trang trả về đúng thứ tự, tối đa workers + lookahead trang đang render/chờ tiêu thụ → cắm thẳng
+  vào luồng trang (rasterize.stream_pages) của detect/recognize.
+- Pool tạo lười (spawn) trong từng process, dùng lại giữa các job. Pool dựng bằng billiard (đi kèm
+  Celery) khi có: process con prefork của Celery là daemon, multiprocessing cấm daemon tạo process
+  con còn billiard thì cho phép — nên worker prefork mặc định vẫn render song song. Không có
+  billiard mà process là daemon → render tuần tự (WARNING nếu rasterize.workers > 1 được cấu hình).
+
+Cấu hình (infra/system_config.yml):
+  rasterize:
+    workers: 2    # số process render; 0/1 = tuần tự; bỏ trống = min(2, worker.cores_per_child)
+    parallel_min_pages: 8  # PDF ít trang hơn thì render tuần tự (không đáng chi phí IPC)
+"""
+from __future__ import annotations
+
+import atexit
+import logging
+import multiprocessing
+from collections import deque
+from collections.abc import Iterator
+from functools import lru_cache
+from multiprocessing import resource_tracker, shared_memory
+
+from PIL import Image
+
+from ocr_core.config_loader import get_system_config
+from ocr_core.pipeline.rasterize import RasterPage, render_page
+from ocr_core.pipeline.text_layer import extract_text_layer
+
+logger = logging.getLogger(__name__)
+
+RASTER_WORKERS = 2
+PARALLEL_MIN_PAGES = 8
+
+# Phía process con: document đang mở (theo tên segment input) — một job tại một thời điểm
+_doc_state: dict = {"name": None, "doc": None, "shm": None, "view": None}
+# Đã log việc tắt pool (chỉ log một lần mỗi process)
+_fallback_logged = False
+
+
+def _billiard_context():
+    """Context spawn của billiard, None nếu chưa cài (ocr_core dùng ngoài Celery)."""
+    try:
+        import billiard
+    except ImportError:
+        return None
+    return billiard.get_context("spawn")
+
+
+def _can_spawn(configured: int | None) -> bool:
+    """Process hiện tại tạo được pool render không. Daemon (con prefork Celery) chỉ tạo được qua
+    billiard; multiprocessing sẽ lỗi "daemonic processes are not allowed to have children"."""
+    global _fallback_logged
+    if not multiprocessing.current_process().daemon or _billiard_context() is not None:
+        return True
+    if not _fallback_logged:
+        _fallback_logged = True
+        level = logging.WARNING if configured is not None and configured > 1 else logging.INFO
+        logger.log(
+            level,
+            "[OCR Pipeline] Process daemon không có billiard, không tạo được process render; "
+            "rasterize tuần tự (rasterize.workers=%s)",
+            configured,
+        )
+    return False
+
+
+def raster_workers(page_count: int) -> int:
+    """Số process render cho tài liệu page_count trang (0 = tuần tự)."""
+    cfg = get_system_config().rasterize
+    min_pages = PARALLEL_MIN_PAGES if cfg.parallel_min_pages is None else cfg.parallel_min_pages
+    if page_count < max(2, min_pages):
+        return 0
+    workers = configured = cfg.workers
+    if workers is None:
+        from ocr_core.engines.runtime import cores_per_child
+
+        workers = min(RASTER_WORKERS, cores_per_child())
+    workers = min(workers, page_count)
+    if workers <= 1 or not _can_spawn(configured):
+        return 0
+    return workers
+
+
+@lru_cache(maxsize=4)
+def _raster_pool(workers: int):
+    """Pool render (API multiprocessing.Pool), tạo lười trong từng process; spawn: không fork
+    process đang có thread/model. billiard nếu có (chạy được trong process daemon), không thì
+    multiprocessing."""
+    ctx = _billiard_context() or multiprocessing.get_context("spawn")
+    return ctx.Pool(processes=workers)
+
+
+def _untrack(shm: shared_memory.SharedMemory) -> None:
+    """(process con) Segment do process chính unlink: bỏ khỏi resource_tracker của process này
+    (Python < 3.13 đăng ký cả khi attach) — tránh tracker unlink lại/cảnh báo "leaked" khi process
+    con thoát."""
+    resource_tracker.unregister(shm._name, "shared_memory")
+
+
+def _close_doc() -> None:
+    """(process con) Đóng document đang mở và segment input của nó (document trước, rồi mới nhả
+    vùng nhớ)."""
+    doc, view, shm = _doc_state["doc"], _doc_state["view"], _doc_state["shm"]
+    _doc_state.update(name=None, doc=None, shm=None, view=None)
+    if doc is not None:
+        doc.close()
+        del doc
+    if view is not None:
+        view.release()
+    if shm is not None:
+        shm.close()
+
+
+def _open_doc(name: str, size: int):
+    """(process con) Document fitz mở thẳng trên segment input (không copy bytes PDF); giữ segment
+    map tới khi chuyển sang job khác."""
+    import fitz
+
+    if _doc_state["name"] != name:
+        if _doc_state["shm"] is None:
+            # đóng document trước khi interpreter dọn segment
+            # (tránh BufferError lúc process con thoát)
+            atexit.register(_close_doc)
+        _close_doc()
+        shm = shared_memory.SharedMemory(name=name)
+        _untrack(shm)
+        view = shm.buf[:size]
+        _doc_state.update(name=name, shm=shm, view=view, doc=fitz.open(stream=view, filetype="pdf"))
+    return _doc_state["doc"]
+
+
+def _render_shared(
+    name: str, size: int, index: int, target_side: int | None, dpi: int, grayscale: bool
+):
+    """(process con) Render trang index → ghi pixel vào segment shared memory mới; trả về metadata
+    trang."""
+    page = _open_doc(name, size)[index]
+    img, ref = render_page(page, target_side, dpi, grayscale)
+    data = img.tobytes()
+    out = shared_memory.SharedMemory(create=True, size=max(1, len(data)))
+    _untrack(out)
+    try:
+        out.buf[:len(data)] = data
+    finally:
+        out.close()
+    return out.name, img.mode, img.size, ref, extract_text_layer(page, dpi)
+
+
+def _collect(result) -> Image.Image:
+    """(process chính) Segment trang → ảnh PIL: giải mã thẳng từ vùng nhớ segment vào ảnh (một lần
+    copy, không qua bytes trung gian), rồi unlink segment ngay để /dev/shm không giữ trang đã tiêu
+    thụ."""
+    name, mode, size, _, _ = result
+    shm = shared_memory.SharedMemory(name=name)
+    view = shm.buf[:len(mode) * size[0] * size[1]]
+    try:
+        return Image.frombytes(mode, size, view)
+    finally:
+        view.release()
+        shm.close()
+        shm.unlink()
+
+
+def _discard(pending) -> None:
+    """Bỏ trang đã gửi render nhưng không tiêu thụ (generator đóng sớm / lỗi): Pool không hủy được
+    task đã gửi → chờ render xong rồi unlink segment."""
+    try:
+        name = pending.get()[0]
+    except Exception:
+        return
+    try:
+        shm = shared_memory.SharedMemory(name=name)
+        shm.close()
+        shm.unlink()
+    except FileNotFoundError:
+        pass
+
+
+def iter_pdf_pages_parallel(
+    raw: bytes,
+    page_count: int,
+    target_side: int | None,
+    dpi: int,
+    workers: int,
+    depth: int = 0,
+    start: int = 0,
+) -> Iterator[RasterPage]:
+    """PDF bytes → RasterPage theo thứ tự trang (từ trang start), render trên workers process;
+    tối đa workers + depth trang đang render/chờ."""
+    grayscale = get_system_config().rasterize.grayscale
+    pool = _raster_pool(workers)
+    src = shared_memory.SharedMemory(create=True, size=max(1, len(raw)))
+    src.buf[:len(raw)] = raw
+    pending: deque = deque()
+    try:
+        submit = iter(range(start, page_count))
+
+        def _submit_next() -> None:
+            for index in submit:
+                args = (src.name, len(raw), index, target_side, dpi, grayscale)
+                pending.append(pool.apply_async(_render_shared, args))
+                return
+
+        for _ in range(workers + max(0, depth)):
+            _submit_next()
+        index = start
+        while pending:
+            result = pending.popleft().get()
+            _submit_next()
+            img = _collect(result)
+            yield RasterPage(index, img, result[3], result[4])
+            index += 1
+    finally:
+        for item in pending:
+            _discard(item)
+        src.close()
+        src.unlink()
@@ -0,0 +1,246 @@
+"""Rasterize PDF theo độ phân giải cần dùng: render một lần bằng ma trận PyMuPDF ở đúng kích thước
+bước sau cần (detect: cạnh dài input CRAFT; recognize: preprocess.max_side) thay vì render cố định
+150 dpi rồi resize lại.
+
+Hệ tọa độ detect_result (width/height + boxes) giữ nguyên như trước: kích thước trang khi render ở
+REFERENCE_DPI (rasterize.dpi). RasterPage.ref_size là kích thước đó; box detect trên ảnh đã render
+được đổi về bằng to_reference, run_ocr_with_boxes tự scale box theo kích thước ảnh thực tế nên không
+cần biết ảnh render ở độ phân giải nào.
+
+Trang PDF có lớp text dùng được (ocr_core.pipeline.text_layer) mang kèm RasterPage.text_layer để
+detect/recognize lấy box + text thẳng từ PDF.
+
+Luồng trang (stream_pages): PDF được render lười từng trang; một thread render trước tối đa
+page_stream.lookahead trang (hàng đợi có giới hạn) trong khi phía tiêu thụ xử lý theo cửa sổ
+page_stream.window trang (chunked). Bộ nhớ đỉnh ~ (lookahead + window) trang, không phụ thuộc số
+trang tài liệu.
+
+Cấu hình (infra/system_config.yml):
+  rasterize:
+    dpi: 150             # độ phân giải tham chiếu (tọa độ detect_result), cũng là độ phân giải
+    render tối đa
+    grayscale: false     # render xám (nhanh hơn, ít bộ nhớ hơn); env OCR_PDF_GRAYSCALE
+    workers: 2           # số process render song song (0/1 = tuần tự) — xem
+    ocr_core.pipeline.raster_pool
+  page_stream:
+    lookahead: 2         # số trang render sẵn chờ xử lý (0 = render đồng bộ); env
+    OCR_PAGE_LOOKAHEAD
+    window: 4            # số trang detect/recognize chung một lượt; env OCR_PAGE_WINDOW
+"""
+from __future__ import annotations
+
+import io
+import logging
+import queue
+import threading
+from collections.abc import Iterable, Iterator
+from itertools import islice
+from typing import NamedTuple, TypeVar
+
+from PIL import Image
+
+from ocr_core.config_loader import get_system_config
+from ocr_core.pipeline.text_layer import PageTextLayer, extract_text_layer
+
+logger = logging.getLogger(__name__)
+
+REFERENCE_DPI = 150
+PAGE_LOOKAHEAD = 2
+PAGE_WINDOW = 4
+
+Box = tuple[int, int, int, int]
+T = TypeVar("T")
+
+
+class RasterPage(NamedTuple):
+    """Một trang đã render. ref_size: (width, height) của hệ tọa độ detect_result; image có thể nhỏ
+    hơn. text_layer: lớp text PDF (tọa độ tham chiếu) nếu trang born-digital, None nếu phải OCR bằng
+    model."""
+
+    index: int
+    image: Image.Image
+    ref_size: tuple[int, int]
+    text_layer: PageTextLayer | None = None
+
+    def to_reference(self, boxes: list[Box]) -> list[Box]:
+        """Box theo tọa độ image → tọa độ tham chiếu (detect_result)."""
+        w, h = self.image.size
+        sx = self.ref_size[0] / w if w else 1.0
+        sy = self.ref_size[1] / h if h else 1.0
+        if sx == 1.0 and sy == 1.0:
+            return list(boxes)
+        return [
+            (int(round(x1 * sx)), int(round(y1 * sy)), int(round(x2 * sx)), int(round(y2 * sy)))
+            for (x1, y1, x2, y2) in boxes
+        ]
+
+
+def _reference_dpi() -> int:
+    return get_system_config().rasterize.dpi or REFERENCE_DPI
+
+
+def page_zoom(width_pt: float, height_pt: float, target_side: int | None, dpi: int) -> float:
+    """Hệ số zoom PyMuPDF (px / point): độ phân giải tham chiếu, thu nhỏ để cạnh dài <= target_side
+    (không phóng to vượt tham chiếu)."""
+    zoom = dpi / 72.0
+    if target_side:
+        zoom = min(zoom, target_side / max(width_pt, height_pt, 1e-6))
+    return zoom
+
+
+def render_page(page, target_side: int | None = None, dpi: int | None = None,
+                grayscale: bool | None = None) -> tuple[Image.Image, tuple[int, int]]:
+    """Render một trang fitz ở kích thước target_side (cạnh dài) → (ảnh PIL RGB hoặc L,
+    ref_size)."""
+    import fitz
+
+    dpi = dpi or _reference_dpi()
+    if grayscale is None:
+        grayscale = get_system_config().rasterize.grayscale
+    rect = page.rect
+    ref = (rect * fitz.Matrix(dpi / 72.0, dpi / 72.0)).irect
+    zoom = page_zoom(rect.width, rect.height, target_side, dpi)
+    colorspace = fitz.csGRAY if grayscale else fitz.csRGB
+    pix = page.get_pixmap(matrix=fitz.Matrix(zoom, zoom), colorspace=colorspace, alpha=False)
+    mode = "L" if grayscale else "RGB"
+    img = Image.frombytes(mode, (pix.width, pix.height), pix.samples)
+    return img, (ref.width, ref.height)
+
+
+def page_stream_params() -> tuple[int, int]:
+    """(số trang render trước, số trang mỗi cửa sổ xử lý) từ page_stream.lookahead /
+    page_stream.window."""
+    cfg = get_system_config().page_stream
+    depth = PAGE_LOOKAHEAD if cfg.lookahead is None else cfg.lookahead
+    return depth, cfg.window or PAGE_WINDOW
+
+
+def count_pages(raw: bytes, is_pdf: bool) -> int:
+    """Số trang của input (mở PDF, không render)."""
+    if not is_pdf:
+        return 1
+    import fitz
+
+    doc = fitz.open(stream=raw, filetype="pdf")
+    try:
+        return len(doc)
+    finally:
+        doc.close()
+
+
+def iter_pdf_pages(
+    raw: bytes, target_side: int | None = None, start: int = 0, stop: int | None = None,
+) -> Iterator[RasterPage]:
+    """PDF bytes → RasterPage lần lượt các trang [start, stop) (render lười, cạnh dài <=
+    target_side); chỉ trang đang yield được giữ trong generator. Tài liệu đủ dài render song song
+    trên process pool (raster_pool), vẫn đúng thứ tự."""
+    import fitz
+
+    from ocr_core.pipeline.raster_pool import iter_pdf_pages_parallel, raster_workers
+
+    dpi = _reference_dpi()
+    doc = fitz.open(stream=raw, filetype="pdf")
+    try:
+        page_count = len(doc) if stop is None else min(stop, len(doc))
+        workers = raster_workers(page_count - start)
+        if not workers:
+            for i in range(start, page_count):
+                page = doc[i]
+                img, ref = render_page(page, target_side, dpi)
+                yield RasterPage(i, img, ref, extract_text_layer(page, dpi))
+            return
+    finally:
+        doc.close()
+    logger.info("[OCR Pipeline] Rasterize %s trang trên %s process", page_count - start, workers)
+    yield from iter_pdf_pages_parallel(raw, page_count, target_side, dpi, workers,
+                                       page_stream_params()[0], start)
+
+
+def iter_pages(
+    raw: bytes, is_pdf: bool, target_side: int | None = None, start: int = 0,
+    stop: int | None = None,
+) -> Iterator[RasterPage]:
+    """Input (PDF hoặc ảnh) → RasterPage lần lượt. Ảnh thường giữ nguyên kích thước (ref_size = kích
+    thước ảnh)."""
+    if is_pdf:
+        yield from iter_pdf_pages(raw, target_side, start, stop)
+        return
+    if start > 0 or stop == 0:
+        return
+    img = Image.open(io.BytesIO(raw)).convert("RGB")
+    yield RasterPage(0, img, img.size)
+
+
+_DONE = object()
+
+
+def lookahead(items: Iterable[T], depth: int) -> Iterator[T]:
+    """Như iter(items) nhưng một thread lấy trước tối đa depth phần tử (hàng đợi có giới hạn →
+    back-pressure). Lỗi của producer được raise lại ở phía tiêu thụ; đóng generator sớm thì producer
+    dừng. depth=0: đồng bộ."""
+    if depth <= 0:
+        yield from items
+        return
+    buf: queue.Queue = queue.Queue(maxsize=depth)
+    stop = threading.Event()
+
+    def _put(item) -> bool:
+        while not stop.is_set():
+            try:
+                buf.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def _produce() -> None:
+        try:
+            for item in items:
+                if not _put((item, None)):
+                    return
+        except BaseException as e:
+            _put((_DONE, e))
+            return
+        _put((_DONE, None))
+
+    thread = threading.Thread(target=_produce, name="ocr-page-lookahead", daemon=True)
+    thread.start()
+    try:
+        while True:
+            item, error = buf.get()
+            if item is _DONE:
+                if error is not None:
+                    raise error
+                return
+            yield item
+    finally:
+        stop.set()
+        thread.join()
+
+
+def chunked(items: Iterable[T], size: int) -> Iterator[list[T]]:
+    """Cắt luồng thành các list tối đa size phần tử (cửa sổ xử lý)."""
+    it = iter(items)
+    while chunk := list(islice(it, max(1, size))):
+        yield chunk
+
+
+def stream_pages(
+    raw: bytes, is_pdf: bool, target_side: int | None = None, start: int = 0,
+    stop: int | None = None,
+) -> Iterator[RasterPage]:
+    """Luồng trang render lười (các trang [start, stop)) + look-ahead page_stream.lookahead
+    trang."""
+    depth, _ = page_stream_params()
+    return lookahead(iter_pages(raw, is_pdf, target_side, start, stop), depth)
+
+
+def rasterize_pdf(raw: bytes, target_side: int | None = None) -> list[RasterPage]:
+    """PDF bytes → danh sách RasterPage (toàn bộ tài liệu trong bộ nhớ; tài liệu dài dùng
+    stream_pages)."""
+    return list(iter_pdf_pages(raw, target_side))
+
+
+def load_pages(raw: bytes, is_pdf: bool, target_side: int | None = None) -> list[RasterPage]:
+    """Input (PDF hoặc ảnh) → danh sách RasterPage (xem iter_pages)."""
+    return list(iter_pages(raw, is_pdf, target_side))
@@ -1,24 +1,130 @@
+"""Recognize: crop vùng (view NumPy) → VietOCR batch.
+
+Producer/consumer: thread pool nhỏ chuẩn bị trước các batch (resize cv2, tra cache, pad + chuẩn hóa
+— cv2/NumPy nhả GIL) trong khi vòng inference tiêu thụ lần lượt; số batch chuẩn bị sẵn chờ inference
+bị giới hạn (queue depth) để không giữ quá nhiều tensor trong RAM. Cấu hình: vietocr.prepare_workers
+/ vietocr.prepare_queue trong system_config.yml hoặc env OCR_PREPARE_WORKERS / OCR_PREPARE_QUEUE
+(workers=0: chuẩn bị tuần tự).
+"""
 from __future__ import annotations
-from typing import List, Optional, Tuple
+
+from collections import deque
+from collections.abc import Callable, Iterable, Iterator
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+from typing import TypeVar
+
+import numpy as np
 from PIL import Image
 
+from ocr_core.config_loader import get_system_config
 from ocr_core.engines.vietocr_engine import get_vietocr_model, vietocr_predict_batch
+from ocr_core.pipeline.preprocess import to_rgb_array
+
+Box = tuple[int, int, int, int]
+Crop = np.ndarray
+T = TypeVar("T")
+R = TypeVar("R")
+
+PREPARE_WORKERS = 2
+PREPARE_QUEUE = 4
+
+
+def _prepare_params() -> tuple[int, int]:
+    """(số thread chuẩn bị batch, số batch tối đa chuẩn bị sẵn) từ env hoặc
+    vietocr.prepare_workers/prepare_queue."""
+    vcfg = get_system_config().vietocr
+    workers = PREPARE_WORKERS if vcfg.prepare_workers is None else vcfg.prepare_workers
+    return workers, vcfg.prepare_queue or PREPARE_QUEUE
+
+
+@lru_cache(maxsize=4)
+def _prepare_pool(workers: int) -> ThreadPoolExecutor:
+    """Thread pool chuẩn bị batch, tạo lười trong từng process (sau fork của Celery prefork)."""
+    return ThreadPoolExecutor(max_workers=workers, thread_name_prefix="ocr-prepare")
+
 
-Box = Tuple[int, int, int, int]
+def prefetch_map(fn: Callable[[T], R], items: Iterable[T], workers: int, depth: int) -> Iterator[R]:
+    """Như map(fn, items) (giữ thứ tự) nhưng fn chạy trước trong thread pool, tối đa depth kết quả
+    chờ tiêu thụ. Phần tử kế tiếp được đưa vào pool trước khi trả kết quả hiện tại, nên pool làm
+    việc song song với consumer."""
+    if workers <= 0:
+        yield from map(fn, items)
+        return
+    pool = _prepare_pool(workers)
+    it = iter(items)
+    pending = deque(pool.submit(fn, item) for _, item in zip(range(depth), it))
+    try:
+        while pending:
+            result = pending.popleft().result()
+            for item in it:
+                pending.append(pool.submit(fn, item))
+                break
+            yield result
+    finally:
+        for future in pending:
+            future.cancel()
 
-def _crop(img: Image.Image, box: Box) -> Image.Image:
+
+def _prefetch_map_fn() -> Callable[[Callable, Iterable], Iterable]:
+    workers, depth = _prepare_params()
+    return lambda fn, items: prefetch_map(fn, items, workers, depth)
+
+
+def _crop(img: np.ndarray, box: Box) -> np.ndarray:
+    """View (không copy) của box trong mảng trang HxWx3; box được kẹp trong ảnh, tối thiểu 1x1
+    px."""
+    h, w = img.shape[:2]
     x1, y1, x2, y2 = box
-    x1 = max(0, x1); y1 = max(0, y1)
-    x2 = max(x1 + 1, x2); y2 = max(y1 + 1, y2)
-    return img.crop((x1, y1, x2, y2))
+    x1 = min(max(0, x1), w - 1)
+    y1 = min(max(0, y1), h - 1)
+    x2 = min(max(x1 + 1, x2), w)
+    y2 = min(max(y1 + 1, y2), h)
+    return img[y1:y2, x1:x2]
+
 
 def recognize(
-    img: Image.Image,
-    boxes: List[Box],
-    original_heights: Optional[List[int]] = None,
-) -> List[tuple[str, float]]:
+    img: Image.Image | np.ndarray,
+    boxes: list[Box],
+    original_heights: list[int] | None = None,
+) -> list[tuple[str, float]]:
     """Recognize từng box. original_heights: chiều cao gốc (page coords) từ detect_result;
-    nếu height > 56 thì tách dòng theo strip dù crop đã bị scale nhỏ."""
+    nếu height > 56 thì tách dòng theo strip dù crop đã bị scale nhỏ.
+    img: mảng uint8 HxWx3 RGB (preprocess_array) hoặc ảnh PIL; crop là view của mảng trang."""
+    model = get_vietocr_model()
+    return vietocr_predict_batch(
+        model, crop_regions(img, boxes), original_heights=original_heights,
+        map_fn=_prefetch_map_fn(),
+    )
+
+
+def crop_regions(img: Image.Image | np.ndarray, boxes: list[Box]) -> list[Crop]:
+    """Crop các box khỏi ảnh trang dưới dạng view NumPy (không copy pixel; giữ tham chiếu tới mảng
+    trang)."""
+    arr = to_rgb_array(img)
+    return [_crop(arr, b) for b in boxes]
+
+
+def recognize_pages(
+    items: list[tuple[list[Crop], list[int] | None]],
+) -> list[list[tuple[str, float]]]:
+    """Recognize nhiều trang trong một lần gọi: crop (và strip) của mọi trang được gom chung một
+    hàng đợi batch, kết quả trả về theo từng trang. items: (crops, original_heights) mỗi trang."""
     model = get_vietocr_model()
-    crops = [_crop(img, b) for b in boxes]
-    return vietocr_predict_batch(model, crops, original_heights=original_heights)
\ No newline at end of file
+    crops: list[Crop] = []
+    heights: list[int | None] = []
+    counts: list[int] = []
+    for page_crops, original_heights in items:
+        crops.extend(page_crops)
+        if original_heights is not None:
+            heights.extend(original_heights)
+        else:
+            heights.extend([None] * len(page_crops))
+        counts.append(len(page_crops))
+    rec = vietocr_predict_batch(model, crops, original_heights=heights, map_fn=_prefetch_map_fn())
+    out = []
+    start = 0
+    for n in counts:
+        out.append(rec[start:start + n])
+        start += n
+    return out
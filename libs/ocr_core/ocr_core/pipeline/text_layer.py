@@ -0,0 +1,151 @@
+"""Lớp text của PDF born-digital (PyMuPDF get_text): trang có text dùng được thì lấy box + text
+thẳng từ PDF, không chạy CRAFT/VietOCR; chỉ trang scan / chỉ có ảnh mới đi qua model.
+
+Trang được coi là có lớp text dùng được khi:
+- có ít nhất min_chars ký tự (không tính khoảng trắng);
+- tỉ lệ ký tự lỗi (U+FFFD, ký tự điều khiển, vùng Private Use — font thiếu ToUnicode) <=
+  max_garbled;
+- ảnh nhúng không phủ quá max_image_coverage diện tích trang (trang scan có lớp text OCR ẩn/header
+  chèn thêm vẫn OCR lại bằng model).
+
+Tọa độ theo hệ tham chiếu của detect_result (render ở rasterize.dpi), khớp box CRAFT.
+
+Cấu hình (infra/system_config.yml):
+  text_layer:
+    enabled: true              # env OCR_TEXT_LAYER=0 để luôn OCR bằng model
+    min_chars: 16              # env OCR_TEXT_LAYER_MIN_CHARS
+    max_garbled: 0.05
+    max_image_coverage: 0.6
+"""
+from __future__ import annotations
+
+import logging
+import math
+import unicodedata
+from typing import NamedTuple
+
+from ocr_core.config_loader import get_system_config
+
+logger = logging.getLogger(__name__)
+
+MIN_CHARS = 16
+MAX_GARBLED = 0.05
+MAX_IMAGE_COVERAGE = 0.6
+# Từ thuộc box khi ít nhất tỉ lệ này diện tích từ nằm trong box
+WORD_IN_BOX = 0.5
+
+Box = tuple[int, int, int, int]
+
+
+class TextWord(NamedTuple):
+    box: Box
+    text: str
+    block: int
+    line: int
+
+
+class PageTextLayer(NamedTuple):
+    """Lớp text một trang: từ (thứ tự đọc PyMuPDF) và dòng (box + text) — dòng là box detect của
+    trang."""
+
+    words: list[TextWord]
+    lines: list[tuple[Box, str]]
+
+    def text_in_box(self, box: Box) -> str | None:
+        """Text các từ nằm trong box (dòng nối "\\n", từ nối " " — như VietOCR ghép strip); None nếu
+        không có từ nào (box vẽ thêm lên vùng ảnh → nhận dạng bằng model)."""
+        x1, y1, x2, y2 = box
+        lines: dict[tuple[int, int], list[str]] = {}
+        for w in self.words:
+            wx1, wy1, wx2, wy2 = w.box
+            iw = min(x2, wx2) - max(x1, wx1)
+            ih = min(y2, wy2) - max(y1, wy1)
+            if iw <= 0 or ih <= 0:
+                continue
+            area = max(1, (wx2 - wx1) * (wy2 - wy1))
+            if iw * ih >= WORD_IN_BOX * area:
+                lines.setdefault((w.block, w.line), []).append(w.text)
+        if not lines:
+            return None
+        return "\n".join(" ".join(words) for words in lines.values())
+
+
+def _garbled_ratio(text: str) -> float:
+    chars = [c for c in text if not c.isspace()]
+    if not chars:
+        return 1.0
+    bad = sum(c == "\ufffd" or unicodedata.category(c) in ("Cc", "Co", "Cs") for c in chars)
+    return bad / len(chars)
+
+
+def _image_coverage(page) -> float:
+    """Tỉ lệ diện tích trang bị ảnh nhúng phủ (lớn nhất một ảnh — tránh cộng trùng ảnh chồng
+    nhau)."""
+    rect = page.rect
+    page_area = max(rect.width * rect.height, 1e-6)
+    best = 0.0
+    for info in page.get_image_info():
+        x0, y0, x1, y1 = info["bbox"]
+        w = min(x1, rect.x1) - max(x0, rect.x0)
+        h = min(y1, rect.y1) - max(y0, rect.y0)
+        if w > 0 and h > 0:
+            best = max(best, w * h / page_area)
+    return best
+
+
+def extract_text_layer(page, dpi: int) -> PageTextLayer | None:
+    """Lớp text của trang fitz theo tọa độ render dpi; None nếu tắt hoặc trang không có text dùng
+    được."""
+    cfg = get_system_config().text_layer
+    if not cfg.enabled:
+        return None
+    raw_words = page.get_text("words", sort=True)
+    text = "".join(w[4] for w in raw_words)
+    n_chars = sum(not c.isspace() for c in text)
+    if n_chars < (cfg.min_chars or MIN_CHARS):
+        return None
+    max_garbled = MAX_GARBLED if cfg.max_garbled is None else cfg.max_garbled
+    if _garbled_ratio(text) > max_garbled:
+        logger.info("[OCR Pipeline] Trang %s: lớp text lỗi font (không ToUnicode), OCR bằng model",
+                    page.number)
+        return None
+    max_cover = MAX_IMAGE_COVERAGE if cfg.max_image_coverage is None else cfg.max_image_coverage
+    if _image_coverage(page) > max_cover:
+        return None
+
+    import fitz
+
+    scale = dpi / 72.0
+    rect = page.rect
+    w_ref = int(round(rect.width * scale))
+    h_ref = int(round(rect.height * scale))
+    # Tọa độ get_text theo trang chưa xoay; ảnh render đã áp /Rotate
+    rotate = page.rotation_matrix if page.rotation else None
+
+    def to_ref(x0: float, y0: float, x1: float, y1: float) -> Box:
+        r = fitz.Rect(x0, y0, x1, y1)
+        if rotate is not None:
+            r = r * rotate
+        return (
+            max(0, min(w_ref, int(r.x0 * scale))),
+            max(0, min(h_ref, int(r.y0 * scale))),
+            max(0, min(w_ref, math.ceil(r.x1 * scale))),
+            max(0, min(h_ref, math.ceil(r.y1 * scale))),
+        )
+
+    words: list[TextWord] = []
+    line_boxes: dict[tuple[int, int], list] = {}
+    for x0, y0, x1, y1, word, block_no, line_no, _ in raw_words:
+        box = to_ref(x0, y0, x1, y1)
+        if box[2] <= box[0] or box[3] <= box[1]:
+            continue
+        words.append(TextWord(box, word, block_no, line_no))
+        entry = line_boxes.setdefault((block_no, line_no), [list(box), []])
+        b = entry[0]
+        b[0], b[1] = min(b[0], box[0]), min(b[1], box[1])
+        b[2], b[3] = max(b[2], box[2]), max(b[3], box[3])
+        entry[1].append(word)
+    if not words:
+        return None
+    lines = [(tuple(b), " ".join(ws)) for b, ws in line_boxes.values()]
+    return PageTextLayer(words, lines)